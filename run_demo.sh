@@ -89,8 +89,8 @@ fi
 
 # Step 7: Setup IP management tool
 print_step "Step 7: Setting up IP management tool..."
-docker cp scripts/ip_manager_demo.py xdp_host:/xdp/ || {
-    print_error "Error copying ip_manager_demo.py"
+docker exec xdp_host test -f /xdp/ip_manager_demo.py || {
+    print_error "ip_manager_demo.py not found in /xdp"
     exit 1
 }
 print_success "IP management tool configured"
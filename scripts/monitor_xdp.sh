@@ -1,7 +1,13 @@
 #!/bin/bash
 
-echo "XDP Monitor - Messages and Statistics"
-echo "====================================="
+# Live counters instead: pps, drop ratio and top dropped sources
+if [ "$1" = "--top" ]; then
+    shift
+    exec docker exec -it xdp_host python3 /xdp/xdp_top.py "$@"
+fi
+
+echo "XDP Monitor - Drop Events"
+echo "========================="
 
 # Function to cleanup on exit
 cleanup() {
@@ -11,29 +17,15 @@ cleanup() {
 }
 trap cleanup SIGINT SIGTERM
 
-echo "Starting kernel log monitoring..."
+echo "Starting drop event monitoring..."
 
-# Monitor trace_pipe in background
+# Stream drop events from the ring buffer in background
 docker exec xdp_host bash -c '
-mount -t debugfs debugfs /sys/kernel/debug 2>/dev/null || true
-echo > /sys/kernel/debug/tracing/trace 2>/dev/null || true
-
-echo "Monitoring XDP messages (press Ctrl+C to stop):"
-echo "================================================"
-
-# Function to show timestamp
-show_timestamp() {
-    echo -n "[$(date +"%H:%M:%S")] "
-}
+echo "Monitoring XDP drop events (press Ctrl+C to stop):"
+echo "==================================================="
 
-tail -f /sys/kernel/debug/tracing/trace_pipe | while read line; do
-    if [[ "$line" == *"Blocked"* ]] || [[ "$line" == *"xdp"* ]] || [[ "$line" == *"bpf"* ]]; then
-        show_timestamp
-        echo "BLOCKED: $line"
-    elif [[ "$line" == *"nc-"* ]] && [[ "$line" == *"8080"* ]]; then
-        show_timestamp 
-        echo "CONNECTION detected: $line"
-    fi
+python3 /xdp/drop_events.py --json | while read line; do
+    echo "[$(date +"%H:%M:%S")] BLOCKED: $line"
 done
 ' &
 
@@ -5,7 +5,6 @@ Shows information about processed traffic
 """
 
 import subprocess
-import time
 import json
 
 def run_command(cmd):
@@ -36,9 +35,9 @@ def check_xdp_status():
     
     return True
 
-def generate_traffic():
-    """Generate test traffic"""
-    print("\nGenerating test traffic...")
+def check_reachability():
+    """Check that allowed ports answer and blocked ports do not"""
+    print("\nChecking reachability...")
     print("-" * 40)
     
     # Allowed traffic (port 80)
@@ -52,48 +51,59 @@ def generate_traffic():
     cmd = "docker exec xdp_client timeout 2 nc -v 172.20.0.10 8080 2>&1 | head -1"
     output, _ = run_command(cmd)
     print(f"   {output}")
-    
-    # Multiple attempts to blocked port
-    print("Generating multiple attempts to port 8080:")
-    for i in range(3):
-        cmd = f"docker exec xdp_client timeout 1 nc 172.20.0.10 8080 2>/dev/null &"
-        run_command(cmd)
-        print(f"   Attempt {i+1}: Sent")
-        time.sleep(0.5)
 
-def check_trace_messages():
-    """Try to capture trace messages"""
-    print("\nTrying to capture XDP messages...")
+def generate_traffic():
+    """Measure the filter at packet rate with the veth traffic generator"""
+    print("\nGenerating test traffic (veth pair, 2 seconds per blocklist size)...")
     print("-" * 40)
     
-    # Setup trace
-    setup_cmd = """docker exec xdp_host bash -c '
-    mount -t debugfs debugfs /sys/kernel/debug 2>/dev/null || true
-    echo > /sys/kernel/debug/tracing/trace 2>/dev/null || true
-    '"""
-    run_command(setup_cmd)
+    cmd = ("docker exec xdp_host python3 /xdp/traffic_gen.py "
+           "--sizes 0,10000 --duration 2 --json 2>/dev/null")
+    output, code = run_command(cmd)
+    try:
+        results = json.loads(output)["results"]
+    except (ValueError, KeyError):
+        print("Traffic generator failed (needs clang, bpftool, numpy and pyroute2)")
+        return
+    
+    for result in results:
+        print(f"   blocklist {result['blocklist_size']:>7,}: "
+              f"{result['received_pps']:>12,.0f} pps received, "
+              f"{result['dropped_pps']:>12,.0f} pps dropped")
+
+def check_drop_events():
+    """Try to capture drop events"""
+    print("\nTrying to capture XDP drop events...")
+    print("-" * 40)
     
     # Generate traffic and capture
-    print("Generating traffic and capturing logs (5 seconds):")
+    print("Generating traffic and capturing events (3 seconds):")
     
     capture_cmd = """docker exec xdp_host bash -c '
     # Generate traffic in background  
-    (echo "test" | nc -w 1 172.20.0.10 8080 2>/dev/null &) &
+    (sleep 0.5; echo "test" | nc -w 1 172.20.0.10 8080 2>/dev/null &) &
     
-    # Capture logs
-    timeout 3 cat /sys/kernel/debug/tracing/trace_pipe | grep -E "(Blocked|xdp|bpf)" | head -5
+    # Capture events
+    python3 /xdp/drop_events.py --json --duration 3 | head -5
     ' 2>/dev/null"""
     
     output, code = run_command(capture_cmd)
     
     if output:
-        print("Messages captured:")
+        print("Events captured:")
         for line in output.split('\n'):
-            if line.strip():
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
                 print(f"   {line}")
+                continue
+            print(f"   {event['reason']}: {event['protocol']} {event['src_ip']} "
+                  f"-> port {event['dst_port']}")
     else:
-        print("No specific messages captured")
-        print("   This is normal - XDP may be working silently")
+        print("No drop events captured")
+        print("   Connections from this host do not pass through eth0 ingress")
 
 def main():
     """Main function"""
@@ -104,11 +114,14 @@ def main():
     if not check_xdp_status():
         return
     
+    # Check allowed and blocked ports
+    check_reachability()
+    
     # Generate traffic
     generate_traffic()
     
-    # Try to capture messages
-    check_trace_messages()
+    # Try to capture drop events
+    check_drop_events()
     
     print("\nOperation Summary")
     print("-" * 40)
@@ -116,7 +129,8 @@ def main():
     print("Port 8080: Timeout/Block        (XDP_DROP)")
     print("Port 9090: Successful connection (XDP_PASS)")
     print("\nTimeout on port 8080 confirms XDP is blocking correctly")
-    print("bpf_printk() messages may require additional kernel configuration")
+    print("Drop events stream live with: python3 /xdp/drop_events.py")
+    print("Live rates and top dropped sources: docker exec -it xdp_host python3 /xdp/xdp_top.py")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for xdp_filter_func
+Loads a private copy of the filter, fills blocked_ips to each requested
+size and times synthetic packets through BPF_PROG_TEST_RUN
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import platform
+import statistics
+
+import bpf_syscall
+from map_backends import run_command
+from ip_manager import BLOCKED_VALUE, PORT_PROTOCOLS, PORT_WORDS
+
+BUILD_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_OBJECT = "xdp_filter_bench.o"
+# Kept apart from /sys/fs/bpf/xdp_filter so a running filter is untouched
+BENCH_PIN_DIR = "/sys/fs/bpf/xdp_bench"
+
+DEFAULT_SIZES = [10, 1000, 10000, 100000, 1000000]
+DEFAULT_REPEAT = 100000
+DEFAULT_ROUNDS = 5
+
+XDP_VERDICTS = {0: "aborted", 1: "drop", 2: "pass", 3: "tx", 4: "redirect"}
+
+# Blocklist entries are drawn from 10.0.0.0/8, allowed sources from elsewhere
+BLOCKED_BASE = 0x0A000000
+BLOCKED_SRC = "10.0.0.1"
+ALLOWED_SRC = "172.20.0.20"
+DST_IP = "172.20.0.10"
+ALLOWED_SRC6 = "2001:db8::20"
+DST_IP6 = "2001:db8::10"
+BLOCKED_PORT = 8080
+MIN_FRAME = 64
+
+def ethernet(ethertype, payload):
+    """Frame payload behind an Ethernet header, padded to the minimum size"""
+    frame = b"\x02\x00\x00\x00\x00\x01" + b"\x02\x00\x00\x00\x00\x02"
+    frame += struct.pack("!H", ethertype) + payload
+    return frame.ljust(MIN_FRAME, b"\0")
+
+def tcp_syn(dport):
+    return struct.pack("!HHIIBBHHH", 40000, dport, 0, 0, 5 << 4, 0x02, 65535, 0, 0)
+
+def ipv4_tcp(src, dport):
+    segment = tcp_syn(dport)
+    header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(segment), 0, 0, 64,
+                         socket.IPPROTO_TCP, 0, socket.inet_aton(src), socket.inet_aton(DST_IP))
+    return ethernet(0x0800, header + segment)
+
+def ipv6_tcp(src, dport):
+    segment = tcp_syn(dport)
+    header = struct.pack("!IHBB16s16s", 0x60000000, len(segment), socket.IPPROTO_TCP, 64,
+                         socket.inet_pton(socket.AF_INET6, src),
+                         socket.inet_pton(socket.AF_INET6, DST_IP6))
+    return ethernet(0x86DD, header + segment)
+
+def arp_request():
+    return ethernet(0x0806, struct.pack("!HHBBH", 1, 0x0800, 6, 4, 1) + b"\0" * 20)
+
+# Packet mix: name -> (frame, expected verdict)
+PACKETS = {
+    "blocked": (ipv4_tcp(BLOCKED_SRC, 80), "drop"),
+    "allowed": (ipv4_tcp(ALLOWED_SRC, 80), "pass"),
+    "tcp_8080": (ipv4_tcp(ALLOWED_SRC, BLOCKED_PORT), "drop"),
+    "non_ip": (arp_request(), "pass"),
+    "ipv6": (ipv6_tcp(ALLOWED_SRC6, 80), "pass"),
+}
+
+def build_object(capacity):
+    """Compile the benchmark object with blocked_ips sized for capacity"""
+    _, stderr, code = run_command(f"make -C {BUILD_DIR} -B -s {BENCH_OBJECT} "
+                                  f"BPF_CFLAGS=-DMAX_BLOCKED_IPS={capacity}")
+    if code != 0:
+        print(f"Error: could not build {BENCH_OBJECT}: {stderr}")
+        return False
+    return True
+
+def clear_pins():
+    if not os.path.isdir(BENCH_PIN_DIR):
+        return
+    for name in os.listdir(BENCH_PIN_DIR):
+        os.remove(os.path.join(BENCH_PIN_DIR, name))
+    os.rmdir(BENCH_PIN_DIR)
+
+def load_object():
+    """Load the benchmark object with its maps pinned in BENCH_PIN_DIR.
+
+    Returns (prog_fd, maps) with maps opened by name, or None on failure.
+    """
+    clear_pins()
+    os.makedirs(BENCH_PIN_DIR)
+    prog_pin = os.path.join(BENCH_PIN_DIR, "xdp_prog")
+    _, stderr, code = run_command(f"bpftool prog load {os.path.join(BUILD_DIR, BENCH_OBJECT)} "
+                                  f"{prog_pin} type xdp pinmaps {BENCH_PIN_DIR}")
+    if code != 0:
+        print(f"Error: could not load {BENCH_OBJECT}: {stderr}")
+        return None
+
+    maps = {}
+    for name in os.listdir(BENCH_PIN_DIR):
+        if name != "xdp_prog":
+            maps[name] = bpf_syscall.BPFMap.open_pinned(os.path.join(BENCH_PIN_DIR, name))
+    return bpf_syscall.obj_get(prog_pin), maps
+
+def blocked_keys(size):
+    """size distinct blocked_ips keys, starting with BLOCKED_SRC"""
+    return [struct.pack("!I", BLOCKED_BASE + 1 + i) for i in range(size)]
+
+def fill_blocklist(blocked_ips, size, current):
+    """Grow or shrink blocked_ips from current to size entries"""
+    keys = blocked_keys(max(size, current))
+    if size > current:
+        blocked_ips.update_batch(keys[current:size], [BLOCKED_VALUE] * (size - current))
+    elif size < current:
+        blocked_ips.delete_batch(keys[size:current])
+
+def block_port(port_bitmap, port):
+    key = struct.pack("=I", PORT_PROTOCOLS["tcp"] * PORT_WORDS + (port >> 6))
+    port_bitmap.update(key, struct.pack("=Q", 1 << (port & 63)))
+
+def time_packet(prog_fd, frame, repeat, rounds):
+    """Median kernel-measured ns/packet over rounds, plus the verdict"""
+    durations = []
+    verdict = None
+    for _ in range(rounds):
+        verdict, duration = bpf_syscall.prog_test_run(prog_fd, frame, repeat)
+        durations.append(duration)
+    return statistics.median(durations), XDP_VERDICTS.get(verdict, str(verdict))
+
+def run_size(prog_fd, size, mix, repeat, rounds):
+    """Benchmark every packet in mix against a blocklist of size entries"""
+    packets = {}
+    verdicts = {}
+    for name in mix:
+        frame, expected = PACKETS[name]
+        ns, verdict = time_packet(prog_fd, frame, repeat, rounds)
+        packets[name] = {"ns_per_packet": ns, "verdict": verdict, "expected": expected}
+        verdicts[verdict] = verdicts.get(verdict, 0) + 1
+    return {
+        "blocklist_size": size,
+        "mix_ns_per_packet": statistics.mean(p["ns_per_packet"] for p in packets.values()),
+        "verdicts": verdicts,
+        "packets": packets,
+    }
+
+def run_metadata(**settings):
+    """Commit and machine details to tag results with, plus the run settings"""
+    commit, _, code = run_command(f"git -C {BUILD_DIR} rev-parse --short HEAD")
+    return {
+        "commit": commit if code == 0 else None,
+        "kernel": platform.release(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "timestamp": int(time.time()),
+        **settings,
+    }
+
+def print_results(results):
+    mix = list(results[0]["packets"]) if results else []
+    print(f"{'Blocklist':>10}  " + "  ".join(f"{name:>10}" for name in mix) + f"  {'mix':>8}")
+    for result in results:
+        cells = [f"{result['packets'][name]['ns_per_packet']:>8.0f}ns" for name in mix]
+        print(f"{result['blocklist_size']:>10,}  " + "  ".join(cells)
+              + f"  {result['mix_ns_per_packet']:>6.0f}ns")
+
+    mismatches = [(result["blocklist_size"], name, packet["verdict"], packet["expected"])
+                  for result in results for name, packet in result["packets"].items()
+                  if packet["verdict"] != packet["expected"]]
+    for size, name, verdict, expected in mismatches:
+        print(f"Warning: {name} got {verdict}, expected {expected} (blocklist {size:,})")
+
+def print_usage():
+    print("Usage: python3 bench.py [--sizes N,N,...] [--repeat N] [--rounds N] "
+          "[--mix NAME,...] [--json]")
+    print("")
+    print(f"  --sizes N,...   Blocklist sizes to measure (default: {','.join(map(str, DEFAULT_SIZES))})")
+    print(f"  --repeat N      Runs per BPF_PROG_TEST_RUN call (default: {DEFAULT_REPEAT})")
+    print(f"  --rounds N      Calls per packet, the median is reported (default: {DEFAULT_ROUNDS})")
+    print(f"  --mix NAME,...  Packets to send (default: {','.join(PACKETS)})")
+    print("  --json          Print results as one JSON document")
+
+def main():
+    sizes = DEFAULT_SIZES
+    repeat = DEFAULT_REPEAT
+    rounds = DEFAULT_ROUNDS
+    mix = list(PACKETS)
+    as_json = False
+
+    args = sys.argv[1:]
+    try:
+        while args:
+            if args[0] == "--json":
+                as_json = True
+                args = args[1:]
+                continue
+            if args[0] == "--sizes" and len(args) > 1:
+                sizes = sorted(int(size) for size in args[1].split(","))
+            elif args[0] == "--repeat" and len(args) > 1:
+                repeat = int(args[1])
+            elif args[0] == "--rounds" and len(args) > 1:
+                rounds = int(args[1])
+            elif args[0] == "--mix" and len(args) > 1:
+                mix = args[1].split(",")
+            else:
+                raise ValueError(args[0])
+            args = args[2:]
+    except ValueError:
+        print_usage()
+        sys.exit(1)
+    if not sizes or sizes[0] < 1 or repeat < 1 or rounds < 1 or not set(mix) <= set(PACKETS):
+        print_usage()
+        sys.exit(1)
+
+    if not build_object(sizes[-1]):
+        sys.exit(1)
+    loaded = load_object()
+    if not loaded:
+        clear_pins()
+        sys.exit(1)
+    prog_fd, maps = loaded
+
+    results = []
+    try:
+        block_port(maps["port_bitmap"], BLOCKED_PORT)
+        current = 0
+        for size in sizes:
+            if not as_json:
+                print(f"Filling blocked_ips with {size:,} entries...", file=sys.stderr)
+            fill_blocklist(maps["blocked_ips"], size, current)
+            current = size
+            results.append(run_size(prog_fd, size, mix, repeat, rounds))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(prog_fd)
+        for bpf_map in maps.values():
+            bpf_map.close()
+        clear_pins()
+
+    if as_json:
+        print(json.dumps({"meta": run_metadata(repeat=repeat, rounds=rounds), "results": results}, indent=2))
+    else:
+        print_results(results)
+
+if __name__ == "__main__":
+    main()
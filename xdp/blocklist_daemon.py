@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""
+Resident blocklist daemon for XDP
+Keeps the BPF map handles open and serves JSON-lines requests on a Unix
+socket, coalescing concurrent writes into batched map updates
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import queue
+import socket
+import signal
+import threading
+import socketserver
+
+from ip_manager import (XDPIPManager, BLOCKED_VALUE, HOST_MAPS, RANGE_MAPS, parse_networks,
+                        expiry_value, value_expiry)
+
+SOCKET_PATH = "/run/xdp_blocklist.sock"
+
+# Upper bound on keys written in one coalesced batch
+MAX_BATCH_KEYS = 65536
+
+# Requests that go through the coalescing writer
+WRITE_OPS = ("add", "remove")
+
+# Expiries are collected this long after the first one is due, so blocks
+# expiring close together leave in one batched delete. The program already
+# ignores expired entries, so deleting late never lets traffic through early.
+EXPIRY_SLACK = 0.5
+
+# Counting a blocklist map walks it, so occupancy is checked off the writer
+# thread after adds, at most this often (seconds)
+CAPACITY_CHECK_INTERVAL = 10.0
+
+def parse_request(line):
+    """Decode one JSON-lines request, raising ValueError unless it is an object"""
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("request must be a JSON object")
+    return request
+
+def request_ips(request):
+    """Return the IPs named by the "ips" list or the single "ip" of a request"""
+    if "ips" in request:
+        ips = request["ips"]
+        if not isinstance(ips, list) or not all(isinstance(ip, str) for ip in ips):
+            raise ValueError("ips must be a list of strings")
+        return list(ips)
+    if "ip" in request:
+        if not isinstance(request["ip"], str):
+            raise ValueError("ip must be a string")
+        return [request["ip"]]
+    return []
+
+class PendingWrite:
+    """A write request waiting for the writer thread"""
+
+    def __init__(self, op, ips, keys, results, value=BLOCKED_VALUE):
+        self.op = op
+        self.ips = ips
+        self.keys = keys
+        self.results = results
+        self.value = value
+        self.done = threading.Event()
+
+    def wait(self):
+        """Block until the write is applied and return the response object"""
+        self.done.wait()
+        return {"ok": True, "results": [[ip, *self.results[ip]] for ip in self.ips]}
+
+class PendingNetworkWrite(PendingWrite):
+    """A CIDR write, applied through the aggregating network path"""
+
+    def __init__(self, op, networks):
+        super().__init__(op, [], networks, {})
+        self.report = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.report is None:
+            return {"ok": False, "error": self.error}
+        report = dict(self.report, failures=[[str(n), ok, error]
+                                            for n, ok, error in self.report["failures"]])
+        return {"ok": not report["failures"], "report": report}
+
+class PendingExpiry(PendingWrite):
+    """Blocks the scheduler found due, with the expiry each was popped for"""
+
+    def __init__(self, keys, expiries):
+        super().__init__("expire", [], keys, {})
+        self.expiries = expiries
+
+class ExpiryScheduler:
+    """Min-heap of blocked_ips expiries driving batched deletes.
+
+    The thread sleeps until the earliest expiry is due, then hands every
+    entry due by then to the writer as one delete. Re-added or removed
+    entries leave stale heap items behind; they are skipped when popped
+    because the current expiry of the key no longer matches.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.heap = []
+        self.expiries = {}
+        self.lock = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.expiries)
+
+    def track(self, entries):
+        """Schedule (key, expiry_ns) pairs; an expiry of 0 cancels the key"""
+        with self.lock:
+            earliest = self.heap[0][0] if self.heap else None
+            for key, expiry in entries:
+                if expiry:
+                    self.expiries[key] = expiry
+                    heapq.heappush(self.heap, (expiry, key))
+                else:
+                    self.expiries.pop(key, None)
+            self._compact()
+            if self.heap and self.heap[0][0] != earliest:
+                self.lock.notify()
+
+    def forget(self, keys):
+        """Stop tracking keys that were removed"""
+        with self.lock:
+            for key in keys:
+                self.expiries.pop(key, None)
+            self._compact()
+
+    def is_current(self, key, expiry):
+        """True if key is still scheduled to expire at expiry"""
+        with self.lock:
+            return self.expiries.get(key) == expiry
+
+    def _compact(self):
+        # Rebuild once stale items outnumber live ones, keeping pops O(log n)
+        if len(self.heap) > 2 * len(self.expiries) + 1024:
+            self.heap = [(expiry, key) for key, expiry in self.expiries.items()]
+            heapq.heapify(self.heap)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.heap:
+                    self.lock.wait()
+                delay = (self.heap[0][0] - time.monotonic_ns()) / 1e9
+                if delay > 0:
+                    self.lock.wait(delay + EXPIRY_SLACK)
+                    continue
+
+                now = time.monotonic_ns()
+                keys, expiries = [], []
+                while self.heap and self.heap[0][0] <= now:
+                    expiry, key = heapq.heappop(self.heap)
+                    if self.expiries.get(key) == expiry:
+                        keys.append(key)
+                        expiries.append(expiry)
+            if keys:
+                self.service.writes.put(PendingExpiry(keys, expiries))
+
+class Completed:
+    """A response that is already available"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def wait(self):
+        return self.response
+
+class BlocklistService:
+    """Map operations behind the socket API.
+
+    Reads are served directly from the map handles the writer uses, under
+    manager_lock: the writer replaces them when a new generation is
+    published, and demo maps are not safe to share between threads. Writes
+    are queued to a single writer thread that merges everything pending
+    into one batched update or delete per run of same-kind requests.
+    """
+
+    def __init__(self, backend="auto"):
+        self.manager = XDPIPManager(backend)
+        self.manager_lock = threading.Lock()
+        # The capacity check walks the maps through its own handles, so it
+        # needs no manager_lock and never holds up the writer
+        self.capacity_manager = XDPIPManager(backend)
+        self.capacity_manager.backend = self.manager.backend
+        self.writes = queue.Queue()
+        self.counters = {"requests": 0, "writes": 0, "batches": 0, "keys_written": 0,
+                         "expired": 0}
+        self.counters_lock = threading.Lock()
+        self.capacity_due = threading.Event()
+        self.expiry = ExpiryScheduler(self)
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer.start()
+        self.capacity_checker = threading.Thread(target=self._capacity_loop, daemon=True)
+        self.capacity_checker.start()
+
+    def load_expiries(self):
+        """Schedule the expiring blocks already in the map, e.g. after a restart"""
+        with self.manager_lock:
+            self.blocked_ips()
+            entries = [(key, value_expiry(value)) for name in HOST_MAPS.values()
+                       if self.manager.find_map(name)
+                       for key, value in self.manager.find_map(name).items()]
+        self.expiry.track(entry for entry in entries if entry[1])
+        return sum(1 for _, expiry in entries if expiry)
+
+    def blocked_ips(self):
+        blocked_ips = self.manager.find_blocked_ips_map()
+        if not blocked_ips:
+            raise RuntimeError("blocked_ips map not found, make sure XDP program is loaded")
+        return blocked_ips
+
+    def _writer_loop(self):
+        while True:
+            pending = [self.writes.get()]
+            keys = len(pending[0].keys)
+            # Everything queued while the previous batch ran joins this one
+            while keys < MAX_BATCH_KEYS:
+                try:
+                    pending.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+                keys += len(pending[-1].keys)
+
+            start = 0
+            while start < len(pending):
+                end = start
+                while end < len(pending) and pending[end].op == pending[start].op:
+                    end += 1
+                try:
+                    with self.manager_lock:
+                        self._flush(pending[start:end])
+                except Exception as e:
+                    # Answer the clients instead of leaving them waiting on a dead thread
+                    print(f"Error applying writes: {e!r}", file=sys.stderr, flush=True)
+                    self._fail(pending[start:end], f"write failed: {e}")
+                start = end
+
+    def _fail(self, run, error):
+        """Complete every write of a run that the writer could not apply"""
+        for write in run:
+            if isinstance(write, PendingNetworkWrite):
+                write.report = None
+                write.error = error
+            else:
+                for ip in write.ips:
+                    write.results.setdefault(ip, (False, error))
+            write.done.set()
+
+    def count(self, name, amount=1):
+        with self.counters_lock:
+            self.counters[name] += amount
+
+    def _flush(self, run):
+        """Write a run of same-kind requests as one batch"""
+        if isinstance(run[0], PendingNetworkWrite):
+            self._flush_networks(run)
+            return
+        if isinstance(run[0], PendingExpiry):
+            self._flush_expiries(run)
+            return
+
+        keys = [key for write in run for key in write.keys]
+        try:
+            # Follow `ip_manager.py replace`, which publishes a new map
+            self.manager.refresh_blocklist()
+            self.blocked_ips()
+            if run[0].op == "add":
+                values = [write.value for write in run for _ in write.keys]
+                results = self.manager.write_hosts(keys, values)
+                self.expiry.track((key, value_expiry(value))
+                                  for key, value, (ok, _) in zip(keys, values, results) if ok)
+                self.capacity_due.set()
+            else:
+                results = self.manager.remove_hosts(keys)
+                self.expiry.forget(key for key, (ok, _) in zip(keys, results) if ok)
+        except (OSError, RuntimeError) as e:
+            results = [(False, str(e))] * len(keys)
+
+        self.count("batches")
+        self.count("keys_written", len(keys))
+        offset = 0
+        for write in run:
+            valid_ips = [ip for ip in write.ips if ip not in write.results]
+            for ip, result in zip(valid_ips, results[offset:offset + len(write.keys)]):
+                write.results[ip] = result
+            offset += len(write.keys)
+            write.done.set()
+
+    def _capacity_loop(self):
+        """Log high-water-mark warnings after adds, at most once per CAPACITY_CHECK_INTERVAL.
+
+        Runs on its own thread so walking the maps never holds up queued writes.
+        """
+        while True:
+            self.capacity_due.wait()
+            self.capacity_due.clear()
+            try:
+                self.capacity_manager.refresh_blocklist()
+                for warning in self.capacity_manager.capacity_warnings(list(HOST_MAPS.values())):
+                    print(f"Warning: {warning}", flush=True)
+            except Exception as e:
+                print(f"Error checking capacity: {e!r}", file=sys.stderr, flush=True)
+            time.sleep(CAPACITY_CHECK_INTERVAL)
+
+    def _flush_expiries(self, run):
+        """Delete the due blocks that still carry the expiry they were scheduled for"""
+        keys = []
+        self.manager.refresh_blocklist()
+        for write in run:
+            for key, expiry in zip(write.keys, write.expiries):
+                # The entry may have been re-added since, through this
+                # daemon or by a direct writer; only delete what expired
+                blocked_ips = self.manager.find_host_map(key)
+                value = blocked_ips.lookup(key) if blocked_ips else None
+                if value is not None and value_expiry(value) == expiry:
+                    keys.append(key)
+        results = self.manager.write_hosts(keys) if keys else []
+
+        self.expiry.forget(key for write in run for key, expiry in zip(write.keys, write.expiries)
+                           if self.expiry.is_current(key, expiry))
+        self.count("batches")
+        self.count("expired", sum(1 for ok, _ in results if ok))
+
+    def _flush_networks(self, run):
+        """Apply a run of CIDR writes as one aggregated update"""
+        networks = [network for write in run for network in write.keys]
+        try:
+            if run[0].op == "add_networks":
+                report = self.manager.update_networks(add=networks)
+                self.capacity_due.set()
+            else:
+                report = self.manager.update_networks(remove=networks)
+            error = None if report else "blocked_ips/blocked_cidrs maps not found"
+        except OSError as e:
+            report, error = None, str(e)
+
+        self.count("batches")
+        self.count("keys_written", report["inserted"] + report["deleted"] if report else 0)
+        for write in run:
+            write.report = report
+            write.error = error
+            write.done.set()
+
+    def submit(self, op, ips, ttl=None):
+        """Queue a write without waiting; returns a PendingWrite"""
+        if ttl is not None and (isinstance(ttl, bool) or not isinstance(ttl, (int, float))
+                                or ttl <= 0):
+            raise ValueError("ttl must be a positive number of seconds")
+        if any("/" in str(ip) for ip in ips):
+            networks, invalid = parse_networks(ips)
+            pending = PendingNetworkWrite(op + "_networks", networks)
+            if invalid:
+                pending.error = f"invalid IP address format: {', '.join(invalid)}"
+                pending.done.set()
+            elif ttl:
+                pending.error = "ttl applies to single IPs only, ranges are permanent"
+                pending.done.set()
+            else:
+                self.count("writes")
+                self.writes.put(pending)
+            return pending
+
+        results = {}
+        keys = []
+        for ip in ips:
+            try:
+                keys.append(self.manager.ip_to_key(ip))
+            except (OSError, TypeError, ValueError):
+                results[ip] = (False, "invalid IP address format")
+
+        pending = PendingWrite(op, ips, keys, results, expiry_value(ttl))
+        if keys:
+            self.count("writes")
+            self.writes.put(pending)
+        else:
+            pending.done.set()
+        return pending
+
+    def handle(self, request):
+        """Execute one decoded request and return the response object"""
+        op = request.get("op")
+        ips = request_ips(request)
+
+        if op in WRITE_OPS:
+            return self.submit(op, ips, request.get("ttl")).wait()
+
+        if op == "check":
+            with self.manager_lock:
+                self.blocked_ips()
+                return {"ok": True, "results": [[ip, bool(self.manager.is_blocked(ip))]
+                                                for ip in ips]}
+
+        if op == "list":
+            with self.manager_lock:
+                self.blocked_ips()
+                networks = self.manager.get_blocked_ranges()
+                entries = [(self.manager.key_to_ip(key), value_expiry(value))
+                           for name in HOST_MAPS.values() if self.manager.find_map(name)
+                           for key, value in self.manager.find_map(name).items()]
+            now = time.monotonic_ns()
+            return {"ok": True,
+                    "ips": [ip for ip, _ in entries],
+                    "ttls": {ip: (expiry - now) / 1e9 for ip, expiry in entries if expiry},
+                    "networks": [str(network) for network in networks]}
+
+        if op == "clear":
+            # Removing both default routes empties every blocked_* map
+            with self.manager_lock:
+                ipv6 = self.manager.find_map(HOST_MAPS[6]) is not None
+            everything = ["0.0.0.0/0"] + (["::/0"] if ipv6 else [])
+            response = self.submit("remove", everything).wait()
+            if "report" not in response:
+                return response
+            report = response["report"]
+            return {"ok": response["ok"], "total": report["deleted"],
+                    "cleared": report["deleted"] - len(report["failures"])}
+
+        if op == "stats":
+            return {"ok": True, "stats": self.stats()}
+
+        return {"ok": False, "error": f"unknown op '{op}'"}
+
+    def stats(self):
+        """Packet counters, blocklist size and daemon counters"""
+        with self.manager_lock:
+            stats = {"blocked_ips": self.blocked_ips().count(),
+                     "blocked_cidrs": self.manager._count("blocked_cidrs"),
+                     "blocked_ips6": self.manager._count(HOST_MAPS[6]),
+                     "blocked_cidrs6": self.manager._count(RANGE_MAPS[6]),
+                     "backend": self.manager.backend.name,
+                     "pending_expiries": len(self.expiry),
+                     "capacity": {name: max_entries for name, (_, max_entries)
+                                  in self.manager.get_occupancy().items()}}
+            packets = self.manager.get_stats()
+        with self.counters_lock:
+            stats.update(self.counters)
+
+        if packets:
+            for name, per_cpu in packets.items():
+                stats[f"{name}_packets"] = sum(per_cpu)
+                stats[f"{name}_packets_per_cpu"] = per_cpu
+        return stats
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """One client connection: a stream of JSON-lines requests, answered in order.
+
+    Writes are queued without waiting, so a pipelined burst from one client
+    joins a single batch. Other requests first wait for this connection's
+    earlier writes, so they always observe them.
+    """
+
+    def handle(self):
+        service = self.server.service
+        responses = queue.Queue()
+        sender = threading.Thread(target=self._send_responses, args=(responses,))
+        sender.start()
+
+        last_write = None
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                service.count("requests")
+                try:
+                    request = parse_request(line)
+                    if request.get("op") in WRITE_OPS:
+                        last_write = service.submit(request["op"], request_ips(request),
+                                                    request.get("ttl"))
+                        responses.put(last_write)
+                        continue
+                    if last_write:
+                        last_write.done.wait()
+                    response = service.handle(request)
+                except (ValueError, OSError, RuntimeError) as e:
+                    response = {"ok": False, "error": str(e)}
+                responses.put(Completed(response))
+        finally:
+            responses.put(None)
+            sender.join()
+
+    def _send_responses(self, responses):
+        while True:
+            pending = responses.get()
+            if pending is None:
+                return
+            try:
+                self.wfile.write(json.dumps(pending.wait()).encode() + b"\n")
+                self.wfile.flush()
+            except OSError:
+                # Client went away; keep draining so the handler can finish
+                continue
+
+class BlocklistServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        self.service = service
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, RequestHandler)
+        os.chmod(path, 0o600)
+
+class DaemonClient:
+    """Client side of the daemon socket API"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+
+    @classmethod
+    def connect(cls, path=SOCKET_PATH):
+        """Connect to a running daemon, or return None if there is none"""
+        if not os.path.exists(path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock)
+
+    def pipeline(self, requests):
+        """Send every request before reading the responses back in order"""
+        self.sock.sendall(b"".join(json.dumps(r).encode() + b"\n" for r in requests))
+        return [json.loads(self.rfile.readline()) for _ in requests]
+
+    def request(self, op, **args):
+        """Send one request and return its response"""
+        return self.pipeline([dict(op=op, **args)])[0]
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+def main():
+    path = SOCKET_PATH
+    backend = "auto"
+    args = sys.argv[1:]
+    while args:
+        if args[0] == "--socket" and len(args) > 1:
+            path = args[1]
+        elif args[0] == "--backend" and len(args) > 1:
+            backend = args[1]
+        else:
+            print("Usage: python3 blocklist_daemon.py [--socket PATH] "
+                  "[--backend auto|syscall|bpftool]")
+            sys.exit(1)
+        args = args[2:]
+
+    service = BlocklistService(backend)
+    if not service.manager.find_blocked_ips_map():
+        print("Error: Could not find blocked_ips BPF map")
+        print("Make sure XDP program is loaded")
+        sys.exit(1)
+
+    scheduled = service.load_expiries()
+    server = BlocklistServer(path, service)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Blocklist daemon listening on {path} ({service.manager.backend.name} backend, "
+          f"{scheduled} expiring blocks scheduled)")
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        print("\nStopping...")
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
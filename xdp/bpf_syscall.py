@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Minimal ctypes wrapper around the bpf() system call
+Gives direct access to BPF maps without spawning bpftool
+"""
+
+import os
+import errno
+import ctypes
+import struct
+import platform
+
+# bpf() commands (include/uapi/linux/bpf.h)
+BPF_MAP_CREATE = 0
+BPF_MAP_LOOKUP_ELEM = 1
+BPF_MAP_UPDATE_ELEM = 2
+BPF_MAP_DELETE_ELEM = 3
+BPF_MAP_GET_NEXT_KEY = 4
+BPF_OBJ_PIN = 6
+BPF_OBJ_GET = 7
+BPF_PROG_TEST_RUN = 10
+BPF_PROG_GET_FD_BY_ID = 13
+BPF_MAP_GET_FD_BY_ID = 14
+BPF_OBJ_GET_INFO_BY_FD = 15
+BPF_MAP_LOOKUP_BATCH = 24
+BPF_MAP_UPDATE_BATCH = 26
+BPF_MAP_DELETE_BATCH = 27
+BPF_ENABLE_STATS = 32
+
+BPF_STATS_RUN_TIME = 0
+
+# Map types whose values are stored once per possible CPU
+BPF_MAP_TYPE_PERCPU_HASH = 5
+BPF_MAP_TYPE_PERCPU_ARRAY = 6
+BPF_MAP_TYPE_LRU_PERCPU_HASH = 10
+PERCPU_MAP_TYPES = (BPF_MAP_TYPE_PERCPU_HASH, BPF_MAP_TYPE_PERCPU_ARRAY,
+                    BPF_MAP_TYPE_LRU_PERCPU_HASH)
+
+# Update flags
+BPF_ANY = 0
+BPF_NOEXIST = 1
+BPF_EXIST = 2
+
+# Kernel-internal "operation not supported" returned for missing batch ops
+ENOTSUPP = 524
+
+SYS_BPF = {
+    "x86_64": 321,
+    "i386": 357,
+    "i686": 357,
+    "aarch64": 280,
+    "armv7l": 386,
+    "riscv64": 280,
+    "ppc64le": 361,
+    "s390x": 351,
+}
+
+BATCH_CHUNK = 4096
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.syscall.restype = ctypes.c_long
+
+def bpf(cmd, attr):
+    """Invoke bpf(cmd, attr) and return its result, raising OSError on failure"""
+    nr = SYS_BPF.get(platform.machine())
+    if nr is None:
+        raise OSError(errno.ENOSYS, f"bpf() syscall number unknown for {platform.machine()}")
+
+    ret = _libc.syscall(nr, cmd, ctypes.byref(attr), ctypes.sizeof(attr))
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+def _attr(*fields):
+    """Pack (format, value) pairs into a zeroed bpf_attr buffer"""
+    fmt = "=" + "".join(f for f, _ in fields)
+    buf = ctypes.create_string_buffer(128)
+    struct.pack_into(fmt, buf, 0, *(v for _, v in fields))
+    return buf
+
+def _addr(buf):
+    """Address of a ctypes buffer as passed in bpf_attr pointer fields"""
+    return ctypes.addressof(buf) if buf is not None else 0
+
+def possible_cpus():
+    """Number of possible CPUs, which sizes per-CPU map values"""
+    with open("/sys/devices/system/cpu/possible") as f:
+        ranges = f.read().strip()
+
+    count = 0
+    for part in ranges.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            count += int(end) - int(start) + 1
+        else:
+            count += 1
+    return count
+
+def map_create(map_type, key_size, value_size, max_entries, flags=0, name=""):
+    """Create a map and return its file descriptor"""
+    return bpf(BPF_MAP_CREATE, _attr(("I", map_type), ("I", key_size), ("I", value_size),
+                                     ("I", max_entries), ("I", flags), ("I", 0), ("I", 0),
+                                     ("16s", name.encode()[:15])))
+
+def obj_pin(fd, path):
+    """Pin a BPF object at path in bpffs"""
+    path_buf = ctypes.create_string_buffer(os.fsencode(path))
+    bpf(BPF_OBJ_PIN, _attr(("Q", _addr(path_buf)), ("I", fd), ("I", 0)))
+
+def obj_get(path):
+    """Open a pinned BPF object and return its file descriptor"""
+    path_buf = ctypes.create_string_buffer(os.fsencode(path))
+    return bpf(BPF_OBJ_GET, _attr(("Q", _addr(path_buf)), ("I", 0), ("I", 0)))
+
+def map_fd_by_id(map_id):
+    """Open a map by its kernel ID and return its file descriptor"""
+    return bpf(BPF_MAP_GET_FD_BY_ID, _attr(("I", int(map_id)), ("I", 0), ("I", 0)))
+
+def prog_fd_by_id(prog_id):
+    """Open a program by its kernel ID and return its file descriptor"""
+    return bpf(BPF_PROG_GET_FD_BY_ID, _attr(("I", int(prog_id)), ("I", 0), ("I", 0)))
+
+def obj_info(fd, size, info=None):
+    """Return the raw bpf_*_info structure of an object"""
+    info = ctypes.create_string_buffer(info or b"", size)
+    bpf(BPF_OBJ_GET_INFO_BY_FD, _attr(("I", fd), ("I", size), ("Q", _addr(info))))
+    return info.raw
+
+def prog_id(prog_fd):
+    """Return the kernel ID of a program"""
+    # struct bpf_prog_info: type at offset 0, id at 4
+    return struct.unpack_from("=I", obj_info(prog_fd, 8), 4)[0]
+
+def prog_test_run(prog_fd, data, repeat=1):
+    """Run a program on one packet with BPF_PROG_TEST_RUN.
+
+    Returns (retval, duration) where duration is the kernel-measured
+    average run time in nanoseconds over repeat runs.
+    """
+    data_buf = ctypes.create_string_buffer(bytes(data), len(data))
+    attr = _attr(("I", prog_fd), ("I", 0), ("I", len(data)), ("I", 0),
+                 ("Q", _addr(data_buf)), ("Q", 0), ("I", repeat), ("I", 0))
+    bpf(BPF_PROG_TEST_RUN, attr)
+    retval = struct.unpack_from("=I", attr, 4)[0]
+    duration = struct.unpack_from("=I", attr, 36)[0]
+    return retval, duration
+
+def prog_run_stats(prog_fd):
+    """Return (run_time_ns, run_cnt) of a program.
+
+    The kernel only accumulates these while run-time stats are enabled,
+    through kernel.bpf_stats_enabled or an enable_stats() descriptor.
+    """
+    # struct bpf_prog_info: run_time_ns at offset 192, run_cnt at 200
+    return struct.unpack_from("=QQ", obj_info(prog_fd, 208), 192)
+
+def enable_stats():
+    """Enable program run-time stats for as long as the returned fd is open"""
+    return bpf(BPF_ENABLE_STATS, _attr(("I", BPF_STATS_RUN_TIME)))
+
+def prog_map_ids(prog_fd):
+    """Return the IDs of the maps used by a program"""
+    # struct bpf_prog_info: nr_map_ids at offset 52, map_ids pointer at 56
+    nr_map_ids = struct.unpack_from("=I", obj_info(prog_fd, 64), 52)[0]
+    ids = (ctypes.c_uint32 * max(nr_map_ids, 1))()
+
+    request = bytearray(64)
+    struct.pack_into("=IQ", request, 52, nr_map_ids, ctypes.addressof(ids))
+    info = obj_info(prog_fd, 64, bytes(request))
+    nr_map_ids = min(nr_map_ids, struct.unpack_from("=I", info, 52)[0])
+    return list(ids[:nr_map_ids])
+
+class BPFMap:
+    """A BPF map opened by file descriptor.
+
+    Keys and values are raw bytes. For per-CPU maps a value holds one
+    8-byte aligned slot per possible CPU, exactly as the kernel returns it.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        info = obj_info(fd, 80)
+        (self.map_type, self.id, self.key_size, self.value_size,
+         self.max_entries, self.map_flags) = struct.unpack_from("=6I", info, 0)
+        self.name = info[24:40].split(b"\0")[0].decode()
+
+        self.percpu = self.map_type in PERCPU_MAP_TYPES
+        if self.percpu:
+            self.value_len = ((self.value_size + 7) // 8 * 8) * possible_cpus()
+        else:
+            self.value_len = self.value_size
+
+    @classmethod
+    def open_pinned(cls, path):
+        """Open a map pinned in bpffs"""
+        return cls(obj_get(path))
+
+    @classmethod
+    def open_id(cls, map_id):
+        """Open a map by its kernel ID"""
+        return cls(map_fd_by_id(map_id))
+
+    @classmethod
+    def create(cls, map_type, key_size, value_size, max_entries, flags=0, name=""):
+        """Create a new, unpinned map"""
+        return cls(map_create(map_type, key_size, value_size, max_entries, flags, name))
+
+    def close(self):
+        """Release the map file descriptor"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _elem(self, cmd, key, value=None, flags=0):
+        key_buf = ctypes.create_string_buffer(bytes(key), self.key_size)
+        return key_buf, bpf(cmd, _attr(("I", self.fd), ("I", 0),
+                                       ("Q", _addr(key_buf)),
+                                       ("Q", _addr(value)), ("Q", flags)))
+
+    def lookup(self, key):
+        """Return the value stored for key, or None if it is absent"""
+        value = ctypes.create_string_buffer(self.value_len)
+        try:
+            self._elem(BPF_MAP_LOOKUP_ELEM, key, value)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        return value.raw
+
+    def update(self, key, value, flags=BPF_ANY):
+        """Insert or replace a single element"""
+        value_buf = ctypes.create_string_buffer(bytes(value), self.value_len)
+        self._elem(BPF_MAP_UPDATE_ELEM, key, value_buf, flags)
+
+    def delete(self, key):
+        """Delete a single element"""
+        self._elem(BPF_MAP_DELETE_ELEM, key)
+
+    def keys(self):
+        """Iterate over the keys of the map with BPF_MAP_GET_NEXT_KEY"""
+        next_key = ctypes.create_string_buffer(self.key_size)
+        key = None
+        while True:
+            try:
+                bpf(BPF_MAP_GET_NEXT_KEY, _attr(("I", self.fd), ("I", 0),
+                                                ("Q", _addr(key)),
+                                                ("Q", _addr(next_key))))
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return
+                raise
+            key = ctypes.create_string_buffer(next_key.raw, self.key_size)
+            yield next_key.raw
+
+    def _batch(self, cmd, keys, values, count, in_batch=None, out_batch=None):
+        """Issue a batch command and return (processed, error)"""
+        attr = _attr(("Q", _addr(in_batch)), ("Q", _addr(out_batch)),
+                     ("Q", _addr(keys)), ("Q", _addr(values)),
+                     ("I", count), ("I", self.fd), ("Q", 0), ("Q", 0))
+        try:
+            bpf(cmd, attr)
+            error = None
+        except OSError as e:
+            error = e
+        processed = struct.unpack_from("=I", attr, 32)[0]
+        return processed, error
+
+    def _apply_batch(self, cmd, keys, values, single):
+        """Run a batched write, resuming after failed elements.
+
+        Returns one (ok, error) tuple per key. Maps without batch support
+        fall back to one syscall per element.
+        """
+        results = []
+        start = 0
+        while start < len(keys):
+            chunk = keys[start:start + BATCH_CHUNK]
+            key_buf = ctypes.create_string_buffer(b"".join(chunk), len(chunk) * self.key_size)
+            value_buf = None
+            if values is not None:
+                value_buf = ctypes.create_string_buffer(
+                    b"".join(values[start:start + BATCH_CHUNK]),
+                    len(chunk) * self.value_len)
+
+            done, error = self._batch(cmd, key_buf, value_buf, len(chunk))
+            if error is not None and error.errno in (errno.EINVAL, ENOTSUPP,
+                                                     errno.EOPNOTSUPP) and done == 0:
+                return results + self._apply_single(keys[start:], values and values[start:], single)
+
+            results.extend((True, "") for _ in range(done))
+            start += done
+            if error is not None:
+                results.append((False, error.strerror))
+                start += 1
+        return results
+
+    def _apply_single(self, keys, values, single):
+        results = []
+        for i, key in enumerate(keys):
+            try:
+                if values is None:
+                    single(key)
+                else:
+                    single(key, values[i])
+                results.append((True, ""))
+            except OSError as e:
+                results.append((False, e.strerror))
+        return results
+
+    def update_batch(self, keys, values, flags=BPF_ANY):
+        """Insert or replace many elements with BPF_MAP_UPDATE_BATCH.
+
+        The batch command takes no BPF_NOEXIST or BPF_EXIST, so writes with
+        those flags use one syscall per element instead.
+        """
+        values = [bytes(v).ljust(self.value_len, b"\0") for v in values]
+        single = lambda k, v: self.update(k, v, flags)
+        if flags != BPF_ANY:
+            return self._apply_single(list(keys), values, single)
+        return self._apply_batch(BPF_MAP_UPDATE_BATCH, list(keys), values, single)
+
+    def delete_batch(self, keys):
+        """Delete many elements with BPF_MAP_DELETE_BATCH"""
+        return self._apply_batch(BPF_MAP_DELETE_BATCH, list(keys), None, self.delete)
+
+    def items(self):
+        """Return every (key, value) pair, using BPF_MAP_LOOKUP_BATCH when available"""
+        return [item for batch in self.item_batches() for item in batch]
+
+    def item_batches(self):
+        """Yield the (key, value) pairs in lists of at most BATCH_CHUNK.
+
+        Only one chunk is held at a time, so large maps can be copied
+        without materializing them. Maps without batch lookup are walked
+        with one syscall per element.
+        """
+        ks, vl = self.key_size, self.value_len
+        try:
+            for done, key_data, value_data in self._lookup_chunks():
+                yield list(zip([key_data[i:i + ks] for i in range(0, done * ks, ks)],
+                               [value_data[i:i + vl] for i in range(0, done * vl, vl)]))
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, ENOTSUPP, errno.EOPNOTSUPP):
+                raise
+
+        batch = []
+        for key in self.keys():
+            value = self.lookup(key)
+            if value is not None:
+                batch.append((key, value))
+            if len(batch) == BATCH_CHUNK:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def count(self):
+        """Return the number of elements without keeping them in memory"""
+        try:
+            return sum(done for done, _, _ in self._lookup_chunks())
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, ENOTSUPP, errno.EOPNOTSUPP):
+                raise
+        return sum(1 for _ in self.keys())
+
+    def _lookup_chunks(self):
+        """Yield (count, keys, values) for each BPF_MAP_LOOKUP_BATCH call"""
+        count = min(max(self.max_entries, 1), BATCH_CHUNK)
+        # The batch token is a bucket index for hash maps and a key for arrays
+        token_size = max(self.key_size, 8)
+        in_batch = None
+        out_batch = ctypes.create_string_buffer(token_size)
+
+        while True:
+            keys = ctypes.create_string_buffer(count * self.key_size)
+            values = ctypes.create_string_buffer(count * self.value_len)
+            done, error = self._batch(BPF_MAP_LOOKUP_BATCH, keys, values, count,
+                                      in_batch, out_batch)
+            if error is not None and error.errno == errno.ENOSPC and done == 0:
+                # A single hash bucket holds more elements than fit in count
+                count *= 2
+                continue
+            if error is not None and error.errno != errno.ENOENT:
+                raise error
+
+            yield done, keys.raw, values.raw
+            if error is not None:
+                return
+            in_batch = ctypes.create_string_buffer(out_batch.raw, token_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
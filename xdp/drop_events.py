@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Drop event consumer for the XDP filter
+Reads sampled drop events from the drop_events ring buffer through a
+shared memory mapping and prints per-interval summaries
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import errno
+import select
+import socket
+import struct
+from collections import Counter
+
+from map_backends import get_backend
+from ip_manager import XDPIPManager
+
+# struct drop_event in xdp_filter.c
+EVENT_FORMAT = "=Q16sHBBB3x"
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+DROP_REASONS = {1: "blocked_ip", 2: "blocked_port", 3: "rate_limit"}
+PROTOCOLS = {1: "icmp", 6: "tcp", 17: "udp", 58: "icmpv6"}
+
+# Ring buffer record header: u32 length with flag bits, u32 page offset
+RINGBUF_BUSY_BIT = 1 << 31
+RINGBUF_DISCARD_BIT = 1 << 30
+RINGBUF_HDR_SIZE = 8
+
+class RingBuffer:
+    """Consumer side of a BPF_MAP_TYPE_RINGBUF map.
+
+    The kernel exposes the consumer position on a writable page, followed
+    by the producer position and the data area mapped twice in a row, so
+    a record that wraps around the end can be read as one slice.
+    """
+
+    def __init__(self, bpf_map):
+        self.map = bpf_map
+        self.size = bpf_map.max_entries
+        self.mask = self.size - 1
+        page = mmap.PAGESIZE
+        self.consumer = mmap.mmap(bpf_map.fd, page, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE, offset=0)
+        self.producer = mmap.mmap(bpf_map.fd, page + 2 * self.size, mmap.MAP_SHARED,
+                                  mmap.PROT_READ, offset=page)
+        self.data = memoryview(self.producer)[page:]
+        self.epoll = select.epoll()
+        self.epoll.register(bpf_map.fd, select.EPOLLIN)
+
+    def close(self):
+        self.epoll.close()
+        self.data.release()
+        self.producer.close()
+        self.consumer.close()
+        self.map.close()
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds for new records"""
+        try:
+            return bool(self.epoll.poll(timeout))
+        except InterruptedError:
+            return False
+
+    def consume(self):
+        """Return the payloads of every committed record and release them"""
+        records = []
+        consumer_pos = struct.unpack_from("=Q", self.consumer, 0)[0]
+        producer_pos = struct.unpack_from("=Q", self.producer, 0)[0]
+
+        while consumer_pos < producer_pos:
+            offset = consumer_pos & self.mask
+            length = struct.unpack_from("=I", self.data, offset)[0]
+            if length & RINGBUF_BUSY_BIT:
+                # Reserved but not yet submitted; later records wait behind it
+                break
+            size = length & ~(RINGBUF_BUSY_BIT | RINGBUF_DISCARD_BIT)
+            if not length & RINGBUF_DISCARD_BIT:
+                start = offset + RINGBUF_HDR_SIZE
+                records.append(bytes(self.data[start:start + size]))
+            consumer_pos += (size + RINGBUF_HDR_SIZE + 7) // 8 * 8
+
+        # One position update for the whole batch frees the space
+        struct.pack_into("=Q", self.consumer, 0, consumer_pos)
+        return records
+
+def decode_event(record):
+    """Unpack a drop_event record into a dict"""
+    timestamp, src_addr, dst_port, protocol, reason, family = struct.unpack_from(EVENT_FORMAT, record)
+    if family == 6:
+        src_ip = socket.inet_ntop(socket.AF_INET6, src_addr)
+    else:
+        src_ip = socket.inet_ntoa(src_addr[:4])
+    return {
+        "timestamp": timestamp,
+        "src_ip": src_ip,
+        "dst_port": dst_port,
+        "protocol": PROTOCOLS.get(protocol, str(protocol)),
+        "reason": DROP_REASONS.get(reason, str(reason)),
+    }
+
+def open_drop_events():
+    """Open the drop_events ring buffer through the bpf() syscall"""
+    try:
+        bpf_map = get_backend("syscall").open_map("drop_events")
+    except OSError as e:
+        print(f"Error: bpf() syscall unavailable: {e}")
+        return None
+    if not bpf_map:
+        print("Error: Could not find drop_events BPF map")
+        print("Make sure XDP program is loaded")
+        return None
+    return RingBuffer(bpf_map)
+
+def print_summary(events, sample_rate, interval):
+    """Print one interval's aggregated events"""
+    now = time.strftime("%H:%M:%S")
+    if not events:
+        print(f"[{now}] no drops")
+        return
+
+    estimate = len(events) * max(sample_rate, 1)
+    print(f"[{now}] {len(events):,} events (~{estimate / interval:,.0f} drops/sec)")
+    reasons = Counter(event["reason"] for event in events)
+    print("  " + ", ".join(f"{reason}: {count:,}" for reason, count in reasons.most_common()))
+    sources = Counter(event["src_ip"] for event in events)
+    for ip, count in sources.most_common(5):
+        print(f"    {ip:<15} {count:>10,}")
+
+def print_usage():
+    print("Usage: python3 drop_events.py [--sample-rate N] [--interval SECONDS] "
+          "[--duration SECONDS] [--json]")
+    print("")
+    print("  --sample-rate N   Report 1 in N drops (default: 1, every drop)")
+    print("  --interval S      Summary interval in seconds (default: 1)")
+    print("  --duration S      Stop after S seconds (default: run until Ctrl+C)")
+    print("  --json            Print every event as a JSON line instead of summaries")
+
+def main():
+    sample_rate = 1
+    interval = 1.0
+    duration = None
+    as_json = False
+
+    args = sys.argv[1:]
+    try:
+        while args:
+            if args[0] == "--json":
+                as_json = True
+                args = args[1:]
+                continue
+            if args[0] == "--sample-rate" and len(args) > 1:
+                sample_rate = int(args[1])
+            elif args[0] == "--interval" and len(args) > 1:
+                interval = float(args[1])
+            elif args[0] == "--duration" and len(args) > 1:
+                duration = float(args[1])
+            else:
+                raise ValueError(args[0])
+            args = args[2:]
+    except ValueError:
+        print_usage()
+        sys.exit(1)
+    if sample_rate < 1 or interval <= 0:
+        print_usage()
+        sys.exit(1)
+
+    ring = open_drop_events()
+    if not ring:
+        sys.exit(1)
+
+    manager = XDPIPManager(backend="syscall")
+    previous_rate = manager.get_event_sampling()
+    if not manager.set_event_sampling(sample_rate):
+        print("Error: Could not find event_sampling BPF map")
+        ring.close()
+        sys.exit(1)
+
+    if not as_json:
+        print(f"Streaming drop events (1 in {sample_rate} sampled), press Ctrl+C to stop")
+
+    deadline = time.monotonic() + duration if duration else None
+    next_report = time.monotonic() + interval
+    events = []
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            ring.poll(max(next_report - time.monotonic(), 0))
+            batch = [decode_event(record) for record in ring.consume()]
+            if as_json:
+                for event in batch:
+                    print(json.dumps(event))
+                sys.stdout.flush()
+            else:
+                events.extend(batch)
+
+            if time.monotonic() >= next_report:
+                if not as_json:
+                    print_summary(events, sample_rate, interval)
+                events = []
+                next_report += interval
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # Output consumer went away (e.g. piped into head)
+        sys.stdout = open(os.devnull, "w")
+    finally:
+        # Stop producing events nobody reads
+        try:
+            manager.set_event_sampling(previous_rate or 0)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                print(f"Warning: could not restore event sampling: {e}")
+        ring.close()
+        manager.close()
+
+if __name__ == "__main__":
+    main()
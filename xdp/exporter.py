@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Prometheus exporter for the XDP filter
+Keeps the filter's maps open, refreshes counters in the background and
+serves the cached result over HTTP in the Prometheus text format
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bpf_syscall
+from ip_manager import XDPIPManager, PKT_COUNT_KEYS, BLOCKLIST_MAPS
+
+DEFAULT_ADDRESS = "127.0.0.1"
+DEFAULT_PORT = 9435
+DEFAULT_INTERVAL = 1.0
+# Counting the blocklist walks every entry, so it runs on its own slower loop
+DEFAULT_COUNT_INTERVAL = 30.0
+DEFAULT_TOP = 10
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# name -> (type, help)
+METRICS = {
+    "xdp_filter_up": ("gauge", "Whether the pkt_count map could be read"),
+    "xdp_filter_packets_total": ("counter", "Packets seen by the filter, by verdict"),
+    "xdp_filter_blocklist_entries": ("gauge", "Entries in each blocklist map"),
+    "xdp_filter_blocklist_capacity": ("gauge", "max_entries of each blocklist map"),
+    "xdp_filter_blocklist_counted_timestamp_seconds": (
+        "gauge", "When the blocklist entries were last counted"),
+    "xdp_filter_source_dropped_packets_total": (
+        "counter", "Dropped packets of the heaviest dropped sources"),
+    "xdp_filter_source_dropped_bytes_total": (
+        "counter", "Dropped bytes of the heaviest dropped sources"),
+    "xdp_filter_program_info": ("gauge", "The loaded XDP program"),
+    "xdp_filter_program_run_time_seconds_total": (
+        "counter", "Time spent running the XDP program, needs run-time stats enabled"),
+    "xdp_filter_program_runs_total": (
+        "counter", "Runs of the XDP program, needs run-time stats enabled"),
+    "xdp_filter_exporter_refresh_seconds": ("gauge", "Duration of the last counter refresh"),
+}
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+def render(samples):
+    """Prometheus text for (name, labels, value) samples, grouped per metric"""
+    grouped = {}
+    for name, labels, value in samples:
+        grouped.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        if name not in grouped:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in grouped[name]:
+            lines.append(f"{name}{format_labels(labels)} {value}")
+    return ("\n".join(lines) + "\n").encode()
+
+class MetricsCache:
+    """Reads the filter's maps on fixed intervals and holds the rendered page.
+
+    Scrapes only return the cached bytes, so their cost does not depend on
+    the number of scrapers or the size of the blocklist.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, count_interval=DEFAULT_COUNT_INTERVAL,
+                 top=DEFAULT_TOP):
+        self.manager = XDPIPManager(backend="syscall")
+        self.interval = interval
+        self.count_interval = count_interval
+        self.top = top
+        self.lock = threading.Lock()
+        # The refresh and count loops share the manager and its map handles,
+        # which loaded_program() closes when loader.py replaces the program
+        self.manager_lock = threading.Lock()
+        self.page = render([("xdp_filter_up", {}, 0)])
+        self.blocklist = []
+        self.prog_id = None
+        self.stats_fd = None
+        self.stopped = threading.Event()
+        self.threads = [threading.Thread(target=self._loop, args=(self.refresh, interval), daemon=True),
+                        threading.Thread(target=self._loop, args=(self.count, count_interval), daemon=True)]
+
+    def start(self):
+        try:
+            self.stats_fd = bpf_syscall.enable_stats()
+        except OSError as e:
+            print(f"Warning: could not enable program run-time stats: {e}", file=sys.stderr)
+            print("Set kernel.bpf_stats_enabled=1 to collect them", file=sys.stderr)
+        self.count()
+        self.refresh()
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.stats_fd is not None:
+            os.close(self.stats_fd)
+        with self.manager_lock:
+            self.manager.close()
+
+    def _loop(self, task, interval):
+        while not self.stopped.wait(interval):
+            try:
+                task()
+            except Exception as e:
+                print(f"Error refreshing metrics: {e!r}", file=sys.stderr)
+                if task == self.refresh:
+                    # Don't keep serving counters that no longer move as up
+                    with self.lock:
+                        self.page = render([("xdp_filter_up", {}, 0)])
+
+    def program(self):
+        """(id, fd) of the loaded program; called with manager_lock held"""
+        prog = self.manager.loaded_program()
+        if prog and prog[0] != self.prog_id:
+            if self.prog_id is not None:
+                # The counts belong to the maps of the replaced program
+                self.blocklist = []
+            self.prog_id = prog[0]
+        return prog
+
+    def count(self):
+        """Count the blocklist maps; the only reads that grow with the blocklist"""
+        samples = []
+        with self.manager_lock:
+            self.manager.refresh_blocklist()
+            for name in BLOCKLIST_MAPS:
+                bpf_map = self.manager.find_map(name)
+                if bpf_map:
+                    labels = {"map": name}
+                    samples.append(("xdp_filter_blocklist_entries", labels, bpf_map.count()))
+                    samples.append(("xdp_filter_blocklist_capacity", labels, bpf_map.max_entries))
+            samples.append(("xdp_filter_blocklist_counted_timestamp_seconds", {},
+                            f"{time.time():.3f}"))
+            self.blocklist = samples
+
+    def refresh(self):
+        start = time.monotonic()
+        samples = []
+
+        with self.manager_lock:
+            stats = self.manager.get_stats()
+            sources = self.manager.get_source_stats()
+            prog = self.program()
+            run_stats = bpf_syscall.prog_run_stats(prog[1]) if prog else None
+            blocklist = self.blocklist
+
+        samples.append(("xdp_filter_up", {}, int(stats is not None)))
+        for name, _ in PKT_COUNT_KEYS if stats else ():
+            samples.append(("xdp_filter_packets_total", {"verdict": name}, sum(stats[name])))
+
+        samples.extend(blocklist)
+
+        if sources:
+            heaviest = sorted(sources.items(), key=lambda item: item[1][0], reverse=True)[:self.top]
+            for key, (packets, nbytes) in heaviest:
+                labels = {"src": self.manager.key_to_ip(key)}
+                samples.append(("xdp_filter_source_dropped_packets_total", labels, packets))
+                samples.append(("xdp_filter_source_dropped_bytes_total", labels, nbytes))
+
+        if prog:
+            run_time_ns, run_cnt = run_stats
+            samples.append(("xdp_filter_program_info", {"id": prog[0]}, 1))
+            samples.append(("xdp_filter_program_run_time_seconds_total", {}, f"{run_time_ns / 1e9:.9f}"))
+            samples.append(("xdp_filter_program_runs_total", {}, run_cnt))
+
+        samples.append(("xdp_filter_exporter_refresh_seconds", {}, f"{time.monotonic() - start:.6f}"))
+        page = render(samples)
+        with self.lock:
+            self.page = page
+
+    def get_page(self):
+        with self.lock:
+            return self.page
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the cached page on /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        page = self.server.cache.get_page()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        self.cache = cache
+        if ":" in address[0]:
+            self.address_family = socket.AF_INET6
+        super().__init__(address, MetricsHandler)
+
+def print_usage():
+    print("Usage: python3 exporter.py [--listen ADDR:PORT] [--interval SECONDS] "
+          "[--count-interval SECONDS] [--top N]")
+    print("")
+    print(f"  --listen ADDR:PORT       Address to serve /metrics on (default: {DEFAULT_ADDRESS}:{DEFAULT_PORT})")
+    print(f"  --interval SECONDS       Counter refresh interval (default: {DEFAULT_INTERVAL})")
+    print(f"  --count-interval SECONDS Blocklist size refresh interval (default: {DEFAULT_COUNT_INTERVAL})")
+    print(f"  --top N                  Dropped sources to export (default: {DEFAULT_TOP})")
+
+def main():
+    address = DEFAULT_ADDRESS
+    port = DEFAULT_PORT
+    interval = DEFAULT_INTERVAL
+    count_interval = DEFAULT_COUNT_INTERVAL
+    top = DEFAULT_TOP
+
+    args = sys.argv[1:]
+    try:
+        while args:
+            if args[0] == "--listen" and len(args) > 1:
+                host, _, listen_port = args[1].rpartition(":")
+                address = host.strip("[]") or address
+                port = int(listen_port)
+            elif args[0] == "--interval" and len(args) > 1:
+                interval = float(args[1])
+            elif args[0] == "--count-interval" and len(args) > 1:
+                count_interval = float(args[1])
+            elif args[0] == "--top" and len(args) > 1:
+                top = int(args[1])
+            else:
+                raise ValueError(args[0])
+            args = args[2:]
+    except ValueError:
+        print_usage()
+        sys.exit(1)
+    if interval <= 0 or count_interval <= 0 or top < 0:
+        print_usage()
+        sys.exit(1)
+
+    cache = MetricsCache(interval, count_interval, top)
+    try:
+        cache.start()
+    except OSError as e:
+        print(f"Error reading XDP maps: {e}")
+        sys.exit(1)
+    server = MetricsServer((address, port), cache)
+    print(f"Serving metrics on http://{address}:{port}/metrics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        cache.stop()
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,82 @@ Dynamic IP Blocker for XDP
 Allows adding/removing IPs from the blocked_ips BPF map
 """
 
+import os
 import sys
+import errno
 import struct
 import socket
-import subprocess
-import json
-from pathlib import Path
+import bisect
+import hashlib
+import ipaddress
+import heapq
+import time
+import itertools
+
+from map_backends import BACKENDS, get_backend
+
+# blocked_ips value: expiry in CLOCK_MONOTONIC nanoseconds, 0 never expires
+BLOCKED_VALUE = struct.pack("=Q", 0)
+
+# Value stored for every blocked range
+RANGE_VALUE = b"\x01"
+
+# Maps holding the exact addresses and the ranges of each IP version
+HOST_MAPS = {4: "blocked_ips", 6: "blocked_ips6"}
+RANGE_MAPS = {4: "blocked_cidrs", 6: "blocked_cidrs6"}
+ADDRESS_BITS = {4: 32, 6: 128}
+# Every map a source can be blocked through, as monitoring tools list them
+BLOCKLIST_MAPS = (*HOST_MAPS.values(), *RANGE_MAPS.values())
+
+# Warn once a blocklist map is this full; a full hash map rejects inserts
+HIGH_WATER_MARK = 0.8
+
+# Outer map whose slot 0 holds the blocked_ips generation the program uses,
+# and the pin of the generation it replaced, kept for rollback
+GENERATION_MAP = "blocklist_gen"
+ACTIVE_SLOT = struct.pack("=I", 0)
+PREVIOUS_GENERATION = "blocked_ips_prev"
+
+# Update flag of BPF_NOEXIST: keep entries that are already present
+NOEXIST = 1
+
+# Entries written per update batch when filling a generation
+GENERATION_BATCH = 4096
+
+# Feed lines parsed per chunk by `import`; memory use is bounded by this
+# and by the de-duplication set, 4 bytes per distinct IPv4 address
+FEED_CHUNK_LINES = 1 << 16
+FEED_PROGRESS_LINES = 1000000
+
+TTL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# port_bitmap layout: 1024 64-bit words per protocol, in this order
+PORT_PROTOCOLS = {"tcp": 0, "udp": 1}
+PORT_WORDS = 1024
+
+# pkt_count slots
+PKT_COUNT_KEYS = (("allowed", 0), ("blocked", 1))
+
+# struct rate_limit in xdp_filter.c
+RATE_LIMIT_FIELDS = ("pps", "pps_burst", "bps", "bps_burst", "promote_after")
+RATE_LIMIT_FORMAT = "=5Q"
+
+# Buckets are kept in tokens * 1e9, which must fit in 64 bits
+MAX_BURST = (2 ** 64 - 1) // 10 ** 9
+
+# struct rate_bucket in xdp_filter.c
+RATE_BUCKET_FORMAT = "=4Q"
 
 class XDPIPManager:
-    def __init__(self):
+    def __init__(self, backend="auto", pin_dir=None):
         self.map_path = "/sys/fs/bpf"
+        self.pin_dir = pin_dir or os.path.join(self.map_path, "xdp_filter")
+        self.prog_id_file = "/tmp/xdp_prog_id"
+        self.sync_state_dir = "/run/xdp_filter"
+        self.backend = get_backend(backend, pin_dir=self.pin_dir,
+                                   prog_id_file=self.prog_id_file)
+        self._maps = {}
+        self._prog = None
         
     def ip_to_int(self, ip_str):
         """Convert IP string to network byte order integer"""
@@ -23,195 +89,1799 @@ class XDPIPManager:
         """Convert network byte order integer to IP string"""
         return socket.inet_ntoa(struct.pack("!I", ip_int))
     
-    def run_command(self, cmd):
-        """Execute shell command and return output"""
-        try:
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            return result.stdout.strip(), result.stderr.strip(), result.returncode
-        except Exception as e:
-            return "", str(e), 1
+    def ip_to_key(self, ip_str):
+        """Convert IP string to the raw blocked_ips/blocked_ips6 key (network byte order)"""
+        if ":" in ip_str:
+            return socket.inet_pton(socket.AF_INET6, ip_str)
+        return struct.pack("!I", self.ip_to_int(ip_str))
+    
+    def key_to_ip(self, key):
+        """Convert a raw blocked_ips/blocked_ips6 key to an IP string"""
+        if len(key) == 16:
+            return socket.inet_ntop(socket.AF_INET6, key)
+        return socket.inet_ntoa(key)
+    
+    def find_map(self, name):
+        """Return an open map object for a map of the XDP program.
+        
+        Maps pinned by loader.py are opened by path; otherwise the map is
+        looked up by name among the maps of the program recorded in
+        /tmp/xdp_prog_id. The handle is cached, so discovery only runs
+        once per manager.
+        """
+        if name not in self._maps:
+            try:
+                bpf_map = self.backend.open_map(name)
+            except OSError as e:
+                print(f"Error opening {name} map: {e}")
+                return None
+            if bpf_map is None:
+                return None
+            self._maps[name] = bpf_map
+        return self._maps[name]
+    
+    def network_to_key(self, network):
+        """Convert a network to a blocked_cidrs/blocked_cidrs6 LPM trie key"""
+        # struct lpm_key_v4/v6: host order prefix length, network order address
+        return struct.pack("=I", network.prefixlen) + network.network_address.packed
+    
+    def key_to_network(self, key):
+        """Convert a blocked_cidrs/blocked_cidrs6 LPM trie key to a network"""
+        prefixlen = struct.unpack_from("=I", key)[0]
+        return ipaddress.ip_network((key[4:], prefixlen))
     
     def find_blocked_ips_map(self):
-        """Find the blocked_ips map ID"""
-        cmd = "bpftool map list | grep blocked_ips"
-        stdout, stderr, code = self.run_command(cmd)
-        
-        if code != 0:
-            # Try alternative method using map listing
-            cmd = "bpftool map list"
-            stdout, stderr, code = self.run_command(cmd)
-            
-            if code == 0:
-                lines = stdout.split('\n')
-                for i, line in enumerate(lines):
-                    if 'hash' in line and 'key 4' in line:
-                        # Check next few lines for clues
-                        map_id = line.split(':')[0].strip()
-                        return map_id
+        """Find the blocked_ips map"""
+        return self.find_map("blocked_ips")
+    
+    def find_host_map(self, key):
+        """Find the exact-address map (blocked_ips or blocked_ips6) for a raw key"""
+        return self.find_map(HOST_MAPS[key_version(key)])
+    
+    def write_hosts(self, keys, values=None):
+        """Batch-write raw host keys of either IP version to their maps.
+        
+        Inserts keys with values, or deletes them if values is None.
+        Returns one (ok, error) tuple per key, in order.
+        """
+        results = [None] * len(keys)
+        for version, name in HOST_MAPS.items():
+            indexes = [i for i, key in enumerate(keys) if key_version(key) == version]
+            if not indexes:
+                continue
+            bpf_map = self.find_map(name)
+            if not bpf_map:
+                for i in indexes:
+                    results[i] = (False, f"{name} map not found")
+                continue
+            if values is None:
+                written = bpf_map.delete_batch([keys[i] for i in indexes])
+            else:
+                written = [(ok, describe_write_error(bpf_map, error)) for ok, error
+                           in bpf_map.update_batch([keys[i] for i in indexes],
+                                                   [values[i] for i in indexes])]
+            for i, result in zip(indexes, written):
+                results[i] = result
+        return results
+    
+    def remove_hosts(self, keys):
+        """Unblock raw host keys of either IP version.
+        
+        Deletes the exact entries, then splits the blocked ranges that still
+        cover any of the hosts: update_networks folds permanent hosts into
+        prefixes, so a host may only be blocked through a range. Returns one
+        (ok, error) tuple per key, in order; ok if the host was blocked.
+        """
+        results = self.write_hosts(keys)
+        covered = self._covered_hosts(keys)
+        if not covered:
+            return results
+        
+        report = self.update_networks(
+            remove=[ipaddress.ip_network(self.key_to_ip(keys[i])) for i in covered])
+        if report is None:
+            error = "blocked_ips/blocked_cidrs maps not found"
         else:
-            # Extract map ID from output
-            map_id = stdout.split(':')[0].strip()
-            return map_id
-            
-        return None
+            error = report["failures"][0][2] if report["failures"] else None
+        for i in covered:
+            results[i] = (False, error) if error else (True, "")
+        return results
+    
+    def _covered_hosts(self, keys):
+        """Indexes of the host keys that lie inside a blocked_cidrs/blocked_cidrs6 prefix"""
+        covered = []
+        for version, name in RANGE_MAPS.items():
+            indexes = [i for i, key in enumerate(keys) if key_version(key) == version]
+            blocked_cidrs = self.find_map(name) if indexes else None
+            if not blocked_cidrs:
+                continue
+            _, ranges = rules_to_ranges([], [key for key, _ in blocked_cidrs.items()],
+                                        bits=ADDRESS_BITS[version])
+            ranges = merge_ranges(ranges)
+            starts = [start for start, _ in ranges]
+            for i in indexes:
+                address = int.from_bytes(keys[i], "big")
+                j = bisect.bisect_right(starts, address) - 1
+                if j >= 0 and address <= ranges[j][1]:
+                    covered.append(i)
+        return sorted(covered)
     
-    def add_blocked_ip(self, ip):
-        """Add IP to blocked list"""
-        print(f"Adding IP {ip} to blocked list...")
+    def stage_blocklist(self, batches, capacity=None):
+        """Create a blocked_ips generation the program does not use yet and fill it.
         
-        map_id = self.find_blocked_ips_map()
-        if not map_id:
-            print("Error: Could not find blocked_ips BPF map")
-            print("Make sure XDP program is loaded")
+        batches yields lists of (key, value) pairs, written one update
+        batch each. The new map copies the active one's layout, with
+        capacity entries if given. Returns the open map; raises OSError
+        if it cannot be created or an entry does not fit.
+        """
+        active = self.find_blocked_ips_map()
+        if not active:
+            raise OSError(errno.ENOENT, "blocked_ips map not found, make sure XDP program is loaded")
+        if not hasattr(self.backend, "create_map"):
+            raise OSError(errno.EOPNOTSUPP,
+                          f"generation swaps need the syscall backend, not {self.backend.name}")
+        
+        staged = self.backend.create_map(active, capacity)
+        try:
+            _, failures = fill_map(staged, batches)
+            if failures:
+                key, error = failures[0]
+                raise OSError(errno.EIO, f"{self.key_to_ip(key)}: {describe_write_error(staged, error)}"
+                              + (f" (+{len(failures) - 1} more)" if len(failures) > 1 else ""))
+        except OSError:
+            staged.close()
+            raise
+        return staged
+    
+    def publish_blocklist(self, staged):
+        """Make a staged map the active blocked_ips with a single outer map update.
+        
+        The program switches between two packets. The replaced generation
+        stays pinned as blocked_ips_prev and is returned.
+        """
+        outer = self.find_map(GENERATION_MAP)
+        if not outer:
+            raise OSError(errno.ENOENT, f"{GENERATION_MAP} map not found, "
+                          "run loader.py --reload to enable generation swaps")
+        previous = self.find_blocked_ips_map()
+        outer.update(ACTIVE_SLOT, struct.pack("=I", staged.fd))
+        
+        self.backend.pin_map(previous, PREVIOUS_GENERATION)
+        self.backend.pin_map(staged, HOST_MAPS[4])
+        replaced = self._maps.get(PREVIOUS_GENERATION)
+        if replaced is not None and replaced is not staged:
+            replaced.close()
+        self._maps[PREVIOUS_GENERATION] = previous
+        self._maps[HOST_MAPS[4]] = staged
+        return previous
+    
+    def rollback_blocklist(self):
+        """Publish the previous generation again, returning it, or None if there is none.
+        
+        The generation it replaces becomes the previous one, so rolling
+        back twice restores the original.
+        """
+        previous = self.find_map(PREVIOUS_GENERATION)
+        if not previous:
+            return None
+        self.publish_blocklist(previous)
+        return previous
+    
+    def refresh_blocklist(self):
+        """Reopen blocked_ips if another process published a new generation.
+        
+        The active generation is the map in blocklist_gen slot 0, which
+        publish_blocklist updates before it moves the pin; a userspace
+        lookup returns its map id. Costs one syscall while nothing changed,
+        so long-running tools call it before each write batch. Returns True
+        if the cached handle was replaced.
+        """
+        cached = self._maps.get(HOST_MAPS[4])
+        # bpftool reopens the pin on every call and demo maps have no generations
+        if cached is None or self.backend.name != "syscall":
+            return False
+        outer = self.find_map(GENERATION_MAP)
+        active = outer.lookup(ACTIVE_SLOT) if outer else None
+        try:
+            if active is not None:
+                active_id = struct.unpack_from("=I", active)[0]
+                current = self.backend.open_id(active_id) if active_id != cached.id else None
+            else:
+                # Loaded without generations, only the pin can change
+                current = self.backend.open_map(HOST_MAPS[4])
+        except OSError:
             return False
+        if current is None or current.id == cached.id:
+            if current is not None:
+                current.close()
+            return False
+        # Other threads may still hold the old handle, it stays open as the
+        # previous generation until the next swap
+        replaced = self._maps.pop(PREVIOUS_GENERATION, None)
+        if replaced is not None:
+            replaced.close()
+        self._maps[PREVIOUS_GENERATION] = cached
+        self._maps[HOST_MAPS[4]] = current
+        return True
+    
+    def replace_blocked_ips(self, path, capacity=None):
+        """Replace every blocked IPv4 address with the ones listed in a file.
         
-        ip_int = self.ip_to_int(ip)
+        The new list is written into a fresh generation while the current
+        one keeps filtering, then published in one step.
+        """
+        try:
+            with open(path) as f:
+                hosts, ranges, invalid = parse_ranges(f)
+        except OSError as e:
+            print(f"Error reading {path}: {e.strerror}")
+            return False
+        if invalid:
+            print(f"Error: Invalid IP address format: {', '.join(invalid[:10])}"
+                  + (f" (+{len(invalid) - 10} more)" if len(invalid) > 10 else ""))
+            return False
+        if ranges:
+            print(f"Error: replace takes single IPv4 addresses, {path} has {len(ranges)} ranges "
+                  "(use sync for ranges)")
+            return False
         
-        # Use bpftool to update map
-        cmd = f"bpftool map update id {map_id} key hex {ip_int:08x} value hex 01"
-        stdout, stderr, code = self.run_command(cmd)
+        keys = sorted({host.to_bytes(4, "big") for host in hosts})
+        print(f"Replacing blocked IPs with {len(keys):,} addresses from {path}...")
+        start = time.monotonic()
+        batches = ([(key, BLOCKED_VALUE) for key in keys[i:i + GENERATION_BATCH]]
+                   for i in range(0, len(keys), GENERATION_BATCH))
+        try:
+            staged = self.stage_blocklist(batches, capacity)
+            staged_in = time.monotonic() - start
+            previous = self.publish_blocklist(staged)
+        except OSError as e:
+            print(f"✗ Error replacing blocked IPs: {e.strerror}")
+            print("The current blocked list is unchanged")
+            return False
         
-        if code == 0:
-            print(f"✓ Successfully blocked IP: {ip}")
-            return True
+        print(f"✓ Published map id {staged.id} ({len(keys):,} entries, staged in {staged_in:.2f}s), "
+              f"replacing map id {previous.id}")
+        print("  The previous list is kept: `ip_manager.py rollback` restores it")
+        self.warn_capacity([HOST_MAPS[4]])
+        return True
+    
+    def print_rollback(self):
+        """Roll back to the previous generation and report it"""
+        try:
+            restored = self.rollback_blocklist()
+        except OSError as e:
+            print(f"✗ Error rolling back: {e.strerror}")
+            return False
+        if restored is None:
+            print("Error: No previous blocked list to roll back to")
+            return False
+        print(f"✓ Restored map id {restored.id} ({restored.count():,} entries); "
+              "rollback again to undo")
+        return True
+    
+    def import_feed(self, path, replace=False, capacity=None):
+        """Stream a blocklist feed of any size into the maps.
+        
+        The file is read in chunks of FEED_CHUNK_LINES. Each chunk is
+        validated and packed into network-order keys, de-duplicated against
+        every address seen so far and written in batches of
+        GENERATION_BATCH. With replace, the IPv4 addresses fill a new
+        blocked_ips generation that is published at the end; IPv6
+        addresses and ranges are only written once it is published, and
+        are added to what their maps hold. Ranges are merged among
+        themselves. Returns a report dict; raises OSError if the file
+        cannot be read or the generation cannot be staged, in which case
+        nothing was written with replace.
+        """
+        report = {"lines": 0, "rejected": 0, "rejects": [], "duplicates": 0,
+                  "written": 0, "failed": 0, "errors": [], "ranges": 0}
+        seen = {4: KeySet(4), 6: KeySet(16)}
+        networks = []
+        start = time.monotonic()
+        
+        def record(keys, errors):
+            report["failed"] += len(errors)
+            report["errors"] = (report["errors"] + errors)[:10]
+            return len(keys) - len(errors)
+        
+        def write(keys):
+            results = self.write_hosts(keys, [BLOCKED_VALUE] * len(keys))
+            report["written"] += record(keys, [error for ok, error in results if not ok])
+        
+        def batches():
+            """IPv4 batches for the new generation; without replace everything is written directly"""
+            progress = FEED_PROGRESS_LINES
+            for lines in read_chunks(path):
+                packed, ranges, rejects = parse_feed(lines)
+                report["lines"] += len(lines)
+                report["rejected"] += len(rejects)
+                report["rejects"] = (report["rejects"] + rejects)[:10]
+                networks.extend(ranges)
+                for version in (4, 6):
+                    keys, duplicates = seen[version].add(packed[version])
+                    report["duplicates"] += duplicates
+                    for i in range(0, len(keys), GENERATION_BATCH):
+                        if not replace:
+                            write(keys[i:i + GENERATION_BATCH])
+                        elif version == 4:
+                            report["written"] += len(keys[i:i + GENERATION_BATCH])
+                            yield [(key, BLOCKED_VALUE) for key in keys[i:i + GENERATION_BATCH]]
+                if report["lines"] >= progress:
+                    progress += FEED_PROGRESS_LINES
+                    print(f"  {report['lines']:,} lines "
+                          f"({report['lines'] / (time.monotonic() - start):,.0f} lines/s)")
+        
+        if replace:
+            previous = self.publish_blocklist(self.stage_blocklist(batches(), capacity))
+            report["replaced"] = previous.id
+            # IPv6 addresses waited in the dedup set until the swap succeeded
+            raw = seen[6].members.tobytes()
+            keys = [raw[i:i + 16] for i in range(0, len(raw), 16)]
+            for i in range(0, len(keys), GENERATION_BATCH):
+                write(keys[i:i + GENERATION_BATCH])
         else:
-            print(f"✗ Error blocking IP: {stderr}")
+            for _ in batches():
+                pass
+        
+        # Ranges are few next to hosts; aggregate them among themselves only
+        for version, name in RANGE_MAPS.items():
+            ranges = merge_ranges(networks_to_ranges(n for n in networks if n.version == version))
+            hosts, prefixes = ranges_to_rules(ranges, bits=ADDRESS_BITS[version])
+            for keys, map_name, value in ((sorted(hosts), HOST_MAPS[version], BLOCKED_VALUE),
+                                          (sorted(prefixes), name, RANGE_VALUE)):
+                if not keys:
+                    continue
+                bpf_map = self.find_map(map_name)
+                if not bpf_map:
+                    record(keys, [f"{map_name} map not found"] * len(keys))
+                    continue
+                _, failures = fill_map(bpf_map, ([(key, value) for key in keys[i:i + GENERATION_BATCH]]
+                                                 for i in range(0, len(keys), GENERATION_BATCH)))
+                report["ranges"] += record(keys, [error for _, error in failures])
+        
+        report["seconds"] = time.monotonic() - start
+        report["sizes"] = {name: entries for name, (entries, _) in self.get_occupancy().items()}
+        return report
+    
+    def print_import(self, path, replace=False, capacity=None):
+        """Import a feed and print its report"""
+        print(f"Importing {path}" + (" as a new generation..." if replace else "..."))
+        try:
+            report = self.import_feed(path, replace, capacity)
+        except OSError as e:
+            print(f"✗ Error importing {path}: {e.strerror}")
+            if replace:
+                print("The current blocked list is unchanged")
+            return False
+        
+        rate = report["lines"] / report["seconds"] if report["seconds"] else 0
+        print(f"Read {report['lines']:,} lines in {report['seconds']:.2f}s ({rate:,.0f} lines/s)")
+        print(f"  {report['written']:,} addresses and {report['ranges']:,} range rules written, "
+              f"{report['duplicates']:,} duplicates skipped")
+        if report["rejected"]:
+            print(f"  {report['rejected']:,} lines rejected: {', '.join(report['rejects'])}"
+                  + (" ..." if report["rejected"] > len(report["rejects"]) else ""))
+        if "replaced" in report:
+            print(f"  Published as a new generation, replacing map id {report['replaced']} "
+                  "(`ip_manager.py rollback` restores it)")
+        print("Map sizes: " + ", ".join(f"{name} {entries:,}"
+                                        for name, entries in report["sizes"].items()))
+        self.warn_capacity()
+        if report["failed"]:
+            print(f"✗ {report['failed']:,} entries could not be written: "
+                  f"{describe_write_error(self.find_blocked_ips_map(), report['errors'][0])}")
+            return False
+        print("✓ Import complete")
+        return True
+    
+    def close(self):
+        """Release every cached map handle and the program fd"""
+        for bpf_map in self._maps.values():
+            bpf_map.close()
+        self._maps.clear()
+        if self._prog:
+            os.close(self._prog[1])
+            self._prog = None
+    
+    def loaded_program(self):
+        """(id, fd) of the loaded program, reopened when loader.py replaces it.
+        
+        A fresh load unpins and recreates the maps, so a replaced program
+        also drops every cached map handle; they are found again on next
+        use. Returns None if no program is loaded or it cannot be opened.
+        """
+        from bpf_syscall import prog_fd_by_id
+        try:
+            with open(self.prog_id_file) as f:
+                prog_id = int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        if self._prog and self._prog[0] == prog_id:
+            return self._prog
+        if self._prog:
+            self.close()
+        try:
+            self._prog = (prog_id, prog_fd_by_id(prog_id))
+        except OSError:
+            return None
+        return self._prog
+    
+    def add_blocked_ip(self, ip, ttl=None):
+        """Add IP to blocked list, for ttl seconds if given"""
+        print(f"Adding IP {ip} to blocked list" + (f" for {format_ttl(ttl)}..." if ttl else "..."))
+        
+        key = self.ip_to_key(ip)
+        blocked_ips = self.find_host_map(key)
+        if not blocked_ips:
+            print(f"Error: Could not find {HOST_MAPS[key_version(key)]} BPF map")
+            print("Make sure XDP program is loaded")
             return False
+        
+        try:
+            blocked_ips.update(key, expiry_value(ttl))
+        except OSError as e:
+            print(f"✗ Error blocking IP: {describe_write_error(blocked_ips, e.strerror)}")
+            return False
+        
+        print(f"✓ Successfully blocked IP: {ip}")
+        self.warn_capacity([HOST_MAPS[key_version(key)]])
+        return True
     
     def remove_blocked_ip(self, ip):
         """Remove IP from blocked list"""
         print(f"Removing IP {ip} from blocked list...")
         
-        map_id = self.find_blocked_ips_map()
-        if not map_id:
+        key = self.ip_to_key(ip)
+        if not self.find_host_map(key):
+            print(f"Error: Could not find {HOST_MAPS[key_version(key)]} BPF map")
+            return False
+        
+        ok, error = self.remove_hosts([key])[0]
+        if not ok:
+            print(f"✗ Error unblocking IP: {error}")
+            return False
+        
+        print(f"✓ Successfully unblocked IP: {ip}")
+        return True
+    
+    def _count(self, name):
+        """Number of entries in a map, 0 if it is unavailable"""
+        bpf_map = self.find_map(name)
+        return bpf_map.count() if bpf_map else 0
+    
+    def get_occupancy(self, names=None):
+        """Return {name: (entries, max_entries)} of the blocklist maps that are available"""
+        occupancy = {}
+        for name in names or BLOCKLIST_MAPS:
+            bpf_map = self.find_map(name)
+            if bpf_map:
+                occupancy[name] = (bpf_map.count(), bpf_map.max_entries)
+        return occupancy
+    
+    def capacity_warnings(self, names=None):
+        """Return a warning for each blocklist map filled past HIGH_WATER_MARK"""
+        warnings = []
+        for name, (entries, max_entries) in self.get_occupancy(names).items():
+            if entries >= max_entries * HIGH_WATER_MARK:
+                hint = (" (grow it with `loader.py --reload --capacity N`)"
+                        if name == HOST_MAPS[4] else "")
+                warnings.append(f"{name} is {entries / max_entries:.0%} full "
+                                f"({entries:,}/{max_entries:,} entries){hint}")
+        return warnings
+    
+    def warn_capacity(self, names=None):
+        """Print the high-water-mark warnings of the blocklist maps"""
+        for warning in self.capacity_warnings(names):
+            print(f"Warning: {warning}")
+    
+    def print_capacity(self):
+        """Print entries and capacity of every blocklist map"""
+        occupancy = self.get_occupancy()
+        if HOST_MAPS[4] not in occupancy:
             print("Error: Could not find blocked_ips BPF map")
+            print("Make sure XDP program is loaded")
             return False
         
-        ip_int = self.ip_to_int(ip)
+        print(f"  {'Map':<16} {'Entries':>12} {'Capacity':>12} {'Used':>7}")
+        for name, (entries, max_entries) in occupancy.items():
+            print(f"  {name:<16} {entries:>12,} {max_entries:>12,} {entries / max_entries:>7.1%}")
+        self.warn_capacity()
+        return True
+    
+    def get_blocked_ips(self):
+        """Return the blocked IPs as strings, or None if the map is unavailable"""
+        entries = self.get_blocked_entries()
+        return None if entries is None else [ip for ip, _ in entries]
+    
+    def get_blocked_entries(self):
+        """Return (ip, expiry_ns) for every blocked IP, or None if the map is unavailable.
         
-        # Use bpftool to delete from map
-        cmd = f"bpftool map delete id {map_id} key hex {ip_int:08x}"
-        stdout, stderr, code = self.run_command(cmd)
+        expiry_ns is 0 for permanent blocks. Expired entries that have
+        not been deleted yet are included.
+        """
+        blocked_ips = self.find_blocked_ips_map()
+        if not blocked_ips:
+            print("Error: Could not find blocked_ips BPF map")
+            return None
         
-        if code == 0:
-            print(f"✓ Successfully unblocked IP: {ip}")
-            return True
-        else:
-            print(f"✗ Error unblocking IP: {stderr}")
-            return False
+        entries = []
+        try:
+            for bpf_map in (blocked_ips, self.find_map(HOST_MAPS[6])):
+                if bpf_map:
+                    entries.extend((self.key_to_ip(key), value_expiry(value))
+                                   for key, value in bpf_map.items())
+        except OSError as e:
+            print(f"Error reading map: {e.strerror}")
+            return None
+        return entries
+    
+    def expire_blocked_ips(self):
+        """Delete every expired blocked IP in one batch, returning how many were removed"""
+        if not self.find_blocked_ips_map():
+            return None
+        
+        now = time.monotonic_ns()
+        keys = [key for name in HOST_MAPS.values() if self.find_map(name)
+                for key, value in self.find_map(name).items() if 0 < value_expiry(value) <= now]
+        results = self.write_hosts(keys) if keys else []
+        return sum(1 for ok, _ in results if ok)
     
     def list_blocked_ips(self):
         """List all blocked IPs"""
         print("Listing blocked IPs...")
         
-        map_id = self.find_blocked_ips_map()
-        if not map_id:
-            print("Error: Could not find blocked_ips BPF map")
+        entries = self.get_blocked_entries()
+        if entries is None:
             return
         
-        # Use bpftool to dump map
-        cmd = f"bpftool map dump id {map_id}"
-        stdout, stderr, code = self.run_command(cmd)
+        networks = self.get_blocked_ranges()
+        if not entries and not networks:
+            print("No IPs currently blocked")
+            return
         
-        if code == 0:
-            if not stdout.strip():
-                print("No IPs currently blocked")
-                return
-            
-            print("Currently blocked IPs:")
+        print("Currently blocked IPs:")
+        print("-" * 30)
+        
+        now = time.monotonic_ns()
+        for ip, expiry in entries:
+            print(f"  - {ip}{describe_expiry(expiry, now)}")
+        
+        if networks:
+            print("Currently blocked ranges:")
             print("-" * 30)
+            for network in networks:
+                print(f"  - {network}")
+    
+    def get_blocked_ranges(self):
+        """Return the blocked IPv4 and IPv6 ranges, IPv4 first, each sorted"""
+        networks = []
+        for name in RANGE_MAPS.values():
+            bpf_map = self.find_map(name)
+            if bpf_map:
+                networks.extend(sorted(self.key_to_network(key) for key, _ in bpf_map.items()))
+        return networks
+    
+    def add_blocked_ips(self, ips, ttl=None):
+        """Add several IPs in one batch, returning per-IP results"""
+        print(f"Adding {len(ips)} IPs to blocked list" + (f" for {format_ttl(ttl)}..." if ttl else "..."))
+        value = expiry_value(ttl)
+        results = self.apply_batch(
+            ips, lambda m, keys: [(ok, describe_write_error(m, error)) for ok, error
+                                  in m.update_batch(keys, [value] * len(keys))])
+        print_results(results, "blocked", "blocking")
+        self.warn_capacity(list(HOST_MAPS.values()))
+        return results
+    
+    def remove_blocked_ips(self, ips):
+        """Remove several IPs in one batch, returning per-IP results"""
+        print(f"Removing {len(ips)} IPs from blocked list...")
+        results = self.apply_batch(ips, lambda m, keys: self.remove_hosts(keys))
+        print_results(results, "unblocked", "unblocking")
+        return results
+    
+    def apply_batch(self, ips, operation):
+        """Apply one batched map operation to many IPs.
+        
+        Returns a list of (ip, ok, error) tuples in the order of ips.
+        """
+        results = {}
+        keys = []
+        valid_ips = []
+        
+        for ip in ips:
+            try:
+                key = self.ip_to_key(ip)
+            except (OSError, ValueError):
+                results[ip] = (False, "invalid IP address format")
+                continue
+            valid_ips.append(ip)
+            keys.append(key)
+        
+        # One batch per IP version, each against its own map
+        for version, name in HOST_MAPS.items():
+            batch = [(ip, key) for ip, key in zip(valid_ips, keys) if key_version(key) == version]
+            if not batch:
+                continue
+            bpf_map = self.find_map(name)
+            if not bpf_map:
+                print(f"Error: Could not find {name} BPF map")
+                print("Make sure XDP program is loaded")
+                for ip, _ in batch:
+                    results[ip] = (False, f"{name} map not found")
+                continue
+            for (ip, _), result in zip(batch, operation(bpf_map, [key for _, key in batch])):
+                results[ip] = result
+        
+        return [(ip, *results[ip]) for ip in ips]
+    
+    def get_blocked_networks(self):
+        """Return every blocking rule as a set of IPv4 networks.
+        
+        blocked_ips entries are returned as /32 networks alongside the
+        blocked_cidrs prefixes. Returns None if the maps are unavailable.
+        """
+        rules = self.read_rules()
+        if rules is None:
+            return None
+        hosts, prefixes = rules
+        networks = {ipaddress.IPv4Network((key, 32)) for key in hosts}
+        networks.update(self.key_to_network(key) for key in prefixes)
+        return networks
+    
+    def read_rules(self, version=4):
+        """Read the raw rule keys as (blocked_ips keys, blocked_cidrs keys).
+        
+        version 6 reads blocked_ips6 and blocked_cidrs6 instead. Each map
+        is read once. Hosts with a TTL are left out: they are not merged
+        into permanent prefixes and expire on their own. Returns None if
+        the maps are unavailable.
+        """
+        blocked_ips = self.find_map(HOST_MAPS[version])
+        blocked_cidrs = self.find_map(RANGE_MAPS[version])
+        if not blocked_ips or not blocked_cidrs:
+            print(f"Error: Could not find {HOST_MAPS[version]}/{RANGE_MAPS[version]} BPF maps")
+            print("Make sure XDP program is loaded")
+            return None
+        
+        try:
+            return ({key for key, value in blocked_ips.items() if not value_expiry(value)},
+                    {key for key, _ in blocked_cidrs.items()})
+        except OSError as e:
+            print(f"Error reading map: {e.strerror}")
+            return None
+    
+    def apply_rule_diff(self, current, desired, version=4):
+        """Write only the difference between two rule sets to the maps.
+        
+        Rule sets are (blocked_ips keys, blocked_cidrs keys) pairs. New
+        entries are inserted before stale ones are deleted, so the covered
+        address space never shrinks while the maps converge. Returns
+        (inserted, deleted, failures) where failures lists the
+        (network, ok, error) results of failed writes.
+        """
+        maps = (self.find_map(HOST_MAPS[version]), self.find_map(RANGE_MAPS[version]))
+        values = (BLOCKED_VALUE, RANGE_VALUE)
+        to_network = (lambda key: ipaddress.ip_network(self.key_to_ip(key)), self.key_to_network)
+        inserted = deleted = 0
+        failures = []
+        
+        for write in ("update", "delete"):
+            for bpf_map, value, current_keys, desired_keys, network in zip(
+                    maps, values, current, desired, to_network):
+                if write == "update":
+                    keys = sorted(desired_keys - current_keys)
+                    results = bpf_map.update_batch(keys, [value] * len(keys)) if keys else []
+                    inserted += len(keys)
+                else:
+                    keys = sorted(current_keys - desired_keys)
+                    results = bpf_map.delete_batch(keys) if keys else []
+                    deleted += len(keys)
+                failures.extend((network(key), ok, error)
+                                for key, (ok, error) in zip(keys, results) if not ok)
+        
+        return inserted, deleted, failures
+    
+    def update_networks(self, add=(), remove=()):
+        """Add and remove networks, storing the aggregated rule set.
+        
+        The union of the current rules and add, minus remove, is collapsed
+        into the smallest equivalent set of prefixes before it is written.
+        IPv4 and IPv6 networks are aggregated separately, each into its
+        own maps. Returns a report dict, or None if the maps are unavailable.
+        """
+        report = None
+        for version in ADDRESS_BITS:
+            family_add = [n for n in add if n.version == version]
+            family_remove = [n for n in remove if n.version == version]
+            if version != 4 and not family_add and not family_remove:
+                continue
+            
+            current = self.read_rules(version)
+            if current is None:
+                return None
             
-            # Parse bpftool output
-            lines = stdout.split('\n')
-            for line in lines:
-                if 'key:' in line:
-                    # Extract hex key and convert to IP
-                    try:
-                        key_part = line.split('key:')[1].split('value:')[0].strip()
-                        # Remove hex formatting
-                        hex_key = key_part.replace(' ', '')
-                        ip_int = int(hex_key, 16)
-                        ip = self.int_to_ip(ip_int)
-                        print(f"  - {ip}")
-                    except Exception as e:
-                        print(f"  - Could not parse: {line}")
+            bits = ADDRESS_BITS[version]
+            hosts, ranges = rules_to_ranges(*current, bits=bits)
+            ranges += networks_to_ranges(family_add)
+            desired = ranges_to_rules(subtract_ranges(merge_ranges(ranges, hosts),
+                                                      merge_ranges(networks_to_ranges(family_remove))),
+                                      bits=bits)
+            family_report = self._converge(current, desired, len(hosts) + len(ranges), version)
+            if family_remove:
+                family_report["deleted"] += self._remove_expiring(version, family_remove)
+            report = merge_reports(report, family_report)
+        return report
+    
+    def _remove_expiring(self, version, networks):
+        """Delete the hosts with a TTL that fall inside removed networks"""
+        holes = merge_ranges(networks_to_ranges(networks))
+        starts = [start for start, _ in holes]
+        keys = []
+        for key, value in self.find_map(HOST_MAPS[version]).items():
+            if not value_expiry(value):
+                continue
+            address = int.from_bytes(key, "big")
+            i = bisect.bisect_right(starts, address) - 1
+            if i >= 0 and address <= holes[i][1]:
+                keys.append(key)
+        results = self.write_hosts(keys) if keys else []
+        return sum(1 for ok, _ in results if ok)
+    
+    def sync_blocked_networks(self, path):
+        """Converge the maps to the IPs and CIDRs listed in a file.
+        
+        The live rules are read once and only the set differences are
+        written. The aggregated rule set of the last sync is cached per
+        file, so an unchanged file whose rules are still live is detected
+        without re-parsing it. Returns a report dict, or None on error.
+        """
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            print(f"Error reading {path}: {e.strerror}")
+            return None
+        
+        current = self.read_rules()
+        if current is None:
+            return None
+        
+        digest = hashlib.sha256(data).digest()
+        state_path = self.sync_state_path(path)
+        if load_sync_state(state_path, digest) == current:
+            return self._converge(current, current, len(current[0]) + len(current[1]))
+        
+        hosts, ranges, invalid = parse_ranges(data.decode(errors="replace").splitlines())
+        if invalid:
+            print(f"Error: Invalid IP address format: {', '.join(invalid[:10])}"
+                  + (f" (+{len(invalid) - 10} more)" if len(invalid) > 10 else ""))
+            return None
+        
+        desired = ranges_to_rules(merge_ranges(ranges, hosts))
+        report = self._converge(current, desired, len(hosts) + len(ranges))
+        if not report["failures"]:
+            save_sync_state(state_path, digest, desired)
+        return report
+    
+    def sync_state_path(self, path):
+        """Location of the cached rule set of the last sync of path"""
+        name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+        return os.path.join(self.sync_state_dir, f"sync-{name}.state")
+    
+    def _converge(self, current, desired, requested, version=4):
+        inserted, deleted, failures = self.apply_rule_diff(current, desired, version)
+        return {
+            "before": requested,
+            "after": len(desired[0]) + len(desired[1]),
+            "hosts": len(desired[0]),
+            "inserted": inserted,
+            "deleted": deleted,
+            "failures": failures,
+        }
+    
+    def add_blocked_networks(self, networks):
+        """Block CIDR ranges (and single addresses) with prefix aggregation"""
+        print(f"Adding {len(networks)} networks to blocked list...")
+        ok = self._report_networks(self.update_networks(add=networks))
+        self.warn_capacity()
+        return ok
+    
+    def remove_blocked_networks(self, networks):
+        """Unblock CIDR ranges, splitting wider blocked prefixes as needed"""
+        print(f"Removing {len(networks)} networks from blocked list...")
+        return self._report_networks(self.update_networks(remove=networks))
+    
+    def sync_from_file(self, path):
+        """Sync the blocked list with a file of IPs and CIDRs"""
+        print(f"Syncing blocked list with {path}...")
+        start = time.monotonic()
+        report = self.sync_blocked_networks(path)
+        if report is not None and not report["inserted"] and not report["deleted"]:
+            print(f"✓ Already in sync: {report['after']} entries "
+                  f"({(time.monotonic() - start) * 1000:.1f} ms)")
+            return True
+        ok = self._report_networks(report)
+        if report is not None:
+            print(f"  finished in {(time.monotonic() - start) * 1000:.1f} ms")
+        return ok
+    
+    def _report_networks(self, report):
+        if report is None:
+            return False
+        
+        print(f"Rule set: {report['before']} entries before aggregation, {report['after']} after "
+              f"({report['hosts']} exact, {report['after'] - report['hosts']} ranges)")
+        print(f"  {report['inserted']} inserted, {report['deleted']} deleted")
+        for network, _, error in report["failures"]:
+            print(f"  ✗ {network}: {error}")
+        if report["failures"]:
+            print(f"✗ Error writing {len(report['failures'])} entries")
+            return False
+        print("✓ Blocked networks updated")
+        return True
+    
+    def get_stats(self):
+        """Read the per-CPU packet counters.
+        
+        Returns {"allowed": [...], "blocked": [...]} with one count per
+        possible CPU, or None if pkt_count is unavailable.
+        """
+        pkt_count = self.find_map("pkt_count")
+        if not pkt_count:
+            return None
+        
+        stats = {}
+        for name, index in PKT_COUNT_KEYS:
+            value = pkt_count.lookup(struct.pack("=I", index)) or b""
+            stats[name] = [struct.unpack_from("=Q", value, i)[0]
+                           for i in range(0, len(value) - 7, 8)]
+        return stats
+    
+    def print_stats(self, per_cpu=False):
+        """Print packet counters summed over CPUs, optionally per CPU"""
+        stats = self.get_stats()
+        if stats is None:
+            print("Error: Could not find pkt_count BPF map")
+            print("Make sure XDP program is loaded")
+            return False
+        
+        allowed = sum(stats["allowed"])
+        blocked = sum(stats["blocked"])
+        total = allowed + blocked
+        
+        blocked_ips = self.find_blocked_ips_map()
+        print("Packet statistics:")
+        print(f"  Blocked IP rules: {self._count('blocked_ips')} exact "
+              f"(capacity {blocked_ips.max_entries if blocked_ips else 0}), "
+              f"{self._count('blocked_cidrs')} ranges")
+        print(f"  Allowed packets: {allowed:,}")
+        print(f"  Blocked packets: {blocked:,}")
+        print(f"  Total packets processed: {total:,}")
+        if total:
+            print(f"  Drop ratio: {blocked / total:.2%}")
+        
+        if per_cpu:
+            print("")
+            print(f"  {'CPU':>4} {'Allowed':>14} {'Blocked':>14} {'Share':>7}")
+            for cpu, (cpu_allowed, cpu_blocked) in enumerate(
+                    zip(stats["allowed"], stats["blocked"])):
+                share = (cpu_allowed + cpu_blocked) / total if total else 0
+                print(f"  {cpu:>4} {cpu_allowed:>14,} {cpu_blocked:>14,} {share:>7.1%}")
+        return True
+    
+    def get_source_stats(self):
+        """Read the per-source drop counters in batches.
+        
+        Returns {key: (packets, bytes)} summed over CPUs, keyed by the raw
+        4-byte source address, or None if src_stats is unavailable.
+        """
+        src_stats = self.find_map("src_stats")
+        if not src_stats:
+            return None
+        
+        stats = {}
+        for key, value in src_stats.items():
+            packets = 0
+            nbytes = 0
+            for cpu_packets, cpu_bytes in struct.iter_unpack("=QQ", value):
+                packets += cpu_packets
+                nbytes += cpu_bytes
+            stats[key] = (packets, nbytes)
+        return stats
+    
+    def top_sources(self, count=10, interval=1.0, by="packets"):
+        """Return the heaviest dropped sources, with rates measured over interval.
+        
+        Each entry is a dict with ip, pps, bps (bytes/sec) and the packet
+        and byte totals, ordered by packet or byte rate.
+        """
+        first = self.get_source_stats()
+        if first is None:
+            return None
+        start = time.monotonic()
+        time.sleep(interval)
+        second = self.get_source_stats()
+        elapsed = time.monotonic() - start
+        
+        return [{"ip": self.key_to_ip(key), "pps": pps, "bps": bps,
+                 "packets": packets, "bytes": nbytes}
+                for key, pps, bps, packets, nbytes in heaviest_sources(
+                    source_rates(first, second, elapsed), count, by)]
+    
+    def print_top(self, count=10, interval=1.0, by="packets"):
+        """Print the heaviest dropped sources"""
+        top = self.top_sources(count, interval, by)
+        if top is None:
+            print("Error: Could not find src_stats BPF map")
+            print("Make sure XDP program is loaded")
+            return False
+        
+        if not top:
+            print("No dropped sources recorded")
+            return True
+        
+        print(f"Top {len(top)} dropped sources (rates over {interval:g}s):")
+        print(f"  {'Source':<15} {'Packets/s':>12} {'Bytes/s':>14} {'Packets':>14} {'Bytes':>16}")
+        for entry in top:
+            print(f"  {entry['ip']:<15} {entry['pps']:>12,.0f} {entry['bps']:>14,.0f} "
+                  f"{entry['packets']:>14,} {entry['bytes']:>16,}")
+        return True
+    
+    def read_port_bitmap(self, proto):
+        """Return the 1024 bitmap words of a protocol, or None if port_bitmap is unavailable"""
+        port_bitmap = self.find_map("port_bitmap")
+        if not port_bitmap:
+            return None
+        
+        base = PORT_PROTOCOLS[proto] * PORT_WORDS
+        words = [0] * PORT_WORDS
+        for key, value in port_bitmap.items():
+            index = struct.unpack("=I", key)[0] - base
+            if 0 <= index < PORT_WORDS:
+                words[index] = struct.unpack_from("=Q", value)[0]
+        return words
+    
+    def update_ports(self, proto, ranges, block=True):
+        """Set or clear (start, end) port ranges in a protocol's bitmap.
+        
+        Only the words that change are written, in one batch. Returns the
+        number of ports whose state changed, or None if the map is
+        unavailable.
+        """
+        words = self.read_port_bitmap(proto)
+        if words is None:
+            return None
+        
+        updated = list(words)
+        for start, end in ranges:
+            for index in range(start >> 6, (end >> 6) + 1):
+                low = max(start, index * 64) - index * 64
+                high = min(end, index * 64 + 63) - index * 64
+                mask = ((1 << (high - low + 1)) - 1) << low
+                updated[index] = updated[index] | mask if block else updated[index] & ~mask
+        
+        changed = [index for index in range(PORT_WORDS) if updated[index] != words[index]]
+        if changed:
+            base = PORT_PROTOCOLS[proto] * PORT_WORDS
+            results = self.find_map("port_bitmap").update_batch(
+                [struct.pack("=I", base + index) for index in changed],
+                [struct.pack("=Q", updated[index]) for index in changed])
+            errors = [error for ok, error in results if not ok]
+            if errors:
+                raise OSError(errno.EIO, errors[0])
+        return sum(bin(updated[index] ^ words[index]).count("1") for index in changed)
+    
+    def get_blocked_ports(self, proto):
+        """Return the blocked ports of a protocol as sorted (start, end) ranges, or None"""
+        words = self.read_port_bitmap(proto)
+        if words is None:
+            return None
+        
+        ranges = []
+        for index, word in enumerate(words):
+            while word:
+                # Lowest set bit, then the run of set bits starting there
+                low = (word & -word).bit_length() - 1
+                shifted = word >> low
+                run = (~shifted & (shifted + 1)).bit_length() - 1
+                start = index * 64 + low
+                end = start + run - 1
+                if ranges and ranges[-1][1] == start - 1:
+                    ranges[-1] = (ranges[-1][0], end)
+                else:
+                    ranges.append((start, end))
+                word &= ~(((1 << run) - 1) << low)
+        return ranges
+    
+    def change_blocked_ports(self, proto, ranges, block=True):
+        """Block or unblock port ranges of a protocol and report the result"""
+        try:
+            changed = self.update_ports(proto, ranges, block)
+        except OSError as e:
+            print(f"✗ Error updating port_bitmap: {e.strerror}")
+            return False
+        if changed is None:
+            print("Error: Could not find port_bitmap BPF map")
+            print("Make sure XDP program is loaded")
+            return False
+        
+        action = "blocked" if block else "unblocked"
+        listed = ", ".join(format_port_range(r) for r in ranges)
+        print(f"✓ {proto.upper()} {listed}: {changed} ports newly {action}")
+        return True
+    
+    def list_blocked_ports(self, protos=None):
+        """List the blocked ports of each protocol"""
+        for proto in protos or PORT_PROTOCOLS:
+            ranges = self.get_blocked_ports(proto)
+            if ranges is None:
+                print("Error: Could not find port_bitmap BPF map")
+                print("Make sure XDP program is loaded")
+                return False
+            if ranges:
+                print(f"Blocked {proto.upper()} ports: {', '.join(map(format_port_range, ranges))}")
+            else:
+                print(f"Blocked {proto.upper()} ports: none")
+        return True
+    
+    def get_rate_limit(self):
+        """Return the per-source rate limit as a dict, or None if rate_config is unavailable"""
+        rate_config = self.find_map("rate_config")
+        if not rate_config:
+            return None
+        value = rate_config.lookup(struct.pack("=I", 0))
+        if not value:
+            return dict.fromkeys(RATE_LIMIT_FIELDS, 0)
+        return dict(zip(RATE_LIMIT_FIELDS, struct.unpack_from(RATE_LIMIT_FORMAT, value)))
+    
+    def set_rate_limit(self, pps=0, bps=0, pps_burst=None, bps_burst=None, promote_after=0):
+        """Configure the per-source token buckets enforced in XDP.
+        
+        Rates of 0 leave that dimension unlimited; bursts default to one
+        second worth of traffic. Sources with promote_after packets over
+        budget are added to blocked_ips by the program itself.
+        """
+        rate_config = self.find_map("rate_config")
+        if not rate_config:
+            return False
+        
+        limit = {"pps": pps, "bps": bps,
+                 "pps_burst": pps if pps_burst is None else pps_burst,
+                 "bps_burst": bps if bps_burst is None else bps_burst,
+                 "promote_after": promote_after}
+        for name, value in limit.items():
+            if value < 0 or value > 2 ** 64 - 1:
+                raise ValueError(f"{name} out of range: {value}")
+        for rate, burst in (("pps", "pps_burst"), ("bps", "bps_burst")):
+            if limit[rate] and not 0 < limit[burst] <= MAX_BURST:
+                raise ValueError(f"{burst} must be between 1 and {MAX_BURST}")
+        
+        rate_config.update(struct.pack("=I", 0),
+                           struct.pack(RATE_LIMIT_FORMAT, *(limit[f] for f in RATE_LIMIT_FIELDS)))
+        return True
+    
+    def get_rate_limited_sources(self, count=10):
+        """Return the sources with the most packets over budget as (ip, dropped) pairs"""
+        rate_state = self.find_map("rate_state")
+        if not rate_state:
+            return None
+        
+        limited = ((key, struct.unpack_from(RATE_BUCKET_FORMAT, value)[3])
+                   for key, value in rate_state.items())
+        return [(self.key_to_ip(key), dropped)
+                for key, dropped in heapq.nlargest(count, limited, key=lambda item: item[1])
+                if dropped]
+    
+    def print_rate_limit(self):
+        """Print the rate limit configuration and the most limited sources"""
+        limit = self.get_rate_limit()
+        if limit is None:
+            print("Error: Could not find rate_config BPF map")
+            print("Make sure XDP program is loaded")
+            return False
+        
+        if not limit["pps"] and not limit["bps"]:
+            print("Rate limiting: disabled")
+        else:
+            print("Rate limiting per source:")
+            if limit["pps"]:
+                print(f"  Packets: {limit['pps']:,}/s, burst {limit['pps_burst']:,}")
+            if limit["bps"]:
+                print(f"  Bytes:   {limit['bps']:,}/s, burst {limit['bps_burst']:,}")
+            if limit["promote_after"]:
+                print(f"  Promote to blocked_ips after {limit['promote_after']:,} dropped packets")
+            else:
+                print("  Promotion to blocked_ips: disabled")
+        
+        limited = self.get_rate_limited_sources() or []
+        if limited:
+            print("Most limited sources:")
+            for ip, dropped in limited:
+                print(f"  {ip:<15} {dropped:>14,} dropped")
+        return True
+    
+    def get_event_sampling(self):
+        """Return the drop event sample rate (1 in N drops, 0 = disabled), or None"""
+        event_sampling = self.find_map("event_sampling")
+        if not event_sampling:
+            return None
+        value = event_sampling.lookup(struct.pack("=I", 0))
+        return struct.unpack_from("=I", value)[0] if value else 0
+    
+    def set_event_sampling(self, rate):
+        """Report 1 in rate drops to the drop_events ring buffer, 0 disables it"""
+        event_sampling = self.find_map("event_sampling")
+        if not event_sampling:
+            return False
+        event_sampling.update(struct.pack("=I", 0), struct.pack("=I", rate))
+        return True
+    
+    def is_blocked(self, ip):
+        """Return True if ip is in the blocked list, None if the map is unavailable"""
+        blocked_ips = self.find_blocked_ips_map()
+        if not blocked_ips:
+            return None
+        key = self.ip_to_key(ip)
+        blocked_ips = self.find_host_map(key)
+        if not blocked_ips:
+            return False
+        value = blocked_ips.lookup(key)
+        if value is not None and not is_expired(value_expiry(value)):
+            return True
+        
+        blocked_cidrs = self.find_map(RANGE_MAPS[key_version(key)])
+        if not blocked_cidrs:
+            return False
+        host = ipaddress.ip_network(self.key_to_ip(key))
+        return blocked_cidrs.lookup(self.network_to_key(host)) is not None
+    
+    def check_blocked_ip(self, ip):
+        """Report whether an IP is blocked"""
+        blocked = self.is_blocked(ip)
+        if blocked is None:
+            print("Error: Could not find blocked_ips BPF map")
+        elif blocked:
+            print(f"IP {ip} is blocked")
         else:
-            print(f"Error listing blocked IPs: {stderr}")
+            print(f"IP {ip} is not blocked")
+        return blocked
     
     def clear_all_blocked_ips(self):
         """Clear all blocked IPs"""
         print("Clearing all blocked IPs...")
         
-        map_id = self.find_blocked_ips_map()
-        if not map_id:
+        blocked_ips = self.find_blocked_ips_map()
+        if not blocked_ips:
             print("Error: Could not find blocked_ips BPF map")
             return False
         
-        # First get all keys
-        cmd = f"bpftool map dump id {map_id}"
-        stdout, stderr, code = self.run_command(cmd)
-        
-        if code != 0:
-            print(f"Error reading map: {stderr}")
-            return False
-        
-        # Extract and delete each key
-        lines = stdout.split('\n')
         deleted_count = 0
-        
-        for line in lines:
-            if 'key:' in line:
-                try:
-                    key_part = line.split('key:')[1].split('value:')[0].strip()
-                    hex_key = key_part.replace(' ', '')
-                    
-                    # Delete this key
-                    cmd = f"bpftool map delete id {map_id} key hex {hex_key}"
-                    _, _, code = self.run_command(cmd)
-                    if code == 0:
-                        deleted_count += 1
-                except Exception:
-                    continue
+        total = 0
+        maps = [self.find_map(name) for name in (*HOST_MAPS.values(), *RANGE_MAPS.values())]
+        for bpf_map in maps:
+            if not bpf_map:
+                continue
+            # First get all keys, then delete them in a single batch
+            try:
+                keys = [key for key, _ in bpf_map.items()]
+            except OSError as e:
+                print(f"Error reading map: {e.strerror}")
+                return False
+            
+            results = bpf_map.delete_batch(keys)
+            deleted_count += sum(1 for ok, _ in results if ok)
+            total += len(keys)
         
         print(f"✓ Cleared {deleted_count} blocked IPs")
-        return True
+        return deleted_count == total
+
+def expiry_value(ttl=None):
+    """blocked_ips value for a block lasting ttl seconds, permanent if ttl is None"""
+    if not ttl:
+        return BLOCKED_VALUE
+    return struct.pack("=Q", time.monotonic_ns() + int(ttl * 1e9))
+
+def value_expiry(value):
+    """Expiry in monotonic nanoseconds stored in a blocked_ips value, 0 if permanent"""
+    return struct.unpack_from("=Q", value)[0]
+
+def is_expired(expiry, now=None):
+    """True if a blocked_ips expiry has passed"""
+    return expiry != 0 and expiry <= (now or time.monotonic_ns())
+
+def parse_ttl(text):
+    """Parse a TTL such as 90, 30s, 15m, 2h or 1d into seconds"""
+    unit = text[-1:].lower()
+    seconds = float(text[:-1]) * TTL_UNITS[unit] if unit in TTL_UNITS else float(text)
+    if not 0 < seconds < 10 ** 9:
+        raise ValueError(f"invalid TTL: {text}")
+    return seconds
+
+def format_ttl(seconds):
+    """Format seconds compactly, e.g. 900 -> 15m, 5430 -> 1h30m30s"""
+    if seconds < 1:
+        return f"{seconds:g}s"
+    parts = []
+    remaining = int(seconds)
+    for unit, size in sorted(TTL_UNITS.items(), key=lambda item: -item[1]):
+        if remaining >= size:
+            count, remaining = divmod(remaining, size)
+            parts.append(f"{count}{unit}")
+    return "".join(parts)
+
+def describe_expiry(expiry, now):
+    """Suffix for listings: remaining time of an expiring block"""
+    if expiry == 0:
+        return ""
+    if expiry <= now:
+        return " (expired)"
+    return f" (expires in {format_ttl(max((expiry - now) // 10 ** 9, 1))})"
+
+def parse_port_ranges(args):
+    """Parse ports and start-end ranges into (ranges, invalid)"""
+    ranges, invalid = [], []
+    for arg in args:
+        try:
+            start, _, end = arg.partition("-")
+            port_range = (int(start), int(end or start))
+        except ValueError:
+            invalid.append(arg)
+            continue
+        if not 0 <= port_range[0] <= port_range[1] <= 65535:
+            invalid.append(arg)
+            continue
+        ranges.append(port_range)
+    return ranges, invalid
+
+def format_port_range(port_range):
+    """Format a (start, end) port range as 8080 or 8000-8100"""
+    start, end = port_range
+    return str(start) if start == end else f"{start}-{end}"
+
+def fill_map(bpf_map, batches, flags=0):
+    """Write lists of (key, value) pairs, one update batch per list.
+    
+    Returns (written, failures) where failures lists (key, error) pairs.
+    With NOEXIST, keys the map already holds are kept and not failures.
+    """
+    written = 0
+    failures = []
+    for batch in batches:
+        results = bpf_map.update_batch([key for key, _ in batch],
+                                       [value for _, value in batch], flags)
+        for (key, _), (ok, error) in zip(batch, results):
+            if ok:
+                written += 1
+            elif flags != NOEXIST or error != os.strerror(errno.EEXIST):
+                failures.append((key, error))
+    return written, failures
+
+def replay_blocklist(previous, staged, copied_keys):
+    """Carry changes made to the old generation during a copy over to the new one.
+    
+    copied_keys are the keys the copy read. Entries the old map gained
+    since are written with NOEXIST, so a newer value already in the staged
+    map wins, and entries it lost are deleted. Returns (added, deleted,
+    failures) as fill_map does.
+    """
+    # One pass over the old map: what it gained and what it lost since the copy
+    gone = set(copied_keys)
+    added = []
+    for batch in previous.item_batches():
+        for key, value in batch:
+            if key in gone:
+                gone.discard(key)
+            else:
+                added.append((key, value))
+    copied, failures = fill_map(staged, (added[i:i + GENERATION_BATCH]
+                                         for i in range(0, len(added), GENERATION_BATCH)), NOEXIST)
+    gone = sorted(gone)
+    deleted = sum(1 for ok, _ in staged.delete_batch(gone) if ok) if gone else 0
+    return copied, deleted, failures
+
+class KeySet:
+    """Compact set of fixed-width raw keys, kept as a sorted NumPy array.
+    
+    Members cost their key width (4 bytes for IPv4) instead of a Python
+    object each, so millions of addresses fit in a few megabytes.
+    """
+    
+    def __init__(self, width):
+        # NumPy is only needed for imports, keep it off the path of every command
+        import numpy as np
+        self.np = np
+        self.width = width
+        # Big-endian words compare like the network-order bytes they hold
+        self.dtype = np.dtype(">u4") if width == 4 else np.dtype(f"S{width}")
+        self.members = np.empty(0, dtype=self.dtype)
+    
+    def __len__(self):
+        return len(self.members)
+    
+    def add(self, packed):
+        """Add concatenated keys, returning (keys not seen before, duplicate count)"""
+        np = self.np
+        chunk = np.frombuffer(packed, dtype=self.dtype)
+        unique = np.unique(chunk)
+        pos = np.searchsorted(self.members, unique)
+        if len(self.members):
+            seen = self.members[np.minimum(pos, len(self.members) - 1)] == unique
+            unique, pos = unique[~seen], pos[~seen]
+        self.members = np.insert(self.members, pos, unique)
+        # tobytes() keeps trailing zero bytes that S16 items would drop
+        raw = unique.tobytes()
+        keys = [raw[i:i + self.width] for i in range(0, len(raw), self.width)]
+        return keys, len(chunk) - len(keys)
+
+def read_chunks(path, lines=FEED_CHUNK_LINES):
+    """Yield lists of up to lines lines of a file, or of stdin if path is -"""
+    with (open(sys.stdin.fileno(), errors="replace", closefd=False) if path == "-"
+          else open(path, errors="replace")) as f:
+        while True:
+            chunk = list(itertools.islice(f, lines))
+            if not chunk:
+                return
+            yield chunk
+
+def parse_feed(lines):
+    """Parse feed lines of IPs and CIDRs, skipping blanks and # comments.
+    
+    Returns ({4: packed IPv4 keys, 6: packed IPv6 keys}, networks, rejected
+    entries). Host-length CIDRs such as /32 count as addresses.
+    """
+    packed = {4: bytearray(), 6: bytearray()}
+    networks = []
+    rejected = []
+    for line in lines:
+        entry = line.split("#", 1)[0].strip() if "#" in line else line.strip()
+        if not entry:
+            continue
+        try:
+            if "/" in entry:
+                network = ipaddress.ip_network(entry, strict=False)
+                if network.prefixlen == ADDRESS_BITS[network.version]:
+                    packed[network.version] += network.network_address.packed
+                else:
+                    networks.append(network)
+            elif ":" in entry:
+                packed[6] += socket.inet_pton(socket.AF_INET6, entry)
+            else:
+                packed[4] += socket.inet_pton(socket.AF_INET, entry)
+        except (OSError, ValueError):
+            rejected.append(entry)
+    return packed, networks, rejected
+
+def source_rates(first, second, elapsed):
+    """Per-source rates between two get_source_stats() reads.
+    
+    Returns (key, pps, bps, packets, bytes) rows for the sources of the
+    second read.
+    """
+    rows = []
+    for key, (packets, nbytes) in second.items():
+        prev_packets, prev_bytes = first.get(key, (0, 0))
+        if prev_packets > packets:
+            # Evicted and re-inserted between the reads, counters restarted
+            prev_packets, prev_bytes = 0, 0
+        rows.append((key, (packets - prev_packets) / elapsed,
+                     (nbytes - prev_bytes) / elapsed, packets, nbytes))
+    return rows
+
+def heaviest_sources(rows, count=10, by="packets"):
+    """The count source_rates() rows with the highest packet or byte rate"""
+    rank = 1 if by == "packets" else 2
+    return heapq.nlargest(count, rows, key=lambda row: (row[rank], row[rank + 2]))
+
+def describe_write_error(bpf_map, error):
+    """Explain the E2BIG a full hash map returns for a new key"""
+    if error == os.strerror(errno.E2BIG):
+        return f"{bpf_map.name} is full ({bpf_map.max_entries:,} entries)"
+    return error
+
+def key_version(key):
+    """IP version of a raw host key: 4-byte keys are IPv4, 16-byte keys IPv6"""
+    return 6 if len(key) == 16 else 4
+
+def merge_reports(report, other):
+    """Combine the convergence reports of the IPv4 and IPv6 maps"""
+    if report is None:
+        return other
+    return {name: report[name] + other[name] for name in report}
+
+def networks_to_ranges(networks):
+    """Convert networks of one IP version to inclusive (first, last) integer ranges"""
+    return [(int(n.network_address), int(n.broadcast_address)) for n in networks]
+
+def rules_to_ranges(hosts, prefixes, bits=32):
+    """Convert blocked_ips and blocked_cidrs keys to (host ints, ranges)"""
+    ranges = []
+    for key in prefixes:
+        prefixlen = struct.unpack_from("=I", key)[0]
+        start = int.from_bytes(key[4:], "big")
+        ranges.append((start, start + (1 << (bits - prefixlen)) - 1))
+    return [int.from_bytes(key, "big") for key in hosts], ranges
+
+def merge_ranges(ranges, hosts=()):
+    """Merge ranges and single host addresses into sorted disjoint ranges.
+    
+    Overlapping and adjacent ranges are joined. Hosts are plain integers,
+    kept apart from ranges because they are usually the bulk of the input.
+    """
+    merged = []
+    spans = sorted(ranges)
+    cur_start = cur_end = -2
+    
+    def push(start, end):
+        nonlocal cur_start, cur_end
+        if start <= cur_end + 1:
+            cur_end = max(cur_end, end)
+        else:
+            if cur_end >= 0:
+                merged.append((cur_start, cur_end))
+            cur_start, cur_end = start, end
+    
+    i = 0
+    for host in sorted(hosts):
+        while i < len(spans) and spans[i][0] < host:
+            push(*spans[i])
+            i += 1
+        if host <= cur_end + 1:
+            cur_end = max(cur_end, host)
+        else:
+            if cur_end >= 0:
+                merged.append((cur_start, cur_end))
+            cur_start = cur_end = host
+    for start, end in spans[i:]:
+        push(start, end)
+    if cur_end >= 0:
+        merged.append((cur_start, cur_end))
+    return merged
+
+def subtract_ranges(ranges, holes):
+    """Remove merged holes from merged ranges"""
+    result = []
+    first_hole = 0
+    for start, end in ranges:
+        while first_hole < len(holes) and holes[first_hole][1] < start:
+            first_hole += 1
+        i = first_hole
+        while i < len(holes) and holes[i][0] <= end:
+            if holes[i][0] > start:
+                result.append((start, holes[i][0] - 1))
+            start = max(start, holes[i][1] + 1)
+            i += 1
+        if start <= end:
+            result.append((start, end))
+    return result
+
+def ranges_to_rules(ranges, bits=32):
+    """Split merged ranges into the fewest aligned prefixes.
+    
+    Returns (blocked_ips keys, blocked_cidrs keys): full-length prefixes
+    (/32, or /128 with bits=128) become exact keys, wider prefixes become
+    LPM keys.
+    """
+    width = bits // 8
+    hosts = set()
+    prefixes = set()
+    for start, end in ranges:
+        if start == end:
+            hosts.add(start.to_bytes(width, "big"))
+            continue
+        while start <= end:
+            # Largest aligned block that starts at start and fits the range
+            size = start & -start if start else 1 << bits
+            while size > end - start + 1:
+                size >>= 1
+            prefixlen = bits + 1 - size.bit_length()
+            if prefixlen == bits:
+                hosts.add(start.to_bytes(width, "big"))
+            else:
+                prefixes.add(struct.pack("=I", prefixlen) + start.to_bytes(width, "big"))
+            start += size
+    return hosts, prefixes
+
+def parse_ranges(lines):
+    """Parse IP/CIDR lines, skipping blanks and # comments.
+    
+    Returns (host ints, ranges, invalid entries).
+    """
+    hosts = []
+    ranges = []
+    invalid = []
+    for line in lines:
+        entry = line.split("#", 1)[0].strip() if "#" in line else line.strip()
+        if not entry:
+            continue
+        try:
+            if "/" in entry:
+                network = ipaddress.IPv4Network(entry, strict=False)
+                ranges.append((int(network.network_address), int(network.broadcast_address)))
+            else:
+                hosts.append(int.from_bytes(socket.inet_pton(socket.AF_INET, entry), "big"))
+        except (OSError, ValueError):
+            invalid.append(entry)
+    return hosts, ranges, invalid
+
+def load_sync_state(path, digest):
+    """Return the rule set cached for a file digest, or None"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < 40 or data[:32] != digest:
+        return None
+    
+    n_hosts, n_prefixes = struct.unpack_from("=II", data, 32)
+    hosts_end = 40 + n_hosts * 4
+    if len(data) != hosts_end + n_prefixes * 8:
+        return None
+    return ({data[i:i + 4] for i in range(40, hosts_end, 4)},
+            {data[i:i + 8] for i in range(hosts_end, len(data), 8)})
+
+def save_sync_state(path, digest, rules):
+    """Cache the rule set written for a file digest"""
+    hosts, prefixes = rules
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(digest + struct.pack("=II", len(hosts), len(prefixes)))
+            f.write(b"".join(sorted(hosts)) + b"".join(sorted(prefixes)))
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Warning: could not save sync state: {e.strerror}")
+
+def parse_networks(entries):
+    """Parse IPv4/IPv6 address and CIDR strings, returning (networks, invalid entries)"""
+    networks = []
+    invalid = []
+    for entry in entries:
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            invalid.append(entry)
+    return networks, invalid
+
+def print_results(results, done_verb, error_verb):
+    """Print per-IP results of a batch operation"""
+    ok_count = 0
+    for ip, ok, error in results:
+        if ok:
+            ok_count += 1
+            print(f"  ✓ {ip}")
+        else:
+            print(f"  ✗ {ip}: {error}")
+    print(f"✓ Successfully {done_verb} {ok_count}/{len(results)} IPs"
+          if ok_count == len(results) else
+          f"✗ Error {error_verb} {len(results) - ok_count}/{len(results)} IPs")
 
 def print_usage():
     """Print usage information"""
     print("XDP Dynamic IP Blocker")
     print("=" * 30)
-    print("Usage: python3 ip_manager.py <command> [arguments]")
+    print("Usage: python3 ip_manager.py [--direct] [--backend auto|syscall|bpftool|demo] <command> [arguments]")
     print("")
     print("Commands:")
-    print("  add <IP>     - Block an IP address")
-    print("  remove <IP>  - Unblock an IP address")
+    print("  add <IP|CIDR> [--ttl 15m]")
+    print("               - Block an IP address or range, an IP optionally")
+    print("                 only for a while (s, m, h or d)")
+    print("  remove <IP|CIDR>  - Unblock an IP address or range")
+    print("  add-many <IP|CIDR> [...] | -f <file> [--ttl 15m]")
+    print("               - Block several IPs in one batch")
+    print("  remove-many <IP|CIDR> [...] | -f <file>")
+    print("               - Unblock several IPs in one batch")
+    print("  sync <file>  - Make the blocked list match a file of IPs/CIDRs,")
+    print("                 writing only the differences")
+    print("  replace <file> [--capacity N]")
+    print("               - Swap in a new list of IPv4 addresses atomically,")
+    print("                 optionally in a map of another size")
+    print("  rollback     - Swap the list replaced last back in")
+    print("  import <file|-> [--replace] [--capacity N]")
+    print("               - Stream a large feed of IPs/CIDRs into the maps in batches;")
+    print("                 --replace swaps in its IPv4 addresses as a new generation")
+    print("                 and adds IPv6 addresses and ranges once that succeeded")
+    print("  check <IP>   - Show whether an IP address is blocked")
+    print("  stats [--per-cpu]")
+    print("               - Show packet counters, optionally per CPU")
+    print("  top [N] [--interval S] [--bytes]")
+    print("               - Show the N heaviest dropped sources (default 10)")
+    print("  ratelimit [show]")
+    print("               - Show the per-source rate limit and limited sources")
+    print("  ratelimit set [--pps N] [--pps-burst N] [--bps N] [--bps-burst N] [--promote-after N]")
+    print("               - Drop traffic above N packets or bytes per second per source,")
+    print("                 optionally blocking sources that keep exceeding it;")
+    print("                 options not given keep their current value")
+    print("  ratelimit off")
+    print("               - Disable rate limiting")
+    print("  port add|remove <tcp|udp> <port|start-end> [...]")
+    print("               - Drop or allow traffic to destination ports, live")
+    print("  port list [tcp|udp]")
+    print("               - List blocked destination ports")
+    print("  capacity     - Show entries and capacity of each blocklist map")
+    print("  expire       - Delete expired blocks now (the daemon does this itself)")
     print("  list         - List all blocked IPs")
     print("  clear        - Clear all blocked IPs")
     print("")
+    print("Commands are forwarded to blocklist_daemon.py when it is running;")
+    print("--direct always opens the maps from this process.")
+    print("")
     print("Examples:")
     print("  python3 ip_manager.py add 192.168.1.100")
     print("  python3 ip_manager.py remove 192.168.1.100")
+    print("  python3 ip_manager.py add 192.168.1.100 --ttl 15m")
+    print("  python3 ip_manager.py add 203.0.113.0/24")
+    print("  python3 ip_manager.py add-many 10.0.0.1 10.0.0.2 10.0.0.3")
+    print("  python3 ip_manager.py remove-many -f blocklist.txt")
+    print("  python3 ip_manager.py sync /etc/xdp/blocklist.txt")
+    print("  python3 ip_manager.py replace feed.txt --capacity 1000000")
+    print("  curl -s https://example.org/feed.txt | python3 ip_manager.py import - --replace")
+    print("  python3 ip_manager.py top 20 --interval 5")
+    print("  python3 ip_manager.py port add tcp 8080 8443 9000-9100")
+    print("  python3 ip_manager.py ratelimit set --pps 1000 --promote-after 100000")
     print("  python3 ip_manager.py list")
     print("  python3 ip_manager.py clear")
+    print("  python3 ip_manager.py --backend bpftool list")
+
+def read_ip_args(args):
+    """Collect IPs from the command line or from a file given with -f"""
+    if len(args) == 2 and args[0] == "-f":
+        with open(args[1], "r") as f:
+            return [line.strip() for line in f
+                    if line.strip() and not line.startswith("#")]
+    return args
+
+def run_via_daemon(client, command, args, ttl=None):
+    """Execute a command through the blocklist daemon, return None if unsupported"""
+    options = {"ttl": ttl} if ttl else {}
+    if command in ("add", "remove") and len(args) == 1 and "/" not in args[0]:
+        response = client.request(command, ips=args, **options)
+        if not response["ok"]:
+            print(f"✗ Error {'blocking' if command == 'add' else 'unblocking'} IP: {response['error']}")
+            return False
+        ip, ok, error = response["results"][0]
+        if ok:
+            print(f"✓ Successfully {'blocked' if command == 'add' else 'unblocked'} IP: {ip}")
+        else:
+            print(f"✗ Error {'blocking' if command == 'add' else 'unblocking'} IP: {error}")
+        return ok
+    
+    if command in ("add", "remove", "add-many", "remove-many") and args:
+        op = command.split("-")[0]
+        response = client.request(op, ips=read_ip_args(args), **options)
+        if "report" in response:
+            report = response["report"]
+            print(f"Rule set: {report['before']} entries before aggregation, {report['after']} after "
+                  f"({report['hosts']} exact, {report['after'] - report['hosts']} ranges)")
+            for network, _, error in report["failures"]:
+                print(f"  ✗ {network}: {error}")
+            print("✓ Blocked networks updated" if response["ok"]
+                  else f"✗ Error: {response.get('error', 'some entries failed')}")
+            return response["ok"]
+        if not response["ok"]:
+            print(f"✗ Error: {response['error']}")
+            return False
+        results = [tuple(result) for result in response["results"]]
+        print_results(results, *(("blocked", "blocking") if op == "add"
+                                 else ("unblocked", "unblocking")))
+        return all(ok for _, ok, _ in results)
+    
+    if command == "check" and len(args) == 1:
+        response = client.request("check", ips=args)
+        if not response["ok"]:
+            print(f"Error checking IP: {response['error']}")
+            return False
+        ip, blocked = response["results"][0]
+        print(f"IP {ip} is {'blocked' if blocked else 'not blocked'}")
+        return True
+    
+    if command == "list":
+        response = client.request("list")
+        if not response["ok"]:
+            print(f"Error listing blocked IPs: {response['error']}")
+            return False
+        if not response["ips"] and not response["networks"]:
+            print("No IPs currently blocked")
+            return True
+        print("Currently blocked IPs:")
+        print("-" * 30)
+        now = time.monotonic_ns()
+        ttls = response.get("ttls", {})
+        for ip in response["ips"]:
+            expiry = now + int(ttls[ip] * 1e9) if ip in ttls else 0
+            print(f"  - {ip}{describe_expiry(expiry, now)}")
+        if response["networks"]:
+            print("Currently blocked ranges:")
+            print("-" * 30)
+            for network in response["networks"]:
+                print(f"  - {network}")
+        return True
+    
+    if command == "clear":
+        response = client.request("clear")
+        if not response["ok"]:
+            print(f"Error clearing blocked IPs: {response['error']}")
+            return False
+        print(f"✓ Cleared {response['cleared']} blocked IPs")
+        return response["cleared"] == response["total"]
+    
+    return None
 
 def main():
+    backend = "auto"
+    direct = False
+    while len(sys.argv) > 1 and sys.argv[1].startswith("--"):
+        if sys.argv[1] == "--direct":
+            direct = True
+            del sys.argv[1]
+        elif sys.argv[1] == "--backend" and len(sys.argv) > 2:
+            backend = sys.argv[2]
+            direct = True
+            del sys.argv[1:3]
+            if backend != "auto" and backend not in BACKENDS:
+                print(f"Error: Unknown backend '{backend}'")
+                sys.exit(1)
+        else:
+            break
+    
     if len(sys.argv) < 2:
         print_usage()
         sys.exit(1)
     
-    manager = XDPIPManager()
     command = sys.argv[1].lower()
     
+    ttl = None
+    if "--ttl" in sys.argv[2:]:
+        index = sys.argv.index("--ttl", 2)
+        try:
+            ttl = parse_ttl(sys.argv[index + 1])
+        except (IndexError, ValueError):
+            print("Error: --ttl needs a duration such as 30s, 15m, 2h or 1d")
+            sys.exit(1)
+        del sys.argv[index:index + 2]
+        if command not in ("add", "add-many"):
+            print("Error: --ttl only applies to add and add-many")
+            sys.exit(1)
+    
+    # Imported here: the daemon itself is built on XDPIPManager
+    from blocklist_daemon import DaemonClient
+    client = None if direct else DaemonClient.connect()
+    if client:
+        try:
+            ok = run_via_daemon(client, command, sys.argv[2:], ttl)
+        finally:
+            client.close()
+        if ok is not None:
+            sys.exit(0 if ok else 1)
+    
+    manager = XDPIPManager(backend)
+    
+    if command in ("add", "remove", "add-many", "remove-many") and \
+            any("/" in arg for arg in read_ip_args(sys.argv[2:])):
+        # CIDR ranges go through the aggregated blocked_cidrs path
+        if ttl:
+            print("Error: --ttl applies to single IPs only, ranges are permanent")
+            sys.exit(1)
+        networks, invalid = parse_networks(read_ip_args(sys.argv[2:]))
+        if invalid:
+            print(f"Error: Invalid IP address format: {', '.join(invalid)}")
+            sys.exit(1)
+        if command.startswith("add"):
+            ok = manager.add_blocked_networks(networks)
+        else:
+            ok = manager.remove_blocked_networks(networks)
+        sys.exit(0 if ok else 1)
+    
     if command == "add":
         if len(sys.argv) != 3:
             print("Error: Please provide an IP address")
-            print("Usage: python3 ip_manager.py add <IP>")
+            print("Usage: python3 ip_manager.py add <IP> [--ttl 15m]")
             sys.exit(1)
         
         ip = sys.argv[2]
         try:
-            socket.inet_aton(ip)  # Validate IP format
-            manager.add_blocked_ip(ip)
+            manager.ip_to_key(ip)  # Validate IP format
+            manager.add_blocked_ip(ip, ttl)
         except socket.error:
             print(f"Error: Invalid IP address format: {ip}")
     
@@ -223,16 +1893,191 @@ def main():
         
         ip = sys.argv[2]
         try:
-            socket.inet_aton(ip)  # Validate IP format
+            manager.ip_to_key(ip)  # Validate IP format
             manager.remove_blocked_ip(ip)
         except socket.error:
             print(f"Error: Invalid IP address format: {ip}")
     
+    elif command in ("add-many", "remove-many"):
+        if len(sys.argv) < 3:
+            print("Error: Please provide one or more IP addresses")
+            print(f"Usage: python3 ip_manager.py {command} <IP> [IP ...] | -f <file>")
+            sys.exit(1)
+        
+        ips = read_ip_args(sys.argv[2:])
+        if command == "add-many":
+            results = manager.add_blocked_ips(ips, ttl)
+        else:
+            results = manager.remove_blocked_ips(ips)
+        if not all(ok for _, ok, _ in results):
+            sys.exit(1)
+    
+    elif command == "sync":
+        if len(sys.argv) != 3:
+            print("Error: Please provide a blocklist file")
+            print("Usage: python3 ip_manager.py sync <file>")
+            sys.exit(1)
+        
+        if not manager.sync_from_file(sys.argv[2]):
+            sys.exit(1)
+    
+    elif command in ("replace", "import"):
+        args = sys.argv[2:]
+        replace = command == "replace"
+        if command == "import" and "--replace" in args:
+            args.remove("--replace")
+            replace = True
+        capacity = None
+        if "--capacity" in args:
+            index = args.index("--capacity")
+            try:
+                capacity = int(args[index + 1])
+                if capacity < 1:
+                    raise ValueError(capacity)
+            except (IndexError, ValueError):
+                print("Error: --capacity needs a positive number of entries")
+                sys.exit(1)
+            del args[index:index + 2]
+        if capacity and not replace:
+            print("Error: --capacity applies to replace and import --replace")
+            sys.exit(1)
+        if len(args) != 1:
+            print("Error: Please provide a file of IP addresses")
+            print("Usage: python3 ip_manager.py replace <file> [--capacity N]")
+            print("       python3 ip_manager.py import <file|-> [--replace] [--capacity N]")
+            sys.exit(1)
+        
+        if command == "import":
+            ok = manager.print_import(args[0], replace, capacity)
+        else:
+            ok = manager.replace_blocked_ips(args[0], capacity)
+        if not ok:
+            sys.exit(1)
+    
+    elif command == "rollback":
+        if not manager.print_rollback():
+            sys.exit(1)
+    
+    elif command == "check":
+        if len(sys.argv) != 3:
+            print("Error: Please provide an IP address")
+            print("Usage: python3 ip_manager.py check <IP>")
+            sys.exit(1)
+        
+        try:
+            manager.check_blocked_ip(sys.argv[2])
+        except OSError:
+            print(f"Error: Invalid IP address format: {sys.argv[2]}")
+    
+    elif command == "stats":
+        per_cpu = "--per-cpu" in sys.argv[2:]
+        if not manager.print_stats(per_cpu):
+            sys.exit(1)
+    
+    elif command == "top":
+        args = sys.argv[2:]
+        count, interval, by = 10, 1.0, "packets"
+        try:
+            while args:
+                if args[0] == "--bytes":
+                    by = "bytes"
+                    args = args[1:]
+                elif args[0] == "--interval" and len(args) > 1:
+                    interval = float(args[1])
+                    args = args[2:]
+                else:
+                    count = int(args[0])
+                    args = args[1:]
+            if count < 1 or interval <= 0:
+                raise ValueError(count, interval)
+        except ValueError:
+            print("Usage: python3 ip_manager.py top [N] [--interval S] [--bytes]")
+            sys.exit(1)
+        
+        if not manager.print_top(count, interval, by):
+            sys.exit(1)
+    
+    elif command == "ratelimit":
+        action = sys.argv[2] if len(sys.argv) > 2 else "show"
+        if action == "show":
+            ok = manager.print_rate_limit()
+        elif action == "off":
+            ok = manager.set_rate_limit()
+            print("✓ Rate limiting disabled" if ok else "Error: Could not find rate_config BPF map")
+        elif action == "set":
+            options = {"--pps": "pps", "--pps-burst": "pps_burst", "--bps": "bps",
+                       "--bps-burst": "bps_burst", "--promote-after": "promote_after"}
+            args = sys.argv[3:]
+            changes = {}
+            try:
+                while args:
+                    if args[0] not in options or len(args) < 2:
+                        raise ValueError(f"unknown option '{args[0]}'")
+                    changes[options[args[0]]] = int(args[1])
+                    args = args[2:]
+                # Options not given keep their current value; a new rate
+                # without a burst gets the default burst for that rate
+                limit = manager.get_rate_limit()
+                ok = limit is not None
+                if ok:
+                    for rate in ("pps", "bps"):
+                        if rate in changes and f"{rate}_burst" not in changes:
+                            del limit[f"{rate}_burst"]
+                    limit.update(changes)
+                    ok = manager.set_rate_limit(**limit)
+            except ValueError as e:
+                print(f"Error: {e}")
+                sys.exit(1)
+            if ok:
+                manager.print_rate_limit()
+            else:
+                print("Error: Could not find rate_config BPF map")
+        else:
+            print(f"Error: Unknown ratelimit action '{action}'")
+            print("Usage: python3 ip_manager.py ratelimit [show|set|off]")
+            sys.exit(1)
+        if not ok:
+            sys.exit(1)
+    
+    elif command == "port":
+        args = sys.argv[2:]
+        action = args[0] if args else "list"
+        protos = [arg.lower() for arg in args[1:2]]
+        if action not in ("add", "remove", "list") or \
+                any(proto not in PORT_PROTOCOLS for proto in protos) or \
+                (action != "list" and len(args) < 3):
+            print("Usage: python3 ip_manager.py port add|remove <tcp|udp> <port|start-end> [...]")
+            print("       python3 ip_manager.py port list [tcp|udp]")
+            sys.exit(1)
+        
+        if action == "list":
+            ok = manager.list_blocked_ports(protos)
+        else:
+            ranges, invalid = parse_port_ranges(args[2:])
+            if invalid:
+                print(f"Error: Invalid port or range: {', '.join(invalid)}")
+                sys.exit(1)
+            ok = manager.change_blocked_ports(protos[0], ranges, action == "add")
+        if not ok:
+            sys.exit(1)
+    
+    elif command == "capacity":
+        if not manager.print_capacity():
+            sys.exit(1)
+    
+    elif command == "expire":
+        expired = manager.expire_blocked_ips()
+        if expired is None:
+            print("Error: Could not find blocked_ips BPF map")
+            sys.exit(1)
+        print(f"✓ Removed {expired} expired blocks")
+    
     elif command == "list":
         manager.list_blocked_ips()
     
     elif command == "clear":
-        manager.clear_all_blocked_ips()
+        if not manager.clear_all_blocked_ips():
+            sys.exit(1)
     
     else:
         print(f"Error: Unknown command '{command}'")
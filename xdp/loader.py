@@ -2,68 +2,494 @@
 import os
 import sys
 import time
-import socket
-import struct
-from pyroute2 import IPRoute
+import errno
+import hashlib
+from pyroute2 import IPRoute, NetlinkError
 
-def load_xdp_program():
-    # Compile XDP program
-    os.chdir('/xdp')
-    os.system('make clean && make')
+import bpf_syscall
+from map_backends import PIN_DIR, PROG_ID_FILE
+
+BUILD_DIR = "/xdp"
+OBJECT_FILE = "xdp_filter.o"
+# Inputs whose content decides whether xdp_filter.o must be rebuilt
+BUILD_INPUTS = ("xdp_filter.c", "Makefile")
+BUILD_HASH_FILE = "xdp_filter.o.sha256"
+
+PROG_PIN = os.path.join(PIN_DIR, "xdp_prog")
+# The replacement program is pinned here until it is live everywhere
+# (bpffs does not allow dots in names)
+RELOAD_PIN = os.path.join(PIN_DIR, "xdp_prog_next")
+BLOCKLIST_PIN = os.path.join(PIN_DIR, "blocked_ips")
+PINNED_MAPS = ("blocked_ips", "blocklist_gen", "blocked_cidrs", "blocked_ips6", "blocked_cidrs6",
+               "port_bitmap", "pkt_count", "src_stats",
+               "rate_config", "rate_state", "drop_events", "event_sampling")
+# Pinned by ip_manager.py, not by the load: the blocked_ips generation
+# replaced last, kept for rollback
+GENERATION_PINS = ("blocked_ips_prev",)
+
+# XDP attach flags (include/uapi/linux/if_link.h)
+XDP_FLAGS_UPDATE_IF_NOEXIST = 1
+XDP_FLAGS_SKB_MODE = 2
+XDP_FLAGS_DRV_MODE = 4
+XDP_FLAGS_HW_MODE = 8
+# Replace only if IFLA_XDP_EXPECTED_FD is still the attached program
+XDP_FLAGS_REPLACE = 16
+XDP_MODES = {
+    "offload": XDP_FLAGS_HW_MODE,
+    "native": XDP_FLAGS_DRV_MODE,
+    "generic": XDP_FLAGS_SKB_MODE,
+}
+# A mode that the interface rejects falls back to the next one in this order
+FALLBACK_ORDER = ("offload", "native", "generic")
+# IFLA_XDP_ATTACHED values, numeric or as named by newer pyroute2
+ATTACHED_MODES = {
+    1: "native", "xdp": "native",
+    2: "generic", "xdpgeneric": "generic",
+    3: "offload", "xdpoffload": "offload",
+}
+
+DEFAULT_INTERFACES = ["eth0"]
+
+# max_entries of blocked_ips on a fresh load, compiled in as MAX_BLOCKED_IPS
+DEFAULT_CAPACITY = 1024
+
+# Ports blocked right after loading; change them live with `ip_manager.py port`
+DEFAULT_BLOCKED_PORTS = {"tcp": [(8080, 8080)]}
+
+def source_hash(capacity):
+    """SHA-256 over the build inputs and the compiled-in capacity"""
+    digest = hashlib.sha256()
+    for name in BUILD_INPUTS:
+        with open(name, "rb") as f:
+            digest.update(f.read())
+    digest.update(f"MAX_BLOCKED_IPS={capacity}".encode())
+    return digest.hexdigest()
+
+def build_program(force=False, capacity=DEFAULT_CAPACITY):
+    """Compile xdp_filter.o unless its sources and capacity are unchanged since the last build"""
+    digest = source_hash(capacity)
+    if not force and os.path.exists(OBJECT_FILE):
+        try:
+            with open(BUILD_HASH_FILE) as f:
+                if f.read().strip() == digest:
+                    print(f"{OBJECT_FILE} is up to date, skipping build")
+                    return True
+        except OSError:
+            pass
     
-    if not os.path.exists('xdp_filter.o'):
-        print("Error: Could not compile xdp_filter.o")
-        sys.exit(1)
+    if os.system(f"make clean && make BPF_CFLAGS=-DMAX_BLOCKED_IPS={capacity}") != 0 \
+            or not os.path.exists(OBJECT_FILE):
+        return False
+    with open(BUILD_HASH_FILE, "w") as f:
+        f.write(digest + "\n")
+    return True
+
+def unpin(path):
+    """Remove a pin left over from a previous load"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def load_program(pin_path, maps_dir, dev=None):
+    """Load the object with bpftool, pinning the program and its maps.
     
-    # Get network interface
-    ipr = IPRoute()
+    Returns a file descriptor of the loaded program. With dev the program
+    and its maps are bound to that device for hardware offload.
+    """
+    os.makedirs(maps_dir, exist_ok=True)
+    unpin(pin_path)
+    for name in PINNED_MAPS + GENERATION_PINS:
+        unpin(os.path.join(maps_dir, name))
     
-    # Find eth0 interface
-    idx = None
+    cmd = f"bpftool prog load {OBJECT_FILE} {pin_path} type xdp pinmaps {maps_dir}"
+    if dev:
+        cmd += f" dev {dev}"
+    if os.system(cmd) != 0:
+        raise OSError(errno.EINVAL, f"bpftool could not load {OBJECT_FILE}")
+    return bpf_syscall.obj_get(pin_path)
+
+def load_reusing_maps(pin_path, maps_dir):
+    """Load the object so that it shares every map already pinned in maps_dir.
+    
+    Maps the new object adds are pinned next to the existing ones. Returns
+    a file descriptor of the loaded program.
+    """
+    unpin(pin_path)
+    reuse = [f"map name {name} pinned {os.path.join(maps_dir, name)}"
+             for name in PINNED_MAPS if os.path.exists(os.path.join(maps_dir, name))]
+    cmd = f"bpftool prog load {OBJECT_FILE} {pin_path} type xdp {' '.join(reuse)}"
+    if os.system(cmd) != 0:
+        raise OSError(errno.EINVAL, f"bpftool could not load {OBJECT_FILE} with the pinned maps")
+    prog_fd = bpf_syscall.obj_get(pin_path)
+    
+    for map_id in bpf_syscall.prog_map_ids(prog_fd):
+        with bpf_syscall.BPFMap.open_id(map_id) as bpf_map:
+            map_pin = os.path.join(maps_dir, bpf_map.name)
+            if bpf_map.name in PINNED_MAPS and not os.path.exists(map_pin):
+                bpf_syscall.obj_pin(bpf_map.fd, map_pin)
+                print(f"Pinned new map {bpf_map.name} at {map_pin}")
+    return prog_fd
+
+def find_interfaces(ipr, names):
+    """Map interface names to indexes, reporting the ones that do not exist"""
+    indexes = {}
     for link in ipr.get_links():
-        if link.get_attr('IFLA_IFNAME') == 'eth0':
-            idx = link['index']
-            break
+        name = link.get_attr("IFLA_IFNAME")
+        if name in names:
+            indexes[name] = link["index"]
     
-    if idx is None:
-        print("Error: eth0 interface not found")
-        sys.exit(1)
+    missing = [name for name in names if name not in indexes]
+    for name in missing:
+        print(f"Error: {name} interface not found")
+    return indexes, missing
+
+def attached_program(ipr, idx):
+    """Return (mode, prog_id) of the XDP program on an interface, or (None, 0)"""
+    xdp = ipr.get_links(idx)[0].get_attr("IFLA_XDP")
+    if not xdp:
+        return None, 0
+    mode = ATTACHED_MODES.get(xdp.get_attr("IFLA_XDP_ATTACHED"))
+    return mode, xdp.get_attr("IFLA_XDP_PROG_ID") or 0
+
+def set_xdp(ipr, idx, prog_fd, mode, expected_fd=None):
+    """Attach prog_fd (or detach with -1) in the given mode over netlink.
     
-    print(f"Loading XDP program on eth0 interface (index: {idx})")
+    With expected_fd the kernel swaps the programs in one step, and only
+    if expected_fd is the one attached; otherwise it fails with EEXIST.
+    """
+    flags = XDP_MODES[mode]
+    attrs = [("IFLA_XDP_FD", prog_fd)]
+    if expected_fd is not None:
+        flags |= XDP_FLAGS_REPLACE
+        attrs.append(("IFLA_XDP_EXPECTED_FD", expected_fd))
+    ipr.link("set", index=idx, xdp={"attrs": attrs + [("IFLA_XDP_FLAGS", flags)]})
+
+def attach_interface(ipr, name, idx, prog_fd, mode, fallback=True):
+    """Attach the program to one interface, falling back to slower modes.
     
-    # Load XDP program using ip link with pinned maps
-    cmd = f"ip link set dev eth0 xdp obj xdp_filter.o sec xdp"
-    result = os.system(cmd)
+    Returns the mode actually in use, or None if every attempt failed.
+    Programs for offload are device-bound, so that mode loads its own
+    copy pinned under PIN_DIR/offload/<interface>.
+    """
+    modes = FALLBACK_ORDER[FALLBACK_ORDER.index(mode):] if fallback else (mode,)
+    current, _ = attached_program(ipr, idx)
     
-    if result == 0:
-        print("XDP program loaded successfully")
+    for candidate in modes:
+        # The kernel refuses a second program in another mode on the same link
+        if current and current != candidate:
+            set_xdp(ipr, idx, -1, current)
+            current = None
         
-        # Pin the maps for external access
-        time.sleep(1)  # Wait for maps to be created
+        fd = prog_fd
+        try:
+            if candidate == "offload":
+                offload_dir = os.path.join(PIN_DIR, "offload", name)
+                fd = load_program(os.path.join(offload_dir, "xdp_prog"), offload_dir, dev=name)
+            set_xdp(ipr, idx, fd, candidate)
+        except (NetlinkError, OSError) as e:
+            reason = os.strerror(e.code) if isinstance(e, NetlinkError) else e.strerror
+            print(f"  {name}: {candidate} mode failed: {reason}")
+            continue
+        finally:
+            if fd != prog_fd:
+                os.close(fd)
         
-        # Get the program ID
-        get_prog_cmd = "ip link show eth0 | grep 'prog/xdp id' | awk '{print $4}'"
-        prog_id_output = os.popen(get_prog_cmd).read().strip()
+        mode_in_use, attached_id = attached_program(ipr, idx)
+        if candidate != mode:
+            print(f"  {name}: fell back from {mode} to {candidate} mode")
+        print(f"  {name}: attached in {mode_in_use or candidate} mode (prog id {attached_id})")
+        return candidate
+    return None
+
+def running_interfaces(ipr, prog_id):
+    """Return {name: index} of the interfaces the program is attached to"""
+    running = {}
+    for link in ipr.get_links():
+        xdp = link.get_attr("IFLA_XDP")
+        if xdp and xdp.get_attr("IFLA_XDP_PROG_ID") == prog_id:
+            running[link.get_attr("IFLA_IFNAME")] = link["index"]
+    return running
+
+def swap_program(ipr, targets, old_fd, old_id, new_fd, new_id):
+    """Replace the old program by the new one on every target interface.
+    
+    Each interface keeps its attach mode, and the replace names the old
+    program as the expected one, so the kernel swaps them in a single step
+    (packets see either the old or the new filter) and refuses if another
+    program was attached in the meantime. If any interface does not end up
+    running the new program the ones already switched are put back the same
+    way and False is returned; interfaces that cannot be put back are
+    reported and left as they are.
+    """
+    switched = []
+    for name, idx in targets.items():
+        mode, current_id = attached_program(ipr, idx)
+        error = None
+        if current_id != old_id:
+            error = f"running prog id {current_id}, expected {old_id}"
+        elif mode not in XDP_MODES:
+            error = "program attached in more than one mode"
+        else:
+            try:
+                set_xdp(ipr, idx, new_fd, mode, expected_fd=old_fd)
+                switched.append((name, idx, mode))
+                if attached_program(ipr, idx)[1] != new_id:
+                    error = "new program is not active after replace"
+            except NetlinkError as e:
+                if e.code == errno.EEXIST:
+                    error = f"prog id {old_id} was replaced by another program"
+                else:
+                    error = os.strerror(e.code)
         
-        if prog_id_output:
-            print(f"XDP program ID: {prog_id_output}")
-            
-            # Pin maps for external access
-            os.makedirs("/sys/fs/bpf/xdp_filter", exist_ok=True)
-            
-            # We'll use a different approach - save the program ID for ip_manager
-            with open("/tmp/xdp_prog_id", "w") as f:
-                f.write(prog_id_output)
+        if error:
+            print(f"  {name}: {error}, rolling back")
+            stuck = []
+            replaced = []
+            for rollback_name, rollback_idx, rollback_mode in switched:
+                try:
+                    set_xdp(ipr, rollback_idx, old_fd, rollback_mode, expected_fd=new_fd)
+                except NetlinkError as e:
+                    if e.code == errno.EEXIST:
+                        # Someone else replaced prog id new_id, leave theirs in place
+                        print(f"  {rollback_name}: prog id {new_id} was replaced by another "
+                              "program, not restoring")
+                        replaced.append(rollback_name)
+                        continue
+                    print(f"  {rollback_name}: could not restore prog id {old_id}: "
+                          f"{os.strerror(e.code)}")
+                    stuck.append(rollback_name)
+            if stuck:
+                print(f"Error: {', '.join(stuck)} still running prog id {new_id}")
+            if replaced:
+                print(f"Error: {', '.join(replaced)} running a program attached by someone else")
+            if not stuck and not replaced:
+                print(f"Prog id {old_id} is still active")
+            return False
+        print(f"  {name}: prog id {old_id} -> {new_id} ({mode} mode)")
+    return True
+
+def resize_blocklist(capacity):
+    """Publish a copy of blocked_ips with a new capacity as the active generation.
+    
+    The copy is filled in batches while the current map keeps filtering,
+    then swapped in through blocklist_gen. Changes made to the old map
+    until then are replayed after the swap: entries added, e.g. sources
+    the rate limiter promoted, are copied and entries removed or expired
+    are deleted. Returns True on success.
+    """
+    from ip_manager import XDPIPManager, replay_blocklist
+    manager = XDPIPManager("syscall")
+    copied_keys = set()
+    
+    def snapshot(batches):
+        for batch in batches:
+            copied_keys.update(key for key, _ in batch)
+            yield batch
+    
+    try:
+        active = manager.find_blocked_ips_map()
+        entries = active.count()
+        if entries > capacity:
+            print(f"Error: blocked_ips holds {entries:,} entries, more than --capacity {capacity:,}")
+            return False
         
-        print("\nStatistics available at:")
-        print("  - /sys/fs/bpf/")
-        print("\nTo view logs: cat /sys/kernel/debug/tracing/trace_pipe")
-    else:
-        print("Error loading XDP program")
+        start = time.monotonic()
+        staged = manager.stage_blocklist(snapshot(active.item_batches()), capacity)
+        print(f"Copied {entries:,} entries into a {capacity:,}-entry map "
+              f"({time.monotonic() - start:.2f}s)")
+        previous = manager.publish_blocklist(staged)
+        
+        copied, deleted, failures = replay_blocklist(previous, staged, copied_keys)
+    except OSError as e:
+        print(f"Error resizing blocked_ips: {e.strerror}")
+        return False
+    finally:
+        manager.close()
+    
+    print(f"Published map id {staged.id}, {copied:,} entries added and {deleted:,} removed "
+          "during the swap replayed"
+          + (f", {len(failures)} failed: {failures[0][1]}" if failures else ""))
+    return True
+
+def reload_xdp_program(interfaces=None, rebuild=False, capacity=None):
+    """Replace the running program without losing map state or protection.
+    
+    The new object reuses the pinned maps, so blocklists, counters and rate
+    limiter state carry over, and tools holding map handles keep working.
+    The old program stays pinned and attached until the new one is
+    verified active on every interface.
+    
+    With a capacity other than the current one, blocked_ips is first
+    resized through a generation swap, and the new program is built for
+    the new size.
+    """
+    start = time.monotonic()
+    os.chdir(BUILD_DIR)
+    
+    try:
+        old_fd = bpf_syscall.obj_get(PROG_PIN)
+    except OSError:
+        print(f"Error: no loaded program pinned at {PROG_PIN}, run loader.py first")
+        sys.exit(1)
+    old_id = bpf_syscall.prog_id(old_fd)
+    
+    ipr = IPRoute()
+    targets = running_interfaces(ipr, old_id)
+    if interfaces:
+        not_running = [name for name in interfaces if name not in targets]
+        if not_running:
+            print(f"Error: prog id {old_id} is not attached to {', '.join(not_running)}")
+            sys.exit(1)
+        targets = {name: targets[name] for name in interfaces}
+    if not targets:
+        print(f"Error: prog id {old_id} is not attached to any interface")
+        sys.exit(1)
+    
+    # The pinned blocked_ips can only be reused by a program built for its size
+    with bpf_syscall.BPFMap.open_pinned(BLOCKLIST_PIN) as blocked_ips:
+        current_capacity = blocked_ips.max_entries
+    capacity = capacity or current_capacity
+    if not build_program(force=rebuild, capacity=capacity):
+        print(f"Error: Could not compile {OBJECT_FILE}, keeping prog id {old_id}")
+        sys.exit(1)
+    
+    if capacity != current_capacity:
+        print(f"Resizing blocked_ips from {current_capacity:,} to {capacity:,} entries")
+        if not resize_blocklist(capacity):
+            print(f"Reload aborted, prog id {old_id} is still active")
+            sys.exit(1)
+    
+    try:
+        new_fd = load_reusing_maps(RELOAD_PIN, PIN_DIR)
+    except OSError as e:
+        print(f"Error loading new XDP program: {e.strerror}, keeping prog id {old_id}")
+        sys.exit(1)
+    new_id = bpf_syscall.prog_id(new_fd)
+    
+    print(f"Replacing prog id {old_id} with {new_id} on {', '.join(targets)}")
+    if not swap_program(ipr, targets, old_fd, old_id, new_fd, new_id):
+        unpin(RELOAD_PIN)
+        print("Reload aborted")
+        sys.exit(1)
+    
+    # Only now drop the last references to the old program
+    os.rename(RELOAD_PIN, PROG_PIN)
+    with open(PROG_ID_FILE, "w") as f:
+        f.write(str(new_id))
+    os.close(old_fd)
+    os.close(new_fd)
+    ipr.close()
+    print(f"\nReloaded in {time.monotonic() - start:.2f}s, map state preserved")
+
+def seed_port_policy():
+    """Block the default ports in the freshly created port_bitmap"""
+    from ip_manager import XDPIPManager
+    manager = XDPIPManager()
+    for proto, ranges in DEFAULT_BLOCKED_PORTS.items():
+        manager.change_blocked_ports(proto, ranges)
+    manager.close()
+
+def load_xdp_program(interfaces=None, mode="native", fallback=True, rebuild=False,
+                     capacity=None):
+    """Build, load and attach the filter to every interface in one run"""
+    start = time.monotonic()
+    interfaces = interfaces or DEFAULT_INTERFACES
+    capacity = capacity or DEFAULT_CAPACITY
+    os.chdir(BUILD_DIR)
+    
+    if not build_program(force=rebuild, capacity=capacity):
+        print(f"Error: Could not compile {OBJECT_FILE}")
+        sys.exit(1)
+    
+    ipr = IPRoute()
+    indexes, missing = find_interfaces(ipr, interfaces)
+    if missing:
         sys.exit(1)
+    
+    if os.path.exists(PROG_PIN):
+        print("Replacing the loaded program with fresh maps (use --reload to keep map state)")
+    try:
+        prog_fd = load_program(PROG_PIN, PIN_DIR)
+    except OSError as e:
+        print(f"Error loading XDP program: {e.strerror}")
+        sys.exit(1)
+    
+    prog_id = bpf_syscall.prog_id(prog_fd)
+    print(f"XDP program loaded (id {prog_id}), maps pinned at {PIN_DIR}/, "
+          f"blocked_ips holds up to {capacity:,} entries")
+    # Keep the program ID as a fallback for unpinned lookups
+    with open(PROG_ID_FILE, "w") as f:
+        f.write(str(prog_id))
+    seed_port_policy()
+    
+    print(f"Attaching to {', '.join(interfaces)} ({mode} mode requested)")
+    failed = []
+    for name in interfaces:
+        if not attach_interface(ipr, name, indexes[name], prog_fd, mode, fallback):
+            failed.append(name)
+    os.close(prog_fd)
+    ipr.close()
+    
+    if failed:
+        print(f"Error: could not attach XDP program to {', '.join(failed)}")
+        sys.exit(1)
+    
+    print(f"\nLoaded in {time.monotonic() - start:.2f}s")
+    print("\nStatistics available at:")
+    print(f"  - {PIN_DIR}/")
+    print("\nTo view drop events: python3 /xdp/drop_events.py")
+
+def print_usage():
+    print("Usage: python3 loader.py [INTERFACE ...] [--mode native|generic|offload] "
+          "[--no-fallback] [--rebuild] [--capacity N]")
+    print("       python3 loader.py --reload [INTERFACE ...] [--rebuild] [--capacity N]")
+    print("")
+    print("  INTERFACE        Interfaces to attach to (default: eth0), also comma separated")
+    print("  --mode MODE      Preferred attach mode (default: native)")
+    print("  --no-fallback    Fail instead of falling back offload -> native -> generic")
+    print("  --rebuild        Rebuild xdp_filter.o even if its sources are unchanged")
+    print(f"  --capacity N     Entries blocked_ips can hold (default: {DEFAULT_CAPACITY}, "
+          "or its current size with --reload)")
+    print("  --reload         Swap in the rebuilt program, keeping the pinned maps;")
+    print("                   with --capacity, blocked_ips is resized online")
 
 if __name__ == '__main__':
-    load_xdp_program()
+    interfaces = []
+    mode = "native"
+    fallback = True
+    rebuild = False
+    reload = False
+    capacity = None
+    
+    args = sys.argv[1:]
+    while args:
+        if args[0] == "--mode" and len(args) > 1 and args[1] in XDP_MODES:
+            mode = args[1]
+            args = args[2:]
+            continue
+        if args[0] == "--capacity" and len(args) > 1 and args[1].isdigit() and int(args[1]) > 0:
+            capacity = int(args[1])
+            args = args[2:]
+            continue
+        if args[0] == "--no-fallback":
+            fallback = False
+        elif args[0] == "--rebuild":
+            rebuild = True
+        elif args[0] == "--reload":
+            reload = True
+        elif args[0] in ("-h", "--help") or args[0].startswith("-"):
+            print_usage()
+            sys.exit(0 if args[0] in ("-h", "--help") else 1)
+        else:
+            interfaces.extend(name for name in args[0].split(",") if name)
+        args = args[1:]
+    
+    if reload:
+        reload_xdp_program(interfaces, rebuild, capacity)
+        sys.exit(0)
+    
+    load_xdp_program(interfaces, mode, fallback, rebuild, capacity)
     
     print("\n--- XDP Program Active ---")
     print("Press Ctrl+C to stop\n")
@@ -72,4 +498,4 @@ if __name__ == '__main__':
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("\nStopping...")
\ No newline at end of file
+        print("\nStopping...")
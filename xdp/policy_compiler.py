@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""
+Policy rule compiler for the XDP filter
+Checks a first-match rules file for shadowed and redundant rules, lowers it
+to the exact hash, LPM trie and port bitmap that xdp_filter_func evaluates,
+and reports the map lookups each kind of packet costs
+"""
+
+import sys
+import json
+import bisect
+import contextlib
+
+from ip_manager import (XDPIPManager, HOST_MAPS, RANGE_MAPS, ADDRESS_BITS, HIGH_WATER_MARK,
+                        PORT_PROTOCOLS, parse_networks, parse_port_ranges, format_port_range,
+                        networks_to_ranges, merge_ranges, subtract_ranges, ranges_to_rules,
+                        rules_to_ranges)
+
+ACTIONS = ("drop", "pass")
+
+# Protocols a rule can match; "other" is everything xdp_filter_func has no port check for
+PROTOCOLS = ("tcp", "udp", "other")
+FULL_PORTS = [(0, 65535)]
+
+# Prefixes covering at most this many addresses are expanded into exact
+# blocked_ips entries while the hash stays under its high-water mark
+EXPAND_HOSTS = 16
+
+# Map lookups along each path through xdp_filter_func, in evaluation order.
+# rate_state is looked up after rate_config only when a rate limit is set.
+LOOKUP_PATHS = {
+    4: (
+        ("dropped by source, exact", ("blocklist_gen", "blocked_ips", "pkt_count",
+                                      "src_stats", "event_sampling")),
+        ("dropped by source, prefix", ("blocklist_gen", "blocked_ips", "blocked_cidrs",
+                                       "pkt_count", "src_stats", "event_sampling")),
+        ("dropped by port", ("blocklist_gen", "blocked_ips", "blocked_cidrs", "rate_config",
+                             "port_bitmap", "pkt_count", "src_stats", "event_sampling")),
+        ("passed TCP/UDP", ("blocklist_gen", "blocked_ips", "blocked_cidrs", "rate_config",
+                            "port_bitmap", "pkt_count")),
+        ("passed other", ("blocklist_gen", "blocked_ips", "blocked_cidrs", "rate_config",
+                          "pkt_count")),
+    ),
+    6: (
+        ("dropped by source, exact", ("blocked_ips6", "pkt_count", "event_sampling")),
+        ("dropped by source, prefix", ("blocked_ips6", "blocked_cidrs6", "pkt_count",
+                                       "event_sampling")),
+        ("dropped by port", ("blocked_ips6", "blocked_cidrs6", "port_bitmap", "pkt_count",
+                             "event_sampling")),
+        ("passed TCP/UDP", ("blocked_ips6", "blocked_cidrs6", "port_bitmap", "pkt_count")),
+        ("passed other", ("blocked_ips6", "blocked_cidrs6", "pkt_count")),
+    ),
+}
+
+class Rule:
+    """One line of a policy: an action and what it matches.
+
+    sources maps each IP version to merged (first, last) address ranges,
+    protos is a subset of PROTOCOLS and ports are merged destination port
+    ranges (FULL_PORTS when the rule has no port match).
+    """
+
+    def __init__(self, number, line, text, action, sources, protos, ports):
+        self.number = number
+        self.line = line
+        self.text = text
+        self.action = action
+        self.sources = sources
+        self.protos = protos
+        self.ports = ports
+        # First and last source address per IP version, to skip rules quickly
+        self.spans = {version: (ranges[0][0], ranges[-1][1]) if ranges else (1, 0)
+                      for version, ranges in sources.items()}
+
+    @property
+    def any_source(self):
+        return all(self.sources[version] == [(0, (1 << bits) - 1)]
+                   for version, bits in ADDRESS_BITS.items())
+
+    @property
+    def kind(self):
+        """Which check of xdp_filter_func the rule lowers to: source, port or None"""
+        if self.protos == set(PROTOCOLS) and self.ports == FULL_PORTS:
+            return "source"
+        if self.any_source and "other" not in self.protos:
+            return "port"
+        return None
+
+    def overlaps(self, other):
+        """Whether some packet matches both rules"""
+        return (bool(self.protos & other.protos)
+                and ranges_overlap(self.ports, other.ports)
+                and any(ranges_overlap(self.sources[version], other.sources[version])
+                        for version in ADDRESS_BITS))
+
+    def __str__(self):
+        return f"rule {self.number} (line {self.line}: {self.text})"
+
+def parse_rule(number, line, text):
+    """Parse `drop|pass [from SRC,...] [proto tcp|udp|any] [port PORTS]` into a Rule"""
+    tokens = text.split()
+    if tokens[0] not in ACTIONS:
+        raise ValueError(f"line {line}: expected drop or pass, got {tokens[0]!r}")
+    if len(tokens) % 2 == 0:
+        raise ValueError(f"line {line}: {tokens[-1]!r} needs a value")
+    fields = {}
+    for keyword, value in zip(tokens[1::2], tokens[2::2]):
+        if keyword not in ("from", "proto", "port") or keyword in fields:
+            raise ValueError(f"line {line}: unexpected {keyword!r}")
+        fields[keyword] = value.split(",")
+
+    sources = {version: [] for version in ADDRESS_BITS}
+    entries = fields.get("from", ["any"])
+    if "any" in entries:
+        sources = {version: [(0, (1 << bits) - 1)] for version, bits in ADDRESS_BITS.items()}
+    else:
+        networks, invalid = parse_networks(entries)
+        if invalid:
+            raise ValueError(f"line {line}: invalid source {invalid[0]!r}")
+        for version in ADDRESS_BITS:
+            sources[version] = merge_ranges(
+                networks_to_ranges([n for n in networks if n.version == version]))
+
+    ports = FULL_PORTS
+    if "port" in fields:
+        ranges, invalid = parse_port_ranges(fields["port"])
+        if invalid:
+            raise ValueError(f"line {line}: invalid port {invalid[0]!r}")
+        ports = merge_ranges(ranges)
+
+    protos = fields.get("proto", ["any"])
+    if "any" in protos:
+        # Only TCP and UDP have the ports a port match looks at
+        protos = set(PORT_PROTOCOLS) if "port" in fields else set(PROTOCOLS)
+    elif not set(protos) <= set(PORT_PROTOCOLS):
+        raise ValueError(f"line {line}: protocol must be tcp, udp or any")
+
+    return Rule(number, line, text, tokens[0], sources, set(protos), ports)
+
+def parse_policy(lines):
+    """Parse a rules file, skipping blanks and # comments. Raises ValueError."""
+    rules = []
+    for line, entry in enumerate(lines, 1):
+        text = entry.split("#", 1)[0].strip()
+        if text:
+            rules.append(parse_rule(len(rules) + 1, line, text))
+    return rules
+
+def ranges_overlap(a, b):
+    """Whether two lists of merged ranges share any value"""
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i][1] < b[j][0]:
+            i += 1
+        elif b[j][1] < a[i][0]:
+            j += 1
+        else:
+            return True
+    return False
+
+def ranges_contain(ranges, value):
+    """Whether a value lies in a list of merged ranges"""
+    i = bisect.bisect_right(ranges, (value, float("inf"))) - 1
+    return i >= 0 and ranges[i][1] >= value
+
+def find_cover(rule, earlier):
+    """Return the earlier rules that together match everything rule matches, or None.
+
+    The source space is cut at every range boundary of the candidates, so
+    within each piece the same rules apply and one address stands for it.
+    """
+    cover = set()
+    for version, ranges in rule.sources.items():
+        if not ranges:
+            continue
+        first, last = rule.spans[version]
+        candidates = [other for other in earlier
+                      if other.spans[version][0] <= last and other.spans[version][1] >= first
+                      and other.protos & rule.protos
+                      and ranges_overlap(other.ports, rule.ports)
+                      and ranges_overlap(other.sources[version], ranges)]
+        bounds = {edge for other in (rule, *candidates)
+                  for start, end in other.sources[version] for edge in (start, end + 1)}
+        for point in sorted(bounds):
+            if not ranges_contain(ranges, point):
+                continue
+            matching = [other for other in candidates
+                        if ranges_contain(other.sources[version], point)]
+            for proto in rule.protos:
+                # First match wins, so only rules that reach undecided ports count
+                remaining = rule.ports
+                for other in matching:
+                    if proto in other.protos and ranges_overlap(remaining, other.ports):
+                        cover.add(other)
+                        remaining = subtract_ranges(remaining, other.ports)
+                        if not remaining:
+                            break
+                if remaining:
+                    return None
+    return cover
+
+def check_rules(rules):
+    """Find rules that never decide a packet.
+
+    Returns a list of (rule, problem, related rules): shadowed rules only
+    see packets earlier rules already decided the other way, redundant
+    rules repeat what earlier rules or the default pass already do.
+    """
+    findings = []
+    for i, rule in enumerate(rules):
+        cover = find_cover(rule, rules[:i])
+        if cover is not None:
+            related = sorted(cover, key=lambda other: other.number)
+            if all(other.action == rule.action for other in related):
+                findings.append((rule, "redundant", related))
+            else:
+                findings.append((rule, "shadowed", related))
+        elif rule.action == "pass" and not any(
+                later.action == "drop" and rule.overlaps(later) for later in rules[i + 1:]):
+            # Nothing after it would drop what it passes
+            findings.append((rule, "redundant", []))
+    return findings
+
+def lower_rules(rules):
+    """Lower first-match rules to the checks of xdp_filter_func.
+
+    The program drops by source first and by destination port second,
+    then passes everything else. pass rules become holes in the drop rules
+    that follow them. Returns (source drop ranges per IP version, port drop
+    ranges per protocol, errors) where errors name the rules that this
+    evaluation order cannot express.
+    """
+    source_drop = {version: [] for version in ADDRESS_BITS}
+    source_pass = {version: [] for version in ADDRESS_BITS}
+    port_drop = {proto: [] for proto in PORT_PROTOCOLS}
+    port_pass = {proto: [] for proto in PORT_PROTOCOLS}
+    passed_by_source, passed_by_port = [], []
+    errors = []
+
+    for rule in rules:
+        if rule.kind == "source":
+            # Only what no earlier rule decided; disjoint from both sets
+            effective = {version: subtract_ranges(subtract_ranges(
+                rule.sources[version], source_drop[version]), source_pass[version])
+                for version in ADDRESS_BITS}
+            if not any(effective.values()):
+                continue
+            if rule.action == "pass":
+                passed_by_source.append(rule)
+                target = source_pass
+            else:
+                if passed_by_port:
+                    errors.append(f"{rule} drops traffic passed by port in "
+                                  f"{', '.join(str(other) for other in passed_by_port)}, "
+                                  "but sources are checked before ports")
+                target = source_drop
+            for version, ranges in effective.items():
+                for source_range in ranges:
+                    bisect.insort(target[version], source_range)
+        elif rule.kind == "port":
+            effective = {proto: subtract_ranges(rule.ports, merge_ranges(
+                port_drop[proto] + port_pass[proto])) for proto in rule.protos}
+            if not any(effective.values()):
+                continue
+            if rule.action == "pass":
+                passed_by_port.append(rule)
+                target = port_pass
+            else:
+                if passed_by_source:
+                    errors.append(f"{rule} drops traffic passed by source in "
+                                  f"{', '.join(str(other) for other in passed_by_source)}, "
+                                  "but the port bitmap applies to every source")
+                target = port_drop
+            for proto, ranges in effective.items():
+                target[proto] = merge_ranges(target[proto] + ranges)
+        else:
+            errors.append(f"{rule} matches both sources and ports, which "
+                          "xdp_filter_func cannot combine in one check")
+
+    source_drop = {version: merge_ranges(ranges) for version, ranges in source_drop.items()}
+    return source_drop, port_drop, errors
+
+def expand_prefixes(hosts, prefixes, bits, room, limit=EXPAND_HOSTS):
+    """Move small prefixes into the exact hash while it has room.
+
+    A source found in blocked_ips skips the LPM trie walk, and a smaller
+    trie is cheaper to walk for every other packet. The smallest prefixes
+    go first. Returns the number of prefixes expanded.
+    """
+    width = bits // 8
+    expanded = 0
+    for key in sorted(prefixes, key=lambda key: -int.from_bytes(key[:4], sys.byteorder)):
+        size = 1 << (bits - int.from_bytes(key[:4], sys.byteorder))
+        if size > limit or len(hosts) + size > room:
+            break
+        start = int.from_bytes(key[4:], "big")
+        hosts.update((start + i).to_bytes(width, "big") for i in range(size))
+        prefixes.discard(key)
+        expanded += 1
+    return expanded
+
+def build_layout(source_drop, port_drop, capacities, expand=EXPAND_HOSTS):
+    """Choose the map entries for lowered rules.
+
+    Each source range is split into the fewest aligned prefixes, /32 and
+    /128 ones as exact keys, and small prefixes are expanded into exact
+    keys below the high-water mark of the hash. capacities maps
+    blocked_ips/blocked_ips6 to max_entries, when known. Returns
+    (layout dict, errors).
+    """
+    layout = {"hosts": {}, "prefixes": {}, "expanded": {}, "ports": port_drop}
+    errors = []
+    for version, bits in ADDRESS_BITS.items():
+        hosts, prefixes = ranges_to_rules(source_drop[version], bits=bits)
+        capacity = capacities.get(HOST_MAPS[version])
+        expanded = 0
+        if capacity and expand:
+            expanded = expand_prefixes(hosts, prefixes, bits,
+                                       int(capacity * HIGH_WATER_MARK), expand)
+        if capacity and len(hosts) > capacity:
+            errors.append(f"{HOST_MAPS[version]} needs {len(hosts):,} entries "
+                          f"but holds {capacity:,}")
+        layout["hosts"][version] = hosts
+        layout["prefixes"][version] = prefixes
+        layout["expanded"][version] = expanded
+    return layout, errors
+
+def trie_depth(prefixes, bits=32):
+    """Nodes the longest LPM trie lookup visits.
+
+    The kernel trie is path-compressed: its nodes are the prefixes plus one
+    intermediate node wherever two prefixes diverge, so the depth follows
+    from the prefixes alone.
+    """
+    entries = sorted((int.from_bytes(key[4:], "big"), int.from_bytes(key[:4], sys.byteorder))
+                     for key in prefixes)
+
+    def depth(lo, hi):
+        first, last = entries[lo][0], entries[hi - 1][0]
+        common = min(min(prefixlen for _, prefixlen in entries[lo:hi]),
+                     bits - (first ^ last).bit_length())
+        # The node itself, then its children split on the next bit
+        children = [i for i in range(lo, hi) if entries[i][1] > common]
+        if not children:
+            return 1
+        split = next((i for i in children
+                      if entries[i][0] >> (bits - 1 - common) & 1), hi)
+        return 1 + max(depth(a, b) for a, b in ((children[0], split), (split, hi)) if a < b)
+
+    return depth(0, len(entries)) if entries else 0
+
+def lookup_report(layout, rate_limited=False):
+    """Return the map lookups and trie nodes of every path through the program.
+
+    Paths that cannot happen under the layout, such as drops by prefix
+    with an empty LPM trie, are left out.
+    """
+    report = []
+    for version, paths in LOOKUP_PATHS.items():
+        depth = trie_depth(layout["prefixes"][version], ADDRESS_BITS[version])
+        for name, maps in paths:
+            if "exact" in name and not layout["hosts"][version]:
+                continue
+            if "prefix" in name and not layout["prefixes"][version]:
+                continue
+            if "by port" in name and not any(layout["ports"].values()):
+                continue
+            if rate_limited and "rate_config" in maps:
+                maps = (*maps[:maps.index("rate_config") + 1], "rate_state",
+                        *maps[maps.index("rate_config") + 1:])
+            walks_trie = RANGE_MAPS[version] in maps
+            report.append({"version": version, "path": name, "lookups": len(maps),
+                           "trie_nodes": depth if walks_trie else 0,
+                           "steps": len(maps) - 1 + max(depth, 1) if walks_trie else len(maps),
+                           "maps": list(maps)})
+    return report
+
+def compile_policy(rules, capacities, expand=EXPAND_HOSTS, rate_limited=False):
+    """Check and lower a parsed policy into a report dict"""
+    findings = check_rules(rules)
+    source_drop, port_drop, errors = lower_rules(rules)
+    layout, layout_errors = build_layout(source_drop, port_drop, capacities, expand)
+    return {
+        "rules": len(rules),
+        "findings": findings,
+        "errors": errors + layout_errors,
+        "layout": layout,
+        "lookups": lookup_report(layout, rate_limited),
+    }
+
+def apply_layout(manager, layout):
+    """Make the maps hold exactly the compiled layout.
+
+    Entries are inserted before stale ones are deleted and ports are
+    blocked before others are unblocked, so nothing the old or the new
+    policy drops passes in between. Hosts with a TTL are left alone.
+    Returns False if a map is unavailable or a write failed.
+    """
+    ok = True
+    for version in ADDRESS_BITS:
+        current = manager.read_rules(version)
+        if current is None:
+            return False
+        desired = (layout["hosts"][version], layout["prefixes"][version])
+        inserted, deleted, failures = manager.apply_rule_diff(current, desired, version)
+        for network, _, error in failures:
+            print(f"✗ Error writing {network}: {error}")
+        print(f"✓ IPv{version}: {inserted} entries added, {deleted} removed")
+        ok = ok and not failures
+
+    for proto in PORT_PROTOCOLS:
+        current = manager.get_blocked_ports(proto)
+        if current is None:
+            print("Error: Could not find port_bitmap BPF map")
+            print("Make sure XDP program is loaded")
+            return False
+        desired = layout["ports"][proto]
+        try:
+            blocked = manager.update_ports(proto, desired, True)
+            unblocked = manager.update_ports(proto, subtract_ranges(current, desired), False)
+        except OSError as e:
+            print(f"✗ Error updating port_bitmap: {e.strerror}")
+            return False
+        print(f"✓ {proto.upper()}: {blocked} ports newly blocked, {unblocked} unblocked")
+    return ok
+
+def layout_summary(layout):
+    """Describe the entries of each map in the layout"""
+    summary = {}
+    for version, bits in ADDRESS_BITS.items():
+        hosts, prefixes = layout["hosts"][version], layout["prefixes"][version]
+        lengths = sorted({int.from_bytes(key[:4], sys.byteorder) for key in prefixes})
+        summary[HOST_MAPS[version]] = {"entries": len(hosts),
+                                       "expanded_prefixes": layout["expanded"][version]}
+        summary[RANGE_MAPS[version]] = {"entries": len(prefixes),
+                                        "prefix_lengths": [lengths[0], lengths[-1]] if lengths else [],
+                                        "addresses": sum(end - start + 1 for start, end in
+                                                         rules_to_ranges((), prefixes, bits)[1])}
+    summary["port_bitmap"] = {proto: [format_port_range(r) for r in ranges]
+                              for proto, ranges in layout["ports"].items()}
+    return summary
+
+def print_report(report, budget=None):
+    """Print the findings, the lowered layout and the lookups per packet"""
+    print(f"Policy: {report['rules']} rules")
+    for rule, problem, related in report["findings"]:
+        if problem == "shadowed":
+            by = ", ".join(f"rule {other.number} ({other.action})" for other in related)
+            print(f"  Warning: {rule} is shadowed by {by}, it never matches")
+        elif related:
+            by = ", ".join(f"rule {other.number}" for other in related)
+            print(f"  Warning: {rule} is redundant, covered by {by}")
+        else:
+            print(f"  Warning: {rule} is redundant, no later rule drops what it passes")
+    for error in report["errors"]:
+        print(f"  Error: {error}")
+
+    print("\nLowered to:")
+    for name, entry in layout_summary(report["layout"]).items():
+        if name == "port_bitmap":
+            for proto, ranges in entry.items():
+                print(f"  {name} {proto.upper():<6} {', '.join(ranges) or 'none'}")
+        elif "prefix_lengths" in entry:
+            lengths = entry["prefix_lengths"]
+            detail = ""
+            if lengths:
+                detail = (f", /{lengths[0]}" if lengths[0] == lengths[1]
+                          else f", /{lengths[0]} to /{lengths[1]}")
+            print(f"  {name:<16} {entry['entries']:>8,} prefixes{detail}")
+        else:
+            detail = (f" ({entry['expanded_prefixes']} prefixes expanded)"
+                      if entry["expanded_prefixes"] else "")
+            print(f"  {name:<16} {entry['entries']:>8,} exact{detail}")
+
+    print("\nLookups per packet:")
+    print(f"  {'Path':<32} {'Lookups':>8} {'Trie nodes':>11} {'Steps':>6}")
+    for entry in report["lookups"]:
+        print(f"  {'IPv' + str(entry['version']) + ' ' + entry['path']:<32} "
+              f"{entry['lookups']:>8} {entry['trie_nodes']:>11} {entry['steps']:>6}")
+    if budget is not None:
+        worst = max(entry["steps"] for entry in report["lookups"])
+        verdict = "within" if worst <= budget else "over"
+        print(f"\nWorst case {worst} steps, {verdict} the budget of {budget}")
+
+def print_usage():
+    print("Usage: python3 policy_compiler.py RULES [--apply] [--budget N] [--expand N] "
+          "[--capacity N] [--json]")
+    print("")
+    print("  Rules are matched first to last, unmatched packets pass:")
+    print("    drop|pass [from IP/CIDR,...|any] [proto tcp|udp|any] [port PORTS]")
+    print("  --apply        Write the compiled layout to the maps of the loaded filter")
+    print("  --budget N     Fail if a packet can take more than N lookup steps")
+    print(f"  --expand N     Expand prefixes of up to N addresses into exact entries "
+          f"(default: {EXPAND_HOSTS}, 0 disables)")
+    print("  --capacity N   blocked_ips size to plan for instead of the loaded map's")
+    print("  --json         Print the report as JSON")
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0].startswith("-"):
+        print_usage()
+        sys.exit(1)
+    path = args[0]
+    apply = False
+    as_json = False
+    budget = None
+    expand = EXPAND_HOSTS
+    capacity = None
+
+    args = args[1:]
+    try:
+        while args:
+            if args[0] == "--apply":
+                apply = True
+                args = args[1:]
+                continue
+            if args[0] == "--json":
+                as_json = True
+                args = args[1:]
+                continue
+            if args[0] == "--budget" and len(args) > 1:
+                budget = int(args[1])
+            elif args[0] == "--expand" and len(args) > 1:
+                expand = int(args[1])
+            elif args[0] == "--capacity" and len(args) > 1:
+                capacity = int(args[1])
+            else:
+                raise ValueError(args[0])
+            args = args[2:]
+    except ValueError:
+        print_usage()
+        sys.exit(1)
+
+    try:
+        with open(path) as f:
+            rules = parse_policy(f)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    # Diagnostics go to stderr so --json output stays parseable
+    with contextlib.redirect_stdout(sys.stderr):
+        manager = XDPIPManager()
+        capacities = {name: max_entries for name, (_, max_entries)
+                      in manager.get_occupancy(HOST_MAPS.values()).items()}
+        rate_limit = manager.get_rate_limit()
+    if capacity:
+        capacities[HOST_MAPS[4]] = capacity
+    rate_limited = bool(rate_limit and (rate_limit["pps"] or rate_limit["bps"]))
+
+    report = compile_policy(rules, capacities, expand, rate_limited)
+    worst = max(entry["steps"] for entry in report["lookups"])
+    if as_json:
+        print(json.dumps({
+            "rules": report["rules"],
+            "findings": [{"rule": rule.number, "line": rule.line, "problem": problem,
+                          "related": [other.number for other in related]}
+                         for rule, problem, related in report["findings"]],
+            "errors": report["errors"],
+            "layout": layout_summary(report["layout"]),
+            "lookups": report["lookups"],
+            "worst_steps": worst,
+        }, indent=2))
+    else:
+        print_report(report, budget)
+
+    failed = bool(report["errors"]) or (budget is not None and worst > budget)
+    with contextlib.redirect_stdout(sys.stderr) if as_json else contextlib.nullcontext():
+        if apply and not failed:
+            print("\nApplying to the loaded filter:")
+            failed = not apply_layout(manager, report["layout"])
+        elif apply:
+            print("\nNot applied: fix the errors above first")
+    manager.close()
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+"""
+Offline policy simulator for the XDP filter
+Replays a pcap through a NumPy reimplementation of xdp_filter_func and
+reports what a policy would drop, per rule and per source
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import socket
+import ipaddress
+import contextlib
+from collections import Counter
+
+import numpy as np
+
+import bpf_syscall
+from drop_events import DROP_REASONS
+from ip_manager import (XDPIPManager, BLOCKED_VALUE, RANGE_VALUE, RANGE_MAPS, ADDRESS_BITS,
+                        PORT_PROTOCOLS, RATE_LIMIT_FIELDS, is_expired, parse_networks,
+                        parse_port_ranges, format_port_range)
+
+# Classic pcap magic: byte order and timestamp units per second
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 10 ** 6),
+    b"\xa1\xb2\xc3\xd4": (">", 10 ** 6),
+    b"\x4d\x3c\xb2\xa1": ("<", 10 ** 9),
+    b"\xa1\xb2\x3c\x4d": (">", 10 ** 9),
+}
+PCAP_HEADER_SIZE = 24
+RECORD_HEADER_SIZE = 16
+LINKTYPE_ETHERNET = 1
+
+# Packets evaluated per vectorized batch
+BATCH_SIZE = 1 << 20
+
+# Header layout as xdp_filter_func reads it. L4 is taken right after the
+# fixed IPv4/IPv6 header (options and extension headers are not skipped),
+# and TCP and UDP ports are bounds-checked as a struct udphdr.
+ETH_HLEN = 14
+IPV4_HLEN = 20
+IPV6_HLEN = 40
+L4_HLEN = 8
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+
+# Reasons as numbered in xdp_filter.c, 0 means the packet passes
+PASS = 0
+DROP_BLOCKED_IP = 1
+DROP_BLOCKED_PORT = 2
+DROP_RATE_LIMIT = 3
+
+XDP_DROP = 1
+XDP_PASS = 2
+
+NSEC_PER_SEC = 10 ** 9
+
+class Capture:
+    """Records of a classic pcap file as columns over the raw file bytes"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        if raw[:4] not in PCAP_MAGIC or len(raw) < PCAP_HEADER_SIZE:
+            raise ValueError(f"{path} is not a pcap file (pcapng is not supported)")
+        order, units = PCAP_MAGIC[raw[:4]]
+        linktype = struct.unpack_from(order + "I", raw, 20)[0] & 0xFFFF
+        if linktype != LINKTYPE_ETHERNET:
+            raise ValueError(f"{path}: link type {linktype} is not Ethernet")
+
+        # Records are variable length, so only their offsets are walked in Python
+        caplen_field = struct.Struct(order + "I")
+        offsets = []
+        pos = PCAP_HEADER_SIZE
+        while pos + RECORD_HEADER_SIZE <= len(raw):
+            offsets.append(pos)
+            pos += RECORD_HEADER_SIZE + caplen_field.unpack_from(raw, pos + 8)[0]
+        if pos > len(raw):
+            # Last record cut short by an interrupted capture
+            offsets.pop()
+
+        self.data = np.frombuffer(raw, dtype=np.uint8)
+        offsets = np.array(offsets, dtype=np.int64)
+        headers = self.data[offsets[:, None] + np.arange(RECORD_HEADER_SIZE)]
+        ts_sec, ts_frac, caplen, wirelen = headers.view(order + "u4").T.astype(np.int64)
+        self.ts_ns = ts_sec * NSEC_PER_SEC + ts_frac * (NSEC_PER_SEC // units)
+        self.start = offsets + RECORD_HEADER_SIZE
+        self.caplen = caplen
+        self.wirelen = wirelen
+
+    def __len__(self):
+        return len(self.start)
+
+    def packet(self, i):
+        """Captured bytes of one packet"""
+        return self.data[self.start[i]:self.start[i] + self.caplen[i]].tobytes()
+
+    def field(self, index, offset, width):
+        """Bytes [offset, offset + width) of the selected packets as an (n, width) array.
+
+        Rows of packets captured shorter than offset + width are zero.
+        """
+        present = self.caplen[index] >= offset + width
+        rows = self.data[np.where(present, self.start[index] + offset, 0)[:, None] + np.arange(width)]
+        rows[~present] = 0
+        return rows
+
+    def columns(self, index):
+        """Decode the header fields xdp_filter_func reads for the selected packets"""
+        caplen = self.caplen[index]
+        ethertype = self.field(index, 12, 2).view(">u2")[:, 0]
+        is_ipv4 = (ethertype == ETH_P_IP) & (caplen >= ETH_HLEN + IPV4_HLEN)
+        is_ipv6 = (ethertype == ETH_P_IPV6) & (caplen >= ETH_HLEN + IPV6_HLEN)
+
+        protocol = np.where(is_ipv4, self.field(index, ETH_HLEN + 9, 1)[:, 0],
+                            self.field(index, ETH_HLEN + 6, 1)[:, 0])
+        l4 = np.where(is_ipv4, ETH_HLEN + IPV4_HLEN, ETH_HLEN + IPV6_HLEN)
+        has_ports = (is_ipv4 | is_ipv6) & (caplen >= l4 + L4_HLEN)
+        dport4 = self.field(index, ETH_HLEN + IPV4_HLEN + 2, 2).view(">u2")[:, 0]
+        dport6 = self.field(index, ETH_HLEN + IPV6_HLEN + 2, 2).view(">u2")[:, 0]
+
+        # Headers the filter would have seen had the capture not been cut
+        needed = np.where(ethertype == ETH_P_IP, ETH_HLEN + IPV4_HLEN + L4_HLEN,
+                          np.where(ethertype == ETH_P_IPV6, ETH_HLEN + IPV6_HLEN + L4_HLEN, ETH_HLEN))
+        return {
+            "is_ipv4": is_ipv4,
+            "is_ipv6": is_ipv6,
+            "src4": self.field(index, ETH_HLEN + 12, 4).view(">u4")[:, 0],
+            "src6": self.field(index, ETH_HLEN + 8, 16),
+            "protocol": protocol,
+            "has_ports": has_ports,
+            "dport": np.where(is_ipv4, dport4, dport6),
+            "bytes": self.wirelen[index],
+            "ts_ns": self.ts_ns[index],
+            "truncated": caplen < np.minimum(needed, self.wirelen[index]),
+        }
+
+class Policy:
+    """Blocked addresses and ranges, blocked ports and the rate limit xdp_filter_func applies"""
+
+    def __init__(self, networks=(), ports=None, rate_limit=None):
+        # Host-length networks are exact blocked_ips entries, the rest LPM ranges
+        self.networks = list(dict.fromkeys(networks))
+        self.ports = ports or {proto: [] for proto in PORT_PROTOCOLS}
+        self.rate_limit = rate_limit or dict.fromkeys(RATE_LIMIT_FIELDS, 0)
+
+    @classmethod
+    def from_maps(cls, manager):
+        """Read the policy of the loaded filter, or None if its maps are unavailable"""
+        entries = manager.get_blocked_entries()
+        if entries is None:
+            return None
+        now = time.monotonic_ns()
+        networks = [ipaddress.ip_network(ip) for ip, expiry in entries if not is_expired(expiry, now)]
+        networks += manager.get_blocked_ranges()
+        ports = {proto: manager.get_blocked_ports(proto) or [] for proto in PORT_PROTOCOLS}
+        rate_limit = manager.get_rate_limit() or dict.fromkeys(RATE_LIMIT_FIELDS, 0)
+        return cls(networks, ports, rate_limit)
+
+    def rate_limited(self):
+        return bool(self.rate_limit["pps"] or self.rate_limit["bps"])
+
+    def write(self, manager):
+        """Store the policy in the (empty) maps of a manager. Returns a list of errors."""
+        errors = []
+        hosts = [n for n in self.networks if n.prefixlen == ADDRESS_BITS[n.version]]
+        ranges = [n for n in self.networks if n.prefixlen != ADDRESS_BITS[n.version]]
+        keys = [n.network_address.packed for n in hosts]
+        errors += [e for ok, e in manager.write_hosts(keys, [BLOCKED_VALUE] * len(keys)) if not ok]
+        for version, name in RANGE_MAPS.items():
+            keys = [manager.network_to_key(n) for n in ranges if n.version == version]
+            if keys:
+                results = manager.find_map(name).update_batch(keys, [RANGE_VALUE] * len(keys))
+                errors += [e for ok, e in results if not ok]
+        for proto, port_ranges in self.ports.items():
+            if port_ranges:
+                manager.update_ports(proto, port_ranges)
+        return errors
+
+def mask_bytes(prefixlen, width):
+    """Network mask of a prefix as a byte array"""
+    return np.frombuffer((((1 << prefixlen) - 1) << (width * 8 - prefixlen)).to_bytes(width, "big"),
+                         dtype=np.uint8)
+
+def match_sorted(keys, ids, values):
+    """Rule id of each value found in the sorted keys, -1 where absent"""
+    if not len(keys):
+        return np.full(len(values), -1, dtype=np.int32)
+    pos = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+    return np.where(keys[pos] == values, ids[pos], -1)
+
+class Simulator:
+    """Vectorized xdp_filter_func verdicts for a fixed policy.
+
+    Rule ids index self.rules. Rate limiter buckets and the sources it
+    promoted to blocked_ips carry over from one batch to the next, so
+    batches must be evaluated in capture order.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.rules = []
+        self.hosts = {}
+        self.prefixes = {}
+        for version, bits in ADDRESS_BITS.items():
+            networks = sorted(n for n in policy.networks if n.version == version)
+            hosts = [n for n in networks if n.prefixlen == bits]
+            self.hosts[version] = self._lookup(version, hosts, bits)
+            self.prefixes[version] = []
+            # Longest prefixes first, like the LPM trie
+            for prefixlen in sorted({n.prefixlen for n in networks if n.prefixlen != bits}, reverse=True):
+                group = [n for n in networks if n.prefixlen == prefixlen]
+                self.prefixes[version].append((prefixlen,) + self._lookup(version, group, bits))
+
+        self.port_rules = {}
+        for proto, port_ranges in policy.ports.items():
+            table = np.full(65536, -1, dtype=np.int32)
+            for port_range in port_ranges:
+                table[port_range[0]:port_range[1] + 1] = self._add_rule(
+                    f"port {proto}/{format_port_range(port_range)}")
+            self.port_rules[socket.getprotobyname(proto)] = table
+
+        self.rate_rule = self._add_rule("rate_limit")
+        self.promoted_rule = self._add_rule("rate_limit promotion")
+        self.buckets = {}
+        self.promoted = set()
+
+    def _add_rule(self, label):
+        self.rules.append(label)
+        return len(self.rules) - 1
+
+    def _lookup(self, version, networks, bits):
+        """Sorted keys and rule ids of networks of one IP version and prefix length"""
+        ids = np.array([self._add_rule(str(n.network_address) if n.prefixlen == bits else str(n))
+                        for n in networks], dtype=np.int32)
+        if version == 4:
+            keys = np.array([int(n.network_address) for n in networks], dtype=np.uint32)
+        else:
+            keys = np.array([n.network_address.packed for n in networks], dtype="S16")
+        return keys, ids
+
+    def _match_source(self, version, src):
+        """Rule id of the exact address or longest prefix blocking each source, -1 if none"""
+        keys, ids = self.hosts[version]
+        rule = match_sorted(keys, ids, src if version == 4 else src.view("S16")[:, 0])
+        for prefixlen, keys, ids in self.prefixes[version]:
+            todo = rule < 0
+            if not todo.any():
+                break
+            if version == 4:
+                masked = src[todo] & np.uint32((0xFFFFFFFF << (32 - prefixlen)) & 0xFFFFFFFF)
+            else:
+                masked = (src[todo] & mask_bytes(prefixlen, 16)).view("S16")[:, 0]
+            rule[todo] = match_sorted(keys, ids, masked)
+        return rule
+
+    def evaluate(self, cols):
+        """Return (reason, rule id) arrays for a batch of decoded packets"""
+        n = len(cols["bytes"])
+        reason = np.zeros(n, dtype=np.uint8)
+        rule = np.full(n, -1, dtype=np.int32)
+
+        for version, is_version, src in ((4, cols["is_ipv4"], cols["src4"]),
+                                         (6, cols["is_ipv6"], cols["src6"])):
+            index = np.flatnonzero(is_version)
+            matched = self._match_source(version, src[index])
+            hit = index[matched >= 0]
+            reason[hit] = DROP_BLOCKED_IP
+            rule[hit] = matched[matched >= 0]
+
+        if self.policy.rate_limited() or self.promoted:
+            self._rate_limit(cols, reason, rule)
+
+        for proto, table in self.port_rules.items():
+            index = np.flatnonzero((reason == PASS) & cols["has_ports"] & (cols["protocol"] == proto))
+            matched = table[cols["dport"][index]]
+            hit = index[matched >= 0]
+            reason[hit] = DROP_BLOCKED_PORT
+            rule[hit] = matched[matched >= 0]
+        return reason, rule
+
+    def _rate_limit(self, cols, reason, rule):
+        """Run the token buckets over the IPv4 packets that passed the blocklist.
+
+        Buckets are stateful and ordered in time, so this is the one
+        per-packet loop. Sources dropped promote_after times are blocked
+        for the rest of the capture, as rate_allow() does.
+        """
+        limit = self.policy.rate_limit
+        index = np.flatnonzero(cols["is_ipv4"] & (reason == PASS))
+        for i, src, now, size in zip(index.tolist(), cols["src4"][index].tolist(),
+                                     cols["ts_ns"][index].tolist(), cols["bytes"][index].tolist()):
+            if src in self.promoted:
+                reason[i] = DROP_BLOCKED_IP
+                rule[i] = self.promoted_rule
+                continue
+            if not self.policy.rate_limited():
+                continue
+
+            bucket = self.buckets.get(src)
+            if bucket is None:
+                bucket = [now, limit["pps_burst"] * NSEC_PER_SEC, limit["bps_burst"] * NSEC_PER_SEC, 0]
+                self.buckets[src] = bucket
+            elapsed = max(now - bucket[0], 0)
+            bucket[0] = now
+            packet_cost = NSEC_PER_SEC if limit["pps"] else 0
+            byte_cost = size * NSEC_PER_SEC if limit["bps"] else 0
+            if limit["pps"]:
+                bucket[1] = min(bucket[1] + elapsed * limit["pps"], limit["pps_burst"] * NSEC_PER_SEC)
+            if limit["bps"]:
+                bucket[2] = min(bucket[2] + elapsed * limit["bps"], limit["bps_burst"] * NSEC_PER_SEC)
+            if bucket[1] >= packet_cost and bucket[2] >= byte_cost:
+                bucket[1] -= packet_cost
+                bucket[2] -= byte_cost
+                continue
+
+            bucket[3] += 1
+            reason[i] = DROP_RATE_LIMIT
+            rule[i] = self.rate_rule
+            if limit["promote_after"] and bucket[3] == limit["promote_after"]:
+                self.promoted.add(src)
+
+def simulate(capture, policy, batch_size=BATCH_SIZE):
+    """Evaluate every packet of a capture and aggregate the results"""
+    simulator = Simulator(policy)
+    reasons = Counter()
+    reason_bytes = Counter()
+    rule_packets = np.zeros(len(simulator.rules), dtype=np.int64)
+    rule_bytes = np.zeros(len(simulator.rules), dtype=np.int64)
+    sources = Counter()
+    truncated = 0
+
+    for start in range(0, len(capture), batch_size):
+        index = np.arange(start, min(start + batch_size, len(capture)))
+        cols = capture.columns(index)
+        reason, rule = simulator.evaluate(cols)
+        truncated += int(cols["truncated"].sum())
+
+        codes, counts = np.unique(reason, return_counts=True)
+        reasons.update(dict(zip(codes.tolist(), counts.tolist())))
+        for code in codes.tolist():
+            reason_bytes[code] += int(cols["bytes"][reason == code].sum())
+        matched = rule >= 0
+        rule_packets += np.bincount(rule[matched], minlength=len(simulator.rules))
+        rule_bytes += np.bincount(rule[matched], weights=cols["bytes"][matched],
+                                  minlength=len(simulator.rules)).astype(np.int64)
+
+        dropped = reason != PASS
+        for is_version, src in ((cols["is_ipv4"], cols["src4"]),
+                                (cols["is_ipv6"], cols["src6"].view("S16")[:, 0])):
+            values, counts = np.unique(src[dropped & is_version], return_counts=True)
+            sources.update(dict(zip(values.tolist(), counts.tolist())))
+
+    return {
+        "packets": len(capture),
+        "bytes": int(capture.wirelen.sum()),
+        "dropped": sum(count for code, count in reasons.items() if code != PASS),
+        "truncated": truncated,
+        "reasons": {DROP_REASONS.get(code, "pass"): {"packets": count, "bytes": reason_bytes[code]}
+                    for code, count in reasons.items()},
+        "rules": [{"rule": label, "packets": int(packets), "bytes": int(size)}
+                  for label, packets, size in zip(simulator.rules, rule_packets, rule_bytes)
+                  if packets],
+        "sources": sources,
+    }
+
+def source_name(src):
+    """Address string of a per-source key (IPv4 int or IPv6 bytes)"""
+    if isinstance(src, int):
+        return str(ipaddress.IPv4Address(src))
+    return str(ipaddress.IPv6Address(src.ljust(16, b"\0")))
+
+def verify(capture, policy, count):
+    """Cross-check simulated verdicts against the real program.
+
+    A private copy of xdp_filter.o loaded by bench.py gets the policy
+    (without the rate limit, which depends on timing) and runs up to
+    count packets spread over the capture through BPF_PROG_TEST_RUN.
+    Returns (checked, mismatches) or None if the program cannot be loaded.
+    """
+    import bench
+
+    index = np.unique(np.linspace(0, len(capture) - 1, min(count, len(capture))).astype(np.int64))
+    index = index[capture.caplen[index] >= ETH_HLEN]
+    stateless = Policy(policy.networks, policy.ports)
+    reason, rule = Simulator(stateless).evaluate(capture.columns(index))
+
+    hosts = sum(1 for n in policy.networks if n.version == 4 and n.prefixlen == 32)
+    if not bench.build_object(max(hosts, 1024)):
+        return None
+    loaded = bench.load_object()
+    if not loaded:
+        bench.clear_pins()
+        return None
+    prog_fd, maps = loaded
+
+    manager = XDPIPManager(backend="syscall", pin_dir=bench.BENCH_PIN_DIR)
+    mismatches = []
+    try:
+        errors = stateless.write(manager)
+        if errors:
+            print(f"Warning: {len(errors)} rules could not be loaded: {errors[0]}")
+        for i, expected in zip(index.tolist(), reason.tolist()):
+            verdict, _ = bpf_syscall.prog_test_run(prog_fd, capture.packet(i))
+            if verdict != (XDP_DROP if expected else XDP_PASS):
+                mismatches.append({"packet": i, "simulated": DROP_REASONS.get(expected, "pass"),
+                                   "program": bench.XDP_VERDICTS.get(verdict, str(verdict))})
+    finally:
+        manager.close()
+        for bpf_map in maps.values():
+            bpf_map.close()
+        os.close(prog_fd)
+        bench.clear_pins()
+    return len(index), mismatches
+
+def load_blocklist(path):
+    """Parse an IP/CIDR file (# comments allowed) into networks"""
+    with open(path) as f:
+        entries = [line.split("#", 1)[0].strip() for line in f]
+    networks, invalid = parse_networks(entry for entry in entries if entry)
+    if invalid:
+        raise ValueError(f"invalid entries in {path}: {', '.join(invalid[:10])}")
+    return networks
+
+def print_report(report, top):
+    packets = report["packets"]
+    dropped = report["dropped"]
+    print(f"Packets: {packets:,}  dropped: {dropped:,} ({dropped / max(packets, 1):.1%})")
+    for name, counts in sorted(report["reasons"].items()):
+        print(f"  {name:<14} {counts['packets']:>12,} packets {counts['bytes']:>16,} bytes")
+    if report["truncated"]:
+        print(f"  ({report['truncated']:,} packets cut by the capture snaplen, "
+              "evaluated on the captured bytes)")
+
+    if report["rules"]:
+        print("\nDrops per rule:")
+        for entry in sorted(report["rules"], key=lambda e: -e["packets"])[:top]:
+            print(f"  {entry['rule']:<32} {entry['packets']:>12,}")
+    if report["sources"]:
+        print("\nTop dropped sources:")
+        for src, count in report["sources"].most_common(top):
+            print(f"  {source_name(src):<39} {count:>12,}")
+
+def print_usage():
+    print("Usage: python3 simulate.py CAPTURE.pcap [--blocklist FILE] [--ports PROTO:PORTS] "
+          "[--no-rate-limit] [--top N] [--verify N] [--json]")
+    print("")
+    print("  Without options the policy of the loaded filter is simulated.")
+    print("  --blocklist FILE    Replace the blocked IPs/CIDRs with the ones in FILE")
+    print("  --ports PROTO:PORTS Replace a protocol's blocked ports, e.g. tcp:8080,9000-9100")
+    print("  --no-rate-limit     Ignore the configured per-source rate limit")
+    print("  --top N             Rules and sources to list (default: 10)")
+    print("  --verify N          Check N packets against the real program with BPF_PROG_TEST_RUN")
+    print("  --json              Print the report as JSON")
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0].startswith("-"):
+        print_usage()
+        sys.exit(1)
+    path = args[0]
+    blocklist = None
+    ports = {}
+    rate_limit = True
+    top = 10
+    verify_count = 0
+    as_json = False
+
+    args = args[1:]
+    try:
+        while args:
+            if args[0] == "--json":
+                as_json = True
+                args = args[1:]
+                continue
+            if args[0] == "--no-rate-limit":
+                rate_limit = False
+                args = args[1:]
+                continue
+            if args[0] == "--blocklist" and len(args) > 1:
+                blocklist = args[1]
+            elif args[0] == "--ports" and len(args) > 1:
+                proto, _, listed = args[1].partition(":")
+                port_ranges, invalid = parse_port_ranges(listed.split(",") if listed else [])
+                if proto not in PORT_PROTOCOLS or invalid:
+                    raise ValueError(args[1])
+                ports[proto] = port_ranges
+            elif args[0] == "--top" and len(args) > 1:
+                top = int(args[1])
+            elif args[0] == "--verify" and len(args) > 1:
+                verify_count = int(args[1])
+            else:
+                raise ValueError(args[0])
+            args = args[2:]
+    except ValueError:
+        print_usage()
+        sys.exit(1)
+
+    # Diagnostics go to stderr so --json output stays parseable
+    with contextlib.redirect_stdout(sys.stderr):
+        manager = XDPIPManager()
+        policy = Policy.from_maps(manager)
+        manager.close()
+        if policy is None:
+            print("Simulating an empty policy plus the given options")
+            policy = Policy()
+    try:
+        if blocklist:
+            policy.networks = list(dict.fromkeys(load_blocklist(blocklist)))
+        capture = Capture(path)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    policy.ports.update(ports)
+    if not rate_limit:
+        policy.rate_limit = dict.fromkeys(RATE_LIMIT_FIELDS, 0)
+
+    start = time.monotonic()
+    report = simulate(capture, policy)
+    elapsed = time.monotonic() - start
+
+    checked = None
+    if verify_count:
+        checked = verify(capture, policy, verify_count)
+        if checked is None:
+            print("Error: could not load the program to verify against")
+            sys.exit(1)
+
+    if as_json:
+        report["sources"] = [{"ip": source_name(src), "packets": count}
+                             for src, count in report["sources"].most_common(top)]
+        report["seconds"] = elapsed
+        if checked:
+            report["verify"] = {"checked": checked[0], "mismatches": checked[1]}
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, top)
+        print(f"\nSimulated {len(capture):,} packets in {elapsed:.2f}s "
+              f"({len(capture) / max(elapsed, 1e-9):,.0f} packets/sec)")
+        if checked:
+            print(f"Verified {checked[0]:,} packets against the program: "
+                  f"{len(checked[1])} mismatches")
+            for mismatch in checked[1][:10]:
+                print(f"  packet {mismatch['packet']}: simulated {mismatch['simulated']}, "
+                      f"program {mismatch['program']}")
+    if checked and checked[1]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
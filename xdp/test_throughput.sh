@@ -0,0 +1,68 @@
+#!/bin/bash
+
+echo "=========================================="
+echo "XDP Filter Throughput Test"
+echo "=========================================="
+echo ""
+
+# Colors for output
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+BLUE='\033[0;34m'
+NC='\033[0m' # No Color
+
+# Test configuration, override through the environment
+SIZES="${SIZES:-0,1000,10000,100000,1000000}"
+MIX="${MIX:-blocked=50,allowed=40,tcp_8080=10}"
+DURATION="${DURATION:-5}"
+WORKERS="${WORKERS:-$(nproc)}"
+OUTPUT="${OUTPUT:-throughput-$(date +%Y%m%d-%H%M%S).json}"
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+print_step() {
+    echo -e "${BLUE}[STEP]${NC} $1"
+}
+
+print_success() {
+    echo -e "${GREEN}[SUCCESS]${NC} $1"
+}
+
+print_error() {
+    echo -e "${RED}[ERROR]${NC} $1"
+}
+
+if [ "$1" = "--help" ] || [ "$1" = "-h" ]; then
+    echo "Usage: $0"
+    echo ""
+    echo "Sends $MIX over a veth pair for $DURATION s per blocklist size"
+    echo "and writes the pps-vs-blocklist-size curve to a JSON file."
+    echo ""
+    echo "Environment: SIZES, MIX, DURATION, WORKERS, OUTPUT"
+    echo ""
+    echo "Prerequisites: root, clang, bpftool, python3 with numpy and pyroute2"
+    exit 0
+fi
+
+if [ "$(id -u)" -ne 0 ]; then
+    print_error "Must run as root (creates a network namespace and loads BPF)"
+    exit 1
+fi
+
+print_step "Blocklist sizes: $SIZES, mix: $MIX, $DURATION s per step, $WORKERS workers"
+if ! python3 "$SCRIPT_DIR/traffic_gen.py" --sizes "$SIZES" --mix "$MIX" \
+        --duration "$DURATION" --workers "$WORKERS" --json > "$OUTPUT"; then
+    print_error "Traffic generator failed"
+    exit 1
+fi
+
+print_success "Results written to $OUTPUT"
+echo ""
+python3 - "$OUTPUT" <<'PYEOF'
+import json, sys
+results = json.load(open(sys.argv[1]))["results"]
+peak = max((r["received_pps"] for r in results), default=0) or 1
+print(f"{'Blocklist':>10} {'Received pps':>14}")
+for r in results:
+    bar = "#" * int(40 * r["received_pps"] / peak)
+    print(f"{r['blocklist_size']:>10,} {r['received_pps']:>14,.0f}  {bar}")
+PYEOF
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The tools are run as scripts from xdp/, importing each other by module name
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,109 @@
+"""File-backed demo maps from map_backends.py"""
+
+import os
+import errno
+import struct
+
+import pytest
+
+import map_backends
+from map_backends import DemoMap, DemoLPMMap, DEMO_NOEXIST, DEMO_EXIST
+
+def key(n):
+    return struct.pack(">I", n)
+
+def value(n):
+    return struct.pack("=Q", n)
+
+@pytest.fixture
+def store(tmp_path):
+    return str(tmp_path)
+
+def open_map(store, max_entries=100):
+    return DemoMap(store, "blocked_ips", 4, 8, max_entries)
+
+def test_update_lookup_delete(store):
+    bpf_map = open_map(store)
+    bpf_map.update(key(1), value(10))
+    bpf_map.update(key(1), value(11))
+    assert bpf_map.lookup(key(1)) == value(11)
+    assert bpf_map.lookup(key(2)) is None
+    bpf_map.delete(key(1))
+    assert bpf_map.lookup(key(1)) is None
+    assert bpf_map.count() == 0
+
+def test_write_errors_match_the_kernel(store):
+    bpf_map = open_map(store, max_entries=2)
+    bpf_map.update(key(1), value(1))
+    with pytest.raises(OSError) as raised:
+        bpf_map.update(key(1), value(2), DEMO_NOEXIST)
+    assert raised.value.errno == errno.EEXIST
+    with pytest.raises(OSError) as raised:
+        bpf_map.update(key(2), value(2), DEMO_EXIST)
+    assert raised.value.errno == errno.ENOENT
+    with pytest.raises(OSError) as raised:
+        bpf_map.delete(key(2))
+    assert raised.value.errno == errno.ENOENT
+
+    # A batch fails the entries past capacity and keeps the others
+    results = bpf_map.update_batch([key(2), key(3), key(1)], [value(2), value(3), value(4)])
+    assert results == [(True, ""), (False, os.strerror(errno.E2BIG)), (True, "")]
+    assert bpf_map.count() == 2
+    assert bpf_map.delete_batch([key(3), key(2)]) == [(False, os.strerror(errno.ENOENT)), (True, "")]
+
+def test_log_is_replayed_by_other_handles(store):
+    writer = open_map(store)
+    reader = open_map(store)
+    writer.update_batch([key(n) for n in range(5)], [value(n) for n in range(5)])
+    assert reader.count() == 5
+    writer.delete(key(3))
+    assert reader.lookup(key(3)) is None
+    assert [k for k, _ in reader.items()] == [key(n) for n in (0, 1, 2, 4)]
+
+    # A fresh handle rebuilds the same contents from the files
+    writer.close()
+    reopened = open_map(store)
+    assert reopened.items() == reader.items()
+
+def test_compact_keeps_contents(store):
+    bpf_map = open_map(store)
+    other = open_map(store)
+    bpf_map.update_batch([key(n) for n in range(10)], [value(n) for n in range(10)])
+    bpf_map.delete_batch([key(0), key(9)])
+    before = bpf_map.items()
+    bpf_map.compact()
+    assert os.path.getsize(os.path.join(store, "blocked_ips.log")) == 0
+    assert bpf_map.items() == before
+    assert other.items() == before
+    assert other.count() == 8
+
+    # Writes after a compaction land on top of the snapshot
+    other.update(key(0), value(100))
+    other.delete(key(5))
+    assert bpf_map.lookup(key(0)) == value(100)
+    assert bpf_map.lookup(key(5)) is None
+    assert bpf_map.count() == 8
+
+def test_log_is_compacted_once_it_grows(store, monkeypatch):
+    monkeypatch.setattr(map_backends, "DEMO_COMPACT_MIN", 8)
+    bpf_map = open_map(store)
+    for n in range(20):
+        bpf_map.update(key(n), value(n))
+    log_records = os.path.getsize(os.path.join(store, "blocked_ips.log")) // bpf_map.record_size
+    assert log_records <= 8
+    assert bpf_map.count() == 20
+    assert [k for k, _ in bpf_map.items()] == [key(n) for n in range(20)]
+
+def test_lpm_lookup_finds_longest_prefix(store):
+    tries = DemoLPMMap(store, "blocked_cidrs", 8, 1, 16)
+
+    def lpm_key(prefixlen, *octets):
+        return struct.pack("=I", prefixlen) + bytes(octets)
+
+    tries.update(lpm_key(8, 10, 0, 0, 0), b"\x01")
+    tries.update(lpm_key(24, 10, 1, 2, 0), b"\x02")
+    assert tries.lookup(lpm_key(32, 10, 1, 2, 3)) == b"\x02"
+    assert tries.lookup(lpm_key(32, 10, 1, 3, 3)) == b"\x01"
+    assert tries.lookup(lpm_key(32, 11, 1, 2, 3)) is None
+    assert tries.update_batch([lpm_key(33, 10, 0, 0, 0)], [b"\x01"]) == [
+        (False, os.strerror(errno.EINVAL))]
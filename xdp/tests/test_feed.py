@@ -0,0 +1,64 @@
+"""Feed parsing and key deduplication behind `ip_manager.py import`"""
+
+import random
+import socket
+import ipaddress
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from ip_manager import KeySet, parse_feed
+
+def v4(*ips):
+    return b"".join(socket.inet_pton(socket.AF_INET, ip) for ip in ips)
+
+def v6(*ips):
+    return b"".join(socket.inet_pton(socket.AF_INET6, ip) for ip in ips)
+
+def test_parse_feed_sorts_entries():
+    lines = ["# header\n", "\n", "10.0.0.1\n", "  10.0.0.2  # trailing comment\n",
+             "192.0.2.0/24\n", "198.51.100.7/32\n", "2001:db8::1\n", "2001:db8:1::/48\n",
+             "2001:db8::2/128\n", "not-an-ip\n", "10.0.0.300\n", "10.0.0.0/33\n"]
+    packed, networks, rejected = parse_feed(lines)
+    assert packed[4] == v4("10.0.0.1", "10.0.0.2", "198.51.100.7")
+    assert packed[6] == v6("2001:db8::1", "2001:db8::2")
+    assert networks == [ipaddress.ip_network("192.0.2.0/24"), ipaddress.ip_network("2001:db8:1::/48")]
+    assert rejected == ["not-an-ip", "10.0.0.300", "10.0.0.0/33"]
+
+def test_parse_feed_accepts_host_bits_in_cidrs():
+    _, networks, rejected = parse_feed(["10.1.2.3/16"])
+    assert networks == [ipaddress.ip_network("10.1.0.0/16")]
+    assert rejected == []
+
+def test_keyset_reports_new_keys_and_duplicates():
+    keys = KeySet(4)
+    new, duplicates = keys.add(v4("10.0.0.2", "10.0.0.1", "10.0.0.2"))
+    assert sorted(new) == [v4("10.0.0.1"), v4("10.0.0.2")]
+    assert duplicates == 1
+
+    new, duplicates = keys.add(v4("10.0.0.1", "10.0.0.3"))
+    assert new == [v4("10.0.0.3")]
+    assert duplicates == 1
+    assert len(keys) == 3
+    assert keys.add(b"") == ([], 0)
+
+def test_keyset_keeps_trailing_zero_bytes_of_ipv6_keys():
+    keys = KeySet(16)
+    new, _ = keys.add(v6("2001:db8::", "2001:db8::1"))
+    assert sorted(new) == [v6("2001:db8::"), v6("2001:db8::1")]
+    assert all(len(key) == 16 for key in new)
+    assert keys.add(v6("2001:db8::")) == ([], 1)
+
+def test_keyset_matches_a_python_set():
+    rng = random.Random(3)
+    keys = KeySet(4)
+    seen = set()
+    for _ in range(50):
+        chunk = [rng.randrange(2 ** 12).to_bytes(4, "big") for _ in range(rng.randrange(200))]
+        new, duplicates = keys.add(b"".join(chunk))
+        assert set(new) == set(chunk) - seen
+        assert len(new) + duplicates == len(chunk)
+        seen.update(chunk)
+    assert len(keys) == len(seen)
+    assert keys.members.tobytes() == b"".join(sorted(seen))
@@ -0,0 +1,90 @@
+"""XDPIPManager and the daemon on the file-backed demo maps"""
+
+import os
+import threading
+import ipaddress
+
+import pytest
+
+import bpf_syscall
+from ip_manager import XDPIPManager
+from blocklist_daemon import BlocklistService
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = XDPIPManager(backend="demo")
+    manager.backend.store_dir = str(tmp_path)
+    yield manager
+    manager.close()
+
+def networks(*entries):
+    return [ipaddress.ip_network(entry) for entry in entries]
+
+def test_remove_splits_the_range_a_host_was_folded_into(manager):
+    assert manager.add_blocked_ip("10.0.0.4")
+    manager.update_networks(add=networks("10.0.0.5/32", "10.0.0.6/31"))
+    # The permanent host is aggregated into the prefix
+    assert manager.get_blocked_ips() == []
+    assert manager.get_blocked_ranges() == networks("10.0.0.4/30")
+
+    assert manager.remove_blocked_ip("10.0.0.4")
+    assert not manager.is_blocked("10.0.0.4")
+    assert all(manager.is_blocked(ip) for ip in ("10.0.0.5", "10.0.0.6", "10.0.0.7"))
+
+def test_batch_remove_splits_ranges(manager):
+    manager.update_networks(add=networks("10.0.0.0/30", "2001:db8::/126"))
+    results = manager.remove_blocked_ips(["10.0.0.1", "10.0.0.2", "2001:db8::3", "10.0.1.1"])
+    assert [ok for _, ok, _ in results] == [True, True, True, False]
+    assert [ip for ip in ("10.0.0.0", "10.0.0.1", "10.0.0.2", "10.0.0.3")
+            if manager.is_blocked(ip)] == ["10.0.0.0", "10.0.0.3"]
+    assert not manager.is_blocked("2001:db8::3")
+    assert manager.is_blocked("2001:db8::2")
+
+def test_daemon_remove_splits_ranges(tmp_path):
+    service = BlocklistService("demo")
+    service.manager.backend.store_dir = str(tmp_path)
+    service.manager.update_networks(add=networks("10.0.0.4/30"))
+    response = service.handle({"op": "remove", "ips": ["10.0.0.4"]})
+    assert response["results"] == [["10.0.0.4", True, ""]]
+    assert not service.manager.is_blocked("10.0.0.4")
+    assert service.manager.is_blocked("10.0.0.5")
+
+def test_daemon_reads_and_writes_share_the_manager_lock(tmp_path):
+    service = BlocklistService("demo")
+    service.manager.backend.store_dir = str(tmp_path)
+    responses = []
+    with service.manager_lock:
+        pending = service.submit("add", ["10.0.0.1"])
+        reader = threading.Thread(
+            target=lambda: responses.append(service.handle({"op": "check", "ips": ["10.0.0.1"]})))
+        reader.start()
+        # Neither the writer nor the read may touch the maps meanwhile
+        assert not pending.done.wait(0.2)
+        assert responses == []
+    assert pending.wait()["ok"]
+    reader.join()
+    assert len(responses) == 1
+
+def test_loaded_program_reopens_after_a_reload(manager, tmp_path, monkeypatch):
+    opened = []
+
+    def prog_fd_by_id(prog_id):
+        opened.append(prog_id)
+        return os.open(os.devnull, os.O_RDONLY)
+
+    monkeypatch.setattr(bpf_syscall, "prog_fd_by_id", prog_fd_by_id)
+    manager.prog_id_file = str(tmp_path / "prog_id")
+    assert manager.loaded_program() is None
+
+    (tmp_path / "prog_id").write_text("7\n")
+    blocked_ips = manager.find_blocked_ips_map()
+    prog = manager.loaded_program()
+    assert prog[0] == 7 and manager.loaded_program() == prog
+    # The maps opened before the first program stay cached
+    assert manager.find_blocked_ips_map() is blocked_ips
+
+    (tmp_path / "prog_id").write_text("8\n")
+    assert manager.loaded_program()[0] == 8
+    assert opened == [7, 8]
+    # A new program means new maps, so the handles are opened again
+    assert manager.find_blocked_ips_map() is not blocked_ips
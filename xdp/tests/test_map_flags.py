@@ -0,0 +1,78 @@
+"""BPF_NOEXIST/BPF_EXIST on batched writes through each map backend"""
+
+import os
+import errno
+import struct
+
+import pytest
+
+import map_backends
+from bpf_syscall import BPFMap, BPF_NOEXIST, BPF_EXIST
+from map_backends import BpftoolMap
+from ip_manager import replay_blocklist
+
+# BPF_MAP_TYPE_HASH
+HASH = 1
+
+@pytest.fixture
+def bpf_map():
+    try:
+        bpf_map = BPFMap.create(HASH, 4, 8, 16)
+    except OSError as e:
+        pytest.skip(f"cannot create BPF maps: {e.strerror}")
+    yield bpf_map
+    bpf_map.close()
+
+@pytest.fixture
+def staged(bpf_map):
+    staged = BPFMap.create(HASH, 4, 8, 16)
+    yield staged
+    staged.close()
+
+def key(n):
+    return struct.pack(">I", n)
+
+def value(n):
+    return struct.pack("=Q", n)
+
+def test_batch_noexist_keeps_existing_values(bpf_map):
+    bpf_map.update(key(1), value(10))
+    results = bpf_map.update_batch([key(1), key(2)], [value(11), value(12)], BPF_NOEXIST)
+    assert results == [(False, os.strerror(errno.EEXIST)), (True, "")]
+    assert bpf_map.lookup(key(1)) == value(10)
+    assert bpf_map.lookup(key(2)) == value(12)
+
+def test_batch_exist_only_replaces(bpf_map):
+    bpf_map.update(key(1), value(10))
+    results = bpf_map.update_batch([key(1), key(2)], [value(11), value(12)], BPF_EXIST)
+    assert results == [(True, ""), (False, os.strerror(errno.ENOENT))]
+    assert bpf_map.lookup(key(1)) == value(11)
+    assert bpf_map.lookup(key(2)) is None
+
+def test_replay_keeps_values_written_to_the_new_generation(bpf_map, staged):
+    # The copy read keys 1 and 2; since then the old map gained 3 and 4 and lost 2
+    for n in (1, 3, 4):
+        bpf_map.update(key(n), value(n))
+    staged.update(key(1), value(1))
+    staged.update(key(2), value(2))
+    # Written to the new generation after the swap, newer than the old map's copy
+    staged.update(key(3), value(30))
+    added, deleted, failures = replay_blocklist(bpf_map, staged, {key(1), key(2)})
+    assert (added, deleted, failures) == (1, 1, [])
+    assert staged.lookup(key(3)) == value(30)
+    assert staged.lookup(key(4)) == value(4)
+    assert staged.lookup(key(2)) is None
+
+def test_bpftool_batch_passes_the_flags(monkeypatch):
+    commands = []
+    monkeypatch.setattr(map_backends, "run_batch", lambda lines: commands.extend(lines) or [])
+    bpf_map = BpftoolMap.__new__(BpftoolMap)
+    bpf_map.ref = "pinned /sys/fs/bpf/xdp_filter/blocked_ips"
+    bpf_map.update_batch([key(1)], [value(1)], BPF_NOEXIST)
+    bpf_map.update_batch([key(1)], [value(1)])
+    assert commands == [
+        "map update pinned /sys/fs/bpf/xdp_filter/blocked_ips key hex 00 00 00 01 "
+        "value hex 01 00 00 00 00 00 00 00 noexist",
+        "map update pinned /sys/fs/bpf/xdp_filter/blocked_ips key hex 00 00 00 01 "
+        "value hex 01 00 00 00 00 00 00 00 any",
+    ]
@@ -0,0 +1,169 @@
+"""Rule checks and lowering in policy_compiler.py"""
+
+import struct
+import ipaddress
+
+import pytest
+
+from policy_compiler import (parse_policy, find_cover, check_rules, lower_rules, expand_prefixes,
+                             build_layout, trie_depth, lookup_report)
+
+def policy(*lines):
+    return parse_policy(lines)
+
+def ip(address):
+    return int(ipaddress.ip_address(address))
+
+def span(network):
+    network = ipaddress.ip_network(network)
+    return int(network.network_address), int(network.broadcast_address)
+
+def lpm_key(network):
+    network = ipaddress.ip_network(network)
+    return struct.pack("=I", network.prefixlen) + network.network_address.packed
+
+def findings(rules):
+    return [(rule.number, problem, [other.number for other in related])
+            for rule, problem, related in check_rules(rules)]
+
+@pytest.mark.parametrize("line", ["block from 10.0.0.0/8", "drop from", "drop from 10.0.0.0/33",
+                                  "drop port 70000", "drop proto icmp", "drop to 10.0.0.1",
+                                  "drop port 22 port 23"])
+def test_parse_rejects_bad_rules(line):
+    with pytest.raises(ValueError):
+        policy(line)
+
+def test_parse_policy_skips_comments_and_numbers_rules():
+    rules = policy("# header", "", "drop from 10.0.0.0/8  # scanners", "pass port 80")
+    assert [(rule.number, rule.line, rule.action) for rule in rules] == [
+        (1, 3, "drop"), (2, 4, "pass")]
+    assert rules[0].kind == "source"
+    # A port match without a protocol means TCP and UDP
+    assert rules[1].kind == "port" and rules[1].protos == {"tcp", "udp"}
+
+def test_find_cover_needs_every_address_covered():
+    early = policy("drop from 10.0.0.0/9", "drop from 10.128.0.0/9")
+    assert find_cover(policy("drop from 10.0.0.0/8")[0], early) == set(early)
+    assert find_cover(policy("drop from 10.0.0.0/7")[0], early) is None
+    assert find_cover(policy("drop from 10.0.0.0/8")[0], early[:1]) is None
+
+def test_find_cover_counts_only_deciding_rules():
+    rules = policy("drop from 10.0.0.0/8", "pass from 10.1.0.0/16", "drop from 10.1.2.0/24")
+    # The /16 never decides anything the /8 left open, so it is not part of the cover
+    assert find_cover(rules[2], rules[:2]) == {rules[0]}
+
+def test_find_cover_checks_protocols_and_ports():
+    early = policy("drop proto tcp port 22", "drop proto udp port 20-30")
+    assert find_cover(policy("drop port 22")[0], early) == set(early)
+    assert find_cover(policy("drop port 22-23")[0], early) is None
+    assert find_cover(policy("drop from any")[0], early) is None
+
+def test_check_rules_reports_shadowed_and_redundant():
+    rules = policy("drop from 10.0.0.0/8",
+                   "pass from 10.1.0.0/16",
+                   "drop from 10.2.0.0/16",
+                   "drop from 192.0.2.0/24",
+                   "pass port 443",
+                   "drop port 1-1024",
+                   "pass from 198.51.100.0/24")
+    assert findings(rules) == [
+        (2, "shadowed", [1]),
+        (3, "redundant", [1]),
+        # Nothing later drops what it passes, so it only repeats the default
+        (7, "redundant", []),
+    ]
+
+def test_lower_rules_turns_pass_rules_into_holes():
+    source_drop, port_drop, errors = lower_rules(policy(
+        "pass from 10.0.0.1", "drop from 10.0.0.0/30,2001:db8::/127"))
+    assert errors == []
+    assert source_drop[4] == [(ip("10.0.0.0"), ip("10.0.0.0")), (ip("10.0.0.2"), ip("10.0.0.3"))]
+    assert source_drop[6] == [span("2001:db8::/127")]
+    assert port_drop == {"tcp": [], "udp": []}
+
+    source_drop, port_drop, errors = lower_rules(policy(
+        "pass proto tcp port 80", "drop proto tcp port 1-1024", "drop proto udp port 53"))
+    assert errors == []
+    assert source_drop == {4: [], 6: []}
+    assert port_drop == {"tcp": [(1, 79), (81, 1024)], "udp": [(53, 53)]}
+
+def test_lower_rules_keeps_the_first_match():
+    rules = policy("drop from 10.0.0.0/24", "pass from 10.0.0.0/16", "drop from 10.0.0.0/8")
+    source_drop, _, errors = lower_rules(rules)
+    assert errors == []
+    assert source_drop[4] == [span("10.0.0.0/24"), (ip("10.1.0.0"), ip("10.255.255.255"))]
+
+@pytest.mark.parametrize("lines, message", [
+    (("pass port 80", "drop from 10.0.0.0/8"), "sources are checked before ports"),
+    (("pass from 10.0.0.0/8", "drop port 22"), "the port bitmap applies to every source"),
+    (("drop from 10.0.0.0/8 port 22",), "cannot combine"),
+    (("drop from 10.0.0.0/8 proto tcp",), "cannot combine"),
+])
+def test_lower_rules_reports_orders_the_program_cannot_express(lines, message):
+    _, _, errors = lower_rules(policy(*lines))
+    assert len(errors) == 1 and message in errors[0]
+
+def test_lower_rules_ignores_pass_rules_for_decided_traffic():
+    # The pass only covers what the drop already decided, so it is no hole
+    _, _, errors = lower_rules(policy("drop from 10.0.0.0/8", "pass from 10.1.0.0/16",
+                                      "drop port 22"))
+    assert errors == []
+
+def test_expand_prefixes_takes_the_smallest_first():
+    hosts = set()
+    prefixes = {lpm_key("10.0.0.0/28"), lpm_key("10.0.1.0/30"), lpm_key("10.0.2.0/24")}
+    assert expand_prefixes(hosts, prefixes, 32, room=100) == 2
+    assert prefixes == {lpm_key("10.0.2.0/24")}
+    assert len(hosts) == 20
+    assert ipaddress.ip_address("10.0.0.15").packed in hosts
+
+    hosts = set()
+    prefixes = {lpm_key("10.0.0.0/28"), lpm_key("10.0.1.0/30")}
+    assert expand_prefixes(hosts, prefixes, 32, room=10) == 1
+    assert prefixes == {lpm_key("10.0.0.0/28")}
+
+def test_build_layout_splits_and_expands():
+    source_drop, port_drop, _ = lower_rules(policy("drop from 192.0.2.0/24,198.51.100.0/29",
+                                                   "drop from 203.0.113.7"))
+    layout, errors = build_layout(source_drop, port_drop, {"blocked_ips": 1000})
+    assert errors == []
+    assert layout["prefixes"][4] == {lpm_key("192.0.2.0/24")}
+    assert len(layout["hosts"][4]) == 9
+    assert layout["expanded"][4] == 1
+
+    layout, errors = build_layout(source_drop, port_drop, {"blocked_ips": 4}, expand=0)
+    assert layout["prefixes"][4] == {lpm_key("192.0.2.0/24"), lpm_key("198.51.100.0/29")}
+    assert errors == []
+    layout, errors = build_layout(*lower_rules(policy("drop from 10.0.0.1,10.0.0.3,10.0.0.5"))[:2],
+                                  {"blocked_ips": 2})
+    assert errors == ["blocked_ips needs 3 entries but holds 2"]
+
+@pytest.mark.parametrize("networks, depth", [
+    ([], 0),
+    (["10.0.0.0/8"], 1),
+    (["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24"], 3),
+    # Diverging prefixes share one intermediate node
+    (["10.0.0.0/24", "10.0.1.0/24"], 2),
+    (["10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24"], 3),
+    (["10.0.0.0/8", "192.0.2.0/24"], 2),
+    (["0.0.0.0/0", "10.0.0.0/24", "10.0.1.0/24"], 3),
+])
+def test_trie_depth(networks, depth):
+    assert trie_depth({lpm_key(network) for network in networks}) == depth
+
+def test_trie_depth_ipv6():
+    prefixes = {lpm_key("2001:db8::/32"), lpm_key("2001:db8:1::/48"), lpm_key("2001:db8:2::/48")}
+    assert trie_depth(prefixes, 128) == 3
+
+def test_lookup_report_leaves_out_impossible_paths():
+    source_drop, port_drop, _ = lower_rules(policy("drop from 10.0.0.1"))
+    layout, _ = build_layout(source_drop, port_drop, {})
+    paths = {(entry["version"], entry["path"]) for entry in lookup_report(layout)}
+    assert (4, "dropped by source, exact") in paths
+    assert (4, "dropped by source, prefix") not in paths
+    assert (4, "dropped by port") not in paths
+    assert (6, "dropped by source, exact") not in paths
+
+    passed = next(entry for entry in lookup_report(layout, rate_limited=True)
+                 if entry["path"] == "passed TCP/UDP" and entry["version"] == 4)
+    assert passed["maps"].index("rate_state") == passed["maps"].index("rate_config") + 1
@@ -0,0 +1,76 @@
+"""Range helpers behind prefix aggregation in ip_manager.py"""
+
+import random
+import struct
+import ipaddress
+
+from ip_manager import merge_ranges, subtract_ranges, ranges_to_rules, rules_to_ranges
+
+BASE = int(ipaddress.ip_address("10.0.0.0"))
+
+def addresses(ranges):
+    return {address for start, end in ranges for address in range(start, end + 1)}
+
+def random_ranges(rng, count, span=1024):
+    ranges = []
+    for _ in range(count):
+        start = BASE + rng.randrange(span)
+        ranges.append((start, min(start + rng.randrange(40), BASE + span - 1)))
+    return ranges
+
+def test_merge_joins_overlapping_and_adjacent():
+    assert merge_ranges([(10, 20), (15, 30), (31, 35), (40, 50)]) == [(10, 35), (40, 50)]
+
+def test_merge_folds_hosts_into_ranges():
+    assert merge_ranges([(10, 20)], hosts=[9, 15, 21, 23, 24]) == [(9, 21), (23, 24)]
+    assert merge_ranges([], hosts=[5, 3, 4, 7]) == [(3, 5), (7, 7)]
+
+def test_merge_keeps_address_zero():
+    assert merge_ranges([(0, 3)], hosts=[0, 4]) == [(0, 4)]
+
+def test_subtract_splits_and_trims():
+    assert subtract_ranges([(10, 50)], [(20, 29), (40, 60)]) == [(10, 19), (30, 39)]
+    assert subtract_ranges([(10, 20), (30, 40)], [(0, 10), (40, 40)]) == [(11, 20), (30, 39)]
+    assert subtract_ranges([(10, 20)], [(5, 25)]) == []
+    assert subtract_ranges([(10, 20)], []) == [(10, 20)]
+
+def test_ranges_to_rules_uses_aligned_prefixes():
+    start = int(ipaddress.ip_address("192.0.2.0"))
+    hosts, prefixes = ranges_to_rules([(start, start + 255), (start + 256, start + 256)])
+    assert hosts == {ipaddress.ip_address("192.0.3.0").packed}
+    assert prefixes == {struct.pack("=I", 24) + ipaddress.ip_address("192.0.2.0").packed}
+
+def test_ranges_to_rules_whole_space():
+    assert ranges_to_rules([(0, 2 ** 32 - 1)]) == (set(), {struct.pack("=I", 0) + bytes(4)})
+
+def test_ranges_to_rules_ipv6_hosts_are_exact_keys():
+    address = int(ipaddress.ip_address("2001:db8::1"))
+    hosts, prefixes = ranges_to_rules([(address, address + 2)], bits=128)
+    assert hosts == {address.to_bytes(16, "big")}
+    assert prefixes == {struct.pack("=I", 127) + (address + 1).to_bytes(16, "big")}
+
+def test_merge_and_subtract_match_sets():
+    rng = random.Random(1)
+    for _ in range(200):
+        ranges = random_ranges(rng, rng.randrange(1, 12))
+        hosts = [BASE + rng.randrange(1024) for _ in range(rng.randrange(6))]
+        holes = merge_ranges(random_ranges(rng, rng.randrange(5)))
+        merged = merge_ranges(ranges, hosts)
+
+        assert addresses(merged) == addresses(ranges) | set(hosts)
+        # Sorted, disjoint and not adjacent
+        assert all(a[1] + 1 < b[0] for a, b in zip(merged, merged[1:]))
+        assert addresses(subtract_ranges(merged, holes)) == addresses(merged) - addresses(holes)
+
+def test_rules_round_trip():
+    rng = random.Random(2)
+    for _ in range(200):
+        merged = merge_ranges(random_ranges(rng, rng.randrange(1, 8)))
+        hosts, prefixes = ranges_to_rules(merged)
+
+        host_ints, prefix_ranges = rules_to_ranges(hosts, prefixes)
+        assert merge_ranges(prefix_ranges, host_ints) == merged
+        # As few prefixes as ipaddress needs to cover the same ranges
+        fewest = sum(len(list(ipaddress.summarize_address_range(
+            ipaddress.ip_address(start), ipaddress.ip_address(end)))) for start, end in merged)
+        assert len(hosts) + len(prefixes) == fewest
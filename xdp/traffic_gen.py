@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+High-rate traffic generator for the XDP filter
+Builds a veth pair into a private network namespace, attaches a private
+copy of the filter to the host end and blasts packet mixes at it from the
+namespace through AF_PACKET TX rings, measuring what the filter receives,
+passes and drops for each blocklist size
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import errno
+import random
+import socket
+import contextlib
+import struct
+import subprocess
+
+import numpy as np
+
+import bench
+from map_backends import run_command
+
+NETNS = "xdpgen"
+HOST_IF = "xgen0"      # receives the traffic, runs the filter
+SENDER_IF = "xgen1"    # inside NETNS
+
+DEFAULT_MIX = {"blocked": 50, "allowed": 40, "tcp_8080": 10}
+DEFAULT_SIZES = [0, 1000, 100000, 1000000]
+DEFAULT_DURATION = 5.0
+
+# Allowed sources come from 172.16.0.0/12, never part of the 10.0.0.0/8 blocklist
+ALLOWED_BASE = 0xAC100000
+ALLOWED_SPAN = 1 << 20
+
+# Packet socket options (include/uapi/linux/if_packet.h)
+SOL_PACKET = 263
+PACKET_TX_RING = 13
+PACKET_LOSS = 14
+PACKET_VERSION = 10
+PACKET_QDISC_BYPASS = 20
+TPACKET_V2 = 1
+TP_STATUS_AVAILABLE = 0
+TP_STATUS_SEND_REQUEST = 1
+TP_STATUS_WRONG_FORMAT = 4
+
+# TX frames: tpacket2_hdr (32 bytes) followed by the packet
+TX_FRAME_SIZE = 2048
+TX_DATA_OFFSET = 32
+TX_FRAMES = 4096
+TX_BLOCK_SIZE = 1 << 16
+
+class TxRing:
+    """AF_PACKET socket with a PACKET_TX_RING.
+
+    Frames are written once into the shared ring; each batch only flips
+    their status words back to SEND_REQUEST and one send() hands the whole
+    batch to the kernel.
+    """
+
+    def __init__(self, ifname, frames):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+        self.sock.setsockopt(SOL_PACKET, PACKET_LOSS, 1)
+        try:
+            self.sock.setsockopt(SOL_PACKET, PACKET_QDISC_BYPASS, 1)
+        except OSError:
+            pass
+
+        frames_per_block = TX_BLOCK_SIZE // TX_FRAME_SIZE
+        self.count = TX_FRAMES
+        blocks = self.count // frames_per_block
+        self.sock.setsockopt(SOL_PACKET, PACKET_TX_RING,
+                             struct.pack("=IIII", TX_BLOCK_SIZE, blocks, TX_FRAME_SIZE, self.count))
+        self.sock.bind((ifname, 0))
+        self.ring = mmap.mmap(self.sock.fileno(), TX_BLOCK_SIZE * blocks,
+                              mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.status = np.ndarray((self.count,), dtype=np.uint32, buffer=self.ring,
+                                 strides=(TX_FRAME_SIZE,))
+        # Frame indexes twice over, so a window starting at head never wraps
+        self.order = np.concatenate([np.arange(self.count)] * 2)
+        self.head = 0
+
+        for i in range(self.count):
+            frame = frames[i % len(frames)]
+            base = i * TX_FRAME_SIZE
+            struct.pack_into("=I", self.ring, base + 4, len(frame))
+            self.ring[base + TX_DATA_OFFSET:base + TX_DATA_OFFSET + len(frame)] = frame
+
+    def close(self):
+        del self.status
+        self.ring.close()
+        self.sock.close()
+
+    def send(self, limit):
+        """Queue up to limit free frames and flush them, returning how many were queued"""
+        # Frames the kernel rejected stay marked until handed back
+        self.status[self.status == TP_STATUS_WRONG_FORMAT] = TP_STATUS_AVAILABLE
+        # The kernel walks the ring in order from its own head and stops at
+        # the first frame not requested, so only the free run at head is used
+        order = self.order[self.head:self.head + min(limit, self.count)]
+        free = self.status[order] == TP_STATUS_AVAILABLE
+        run = len(free) if free.all() else int(np.argmin(free))
+        if not run:
+            return 0
+        self.status[order[:run]] = TP_STATUS_SEND_REQUEST
+        self.head = (self.head + run) % self.count
+        try:
+            self.sock.send(b"", socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            if e.errno != errno.ENOBUFS:
+                raise
+        return run
+
+def build_frames(mix, blocklist_size, seed, count=TX_FRAMES):
+    """count frames drawn from the mix, blocked sources spread over the blocklist"""
+    rng = random.Random(seed)
+    kinds = [kind for kind, weight in mix.items() for _ in range(weight)]
+    frames = []
+    for _ in range(count):
+        kind = rng.choice(kinds)
+        if kind == "blocked" and blocklist_size:
+            src = socket.inet_ntoa(struct.pack("!I", bench.BLOCKED_BASE + 1 + rng.randrange(blocklist_size)))
+        else:
+            src = socket.inet_ntoa(struct.pack("!I", ALLOWED_BASE + rng.randrange(ALLOWED_SPAN)))
+        if kind in ("blocked", "allowed"):
+            frames.append(bench.ipv4_tcp(src, 80))
+        elif kind == "tcp_8080":
+            frames.append(bench.ipv4_tcp(src, bench.BLOCKED_PORT))
+        elif kind == "ipv6":
+            frames.append(bench.ipv6_tcp(bench.ALLOWED_SRC6, 80))
+        else:
+            frames.append(bench.arp_request())
+    return frames
+
+def run_worker(ifname, mix, blocklist_size, seed, duration, pps):
+    """Send for duration seconds, at pps if given, and report the counts as JSON"""
+    ring = TxRing(ifname, build_frames(mix, blocklist_size, seed))
+    queued = 0
+    start = time.monotonic()
+    deadline = start + duration
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            limit = ring.count if not pps else int(pps * (now - start)) - queued
+            if limit <= 0:
+                time.sleep(0.0005)
+                continue
+            queued += ring.send(limit)
+    finally:
+        elapsed = time.monotonic() - start
+        # Let the last batch drain before the ring is unmapped
+        time.sleep(0.05)
+        ring.close()
+    print(json.dumps({"queued": queued, "seconds": elapsed}))
+
+def setup_topology():
+    """Create NETNS with SENDER_IF, peered with HOST_IF in the current namespace"""
+    teardown_topology()
+    for cmd in (f"ip netns add {NETNS}",
+                f"ip link add {HOST_IF} type veth peer name {SENDER_IF} netns {NETNS}",
+                f"ip link set {HOST_IF} up",
+                f"ip netns exec {NETNS} ip link set {SENDER_IF} up"):
+        _, stderr, code = run_command(cmd)
+        if code != 0:
+            print(f"Error: {cmd}: {stderr}")
+            teardown_topology()
+            return False
+    return True
+
+def teardown_topology():
+    # Deleting the namespace destroys SENDER_IF and with it the veth pair
+    run_command(f"ip netns del {NETNS} 2>/dev/null")
+    run_command(f"ip link del {HOST_IF} 2>/dev/null")
+
+def sender_tx_packets():
+    """Packets SENDER_IF has transmitted, shared by all workers"""
+    stdout, _, _ = run_command(f"ip netns exec {NETNS} cat /sys/class/net/{SENDER_IF}/statistics/tx_packets")
+    return int(stdout or 0)
+
+def read_pkt_count(pkt_count):
+    """Allowed and blocked totals summed over every CPU"""
+    totals = []
+    for key in (0, 1):
+        value = pkt_count.lookup(struct.pack("=I", key)) or b""
+        totals.append(sum(v for (v,) in struct.iter_unpack("=Q", value)))
+    return totals
+
+def run_step(pkt_count, mix, blocklist_size, duration, pps, workers):
+    """Send from every worker at once and measure the far side"""
+    allowed_before, blocked_before = read_pkt_count(pkt_count)
+    tx_before = sender_tx_packets()
+    procs = []
+    for worker in range(workers):
+        cmd = ["ip", "netns", "exec", NETNS, sys.executable, os.path.abspath(__file__),
+               "--worker", SENDER_IF, "--mix", format_mix(mix),
+               "--blocklist-size", str(blocklist_size), "--seed", str(worker),
+               "--duration", str(duration), "--pps", str(pps // workers if pps else 0)]
+        procs.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True))
+
+    reports = []
+    for proc in procs:
+        stdout, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError("traffic worker failed")
+        reports.append(json.loads(stdout.strip().splitlines()[-1]))
+    allowed_after, blocked_after = read_pkt_count(pkt_count)
+
+    seconds = max(report["seconds"] for report in reports)
+    sent = sender_tx_packets() - tx_before
+    passed = allowed_after - allowed_before
+    dropped = blocked_after - blocked_before
+    return {
+        "blocklist_size": blocklist_size,
+        "seconds": seconds,
+        "sent_pps": sent / seconds,
+        "received_pps": (passed + dropped) / seconds,
+        "passed_pps": passed / seconds,
+        "dropped_pps": dropped / seconds,
+        # Sent but never seen by the filter, e.g. veth ring overflow
+        "lost": max(sent - passed - dropped, 0),
+    }
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in bench.PACKETS:
+            raise ValueError(kind)
+        mix[kind] = int(weight or 1)
+    if not mix or min(mix.values()) < 0 or not sum(mix.values()):
+        raise ValueError(text)
+    return mix
+
+def format_mix(mix):
+    return ",".join(f"{kind}={weight}" for kind, weight in mix.items())
+
+def print_results(results, mix):
+    print(f"\nMix: {format_mix(mix)}")
+    print(f"{'Blocklist':>10} {'Sent pps':>12} {'Received pps':>14} {'Passed pps':>12} "
+          f"{'Dropped pps':>12} {'Lost':>10}")
+    for r in results:
+        print(f"{r['blocklist_size']:>10,} {r['sent_pps']:>12,.0f} {r['received_pps']:>14,.0f} "
+              f"{r['passed_pps']:>12,.0f} {r['dropped_pps']:>12,.0f} {r['lost']:>10,}")
+
+def print_usage():
+    print("Usage: python3 traffic_gen.py [--sizes N,N,...] [--mix KIND=W,...] [--duration S] "
+          "[--pps N] [--workers N] [--mode native|generic] [--json]")
+    print("")
+    print(f"  --sizes N,...     Blocklist sizes, one step each (default: {','.join(map(str, DEFAULT_SIZES))})")
+    print(f"  --mix KIND=W,...  Packet mix weights over {', '.join(bench.PACKETS)} "
+          f"(default: {format_mix(DEFAULT_MIX)})")
+    print(f"  --duration S      Seconds per step (default: {DEFAULT_DURATION:g})")
+    print("  --pps N           Offered load in packets/sec (default: as fast as possible)")
+    print("  --workers N       Sender processes (default: 1)")
+    print("  --mode MODE       XDP attach mode on the veth (default: native)")
+    print("  --json            Print the curve as one JSON document")
+
+def main():
+    sizes = DEFAULT_SIZES
+    mix = DEFAULT_MIX
+    duration = DEFAULT_DURATION
+    pps = 0
+    workers = 1
+    mode = "native"
+    as_json = False
+    worker = None
+    blocklist_size = 0
+    seed = 0
+
+    args = sys.argv[1:]
+    try:
+        while args:
+            if args[0] == "--json":
+                as_json = True
+                args = args[1:]
+                continue
+            if args[0] == "--sizes" and len(args) > 1:
+                sizes = sorted(int(size) for size in args[1].split(","))
+            elif args[0] == "--mix" and len(args) > 1:
+                mix = parse_mix(args[1])
+            elif args[0] == "--duration" and len(args) > 1:
+                duration = float(args[1])
+            elif args[0] == "--pps" and len(args) > 1:
+                pps = int(args[1])
+            elif args[0] == "--workers" and len(args) > 1:
+                workers = int(args[1])
+            elif args[0] == "--mode" and len(args) > 1 and args[1] in ("native", "generic"):
+                mode = args[1]
+            # Internal: sender process started inside NETNS by run_step
+            elif args[0] == "--worker" and len(args) > 1:
+                worker = args[1]
+            elif args[0] == "--blocklist-size" and len(args) > 1:
+                blocklist_size = int(args[1])
+            elif args[0] == "--seed" and len(args) > 1:
+                seed = int(args[1])
+            else:
+                raise ValueError(args[0])
+            args = args[2:]
+    except ValueError:
+        print_usage()
+        sys.exit(1)
+    if not sizes or sizes[0] < 0 or duration <= 0 or pps < 0 or workers < 1:
+        print_usage()
+        sys.exit(1)
+
+    if worker:
+        run_worker(worker, mix, blocklist_size, seed, duration, pps)
+        return
+
+    from pyroute2 import IPRoute
+    from loader import attach_interface
+
+    if not bench.build_object(max(sizes[-1], 1024)):
+        sys.exit(1)
+    if not setup_topology():
+        sys.exit(1)
+    loaded = bench.load_object()
+    if not loaded:
+        bench.clear_pins()
+        teardown_topology()
+        sys.exit(1)
+    prog_fd, maps = loaded
+
+    results = []
+    error = None
+    ipr = IPRoute()
+    try:
+        idx = ipr.link_lookup(ifname=HOST_IF)[0]
+        # Attach progress goes to stderr so --json output stays parseable
+        with contextlib.redirect_stdout(sys.stderr):
+            attached = attach_interface(ipr, HOST_IF, idx, prog_fd, mode, fallback=mode == "native")
+        if not attached:
+            sys.exit(1)
+        bench.block_port(maps["port_bitmap"], bench.BLOCKED_PORT)
+        current = 0
+        for size in sizes:
+            if not as_json:
+                print(f"Blocklist {size:,}: sending for {duration:g}s...", file=sys.stderr)
+            bench.fill_blocklist(maps["blocked_ips"], size, current)
+            current = size
+            results.append(run_step(maps["pkt_count"], mix, size, duration, pps, workers))
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        error = e
+    finally:
+        ipr.close()
+        teardown_topology()
+        os.close(prog_fd)
+        for bpf_map in maps.values():
+            bpf_map.close()
+        bench.clear_pins()
+
+    if error:
+        print(f"Error: {error}", file=sys.stderr)
+        sys.exit(1)
+    if as_json:
+        meta = bench.run_metadata(mix=mix, duration=duration, pps=pps, workers=workers, mode=mode)
+        print(json.dumps({"meta": meta, "results": results}, indent=2))
+    else:
+        print_results(results, mix)
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,362 @@
 #include <linux/bpf.h>
 #include <linux/if_ether.h>
 #include <linux/ip.h>
+#include <linux/ipv6.h>
 #include <linux/tcp.h>
 #include <linux/udp.h>
 #include <linux/in.h>
 #include <bpf/bpf_helpers.h>
 #include <bpf/bpf_endian.h>
 
-// Map to count packets
+// Map to count packets (0: allowed, 1: blocked), one slot per CPU
 struct {
-    __uint(type, BPF_MAP_TYPE_ARRAY);
+    __uint(type, BPF_MAP_TYPE_PERCPU_ARRAY);
     __uint(max_entries, 2);
     __type(key, __u32);
     __type(value, __u64);
 } pkt_count SEC(".maps");
 
-// Map for blocked IPs
+#define PKT_ALLOWED 0
+#define PKT_BLOCKED 1
+
+static __always_inline void count_packet(__u32 key)
+{
+    __u64 *count = bpf_map_lookup_elem(&pkt_count, &key);
+    if (count) {
+        *count += 1;
+    }
+}
+
+// Capacity of blocked_ips, override at build time with -DMAX_BLOCKED_IPS=N
+#ifndef MAX_BLOCKED_IPS
+#define MAX_BLOCKED_IPS 1024
+#endif
+
+// Map for blocked IPs. The value is the expiry time in bpf_ktime_get_ns()
+// (CLOCK_MONOTONIC) nanoseconds, 0 for a permanent block. Expired entries
+// are ignored here and deleted later by the daemon's expiry scheduler.
+// This is the first generation; the program only reaches it through
+// blocklist_gen, so ip_manager.py can publish a replacement atomically.
+struct blocked_ips_map {
+    __uint(type, BPF_MAP_TYPE_HASH);
+    __uint(max_entries, MAX_BLOCKED_IPS);
+    __type(key, __u32);
+    __type(value, __u64);
+} blocked_ips SEC(".maps");
+
+// Active blocked_ips generation in slot 0
+struct {
+    __uint(type, BPF_MAP_TYPE_ARRAY_OF_MAPS);
+    __uint(max_entries, 1);
+    __type(key, __u32);
+    __array(values, struct blocked_ips_map);
+} blocklist_gen SEC(".maps") = {
+    .values = { [0] = &blocked_ips },
+};
+
+static __always_inline void *active_blocklist(void)
+{
+    __u32 key = 0;
+    return bpf_map_lookup_elem(&blocklist_gen, &key);
+}
+
+// Key for longest-prefix matches on IPv4 source addresses
+struct lpm_key_v4 {
+    __u32 prefixlen;
+    __u32 addr;
+};
+
+// Map for blocked CIDR ranges (exact addresses stay in blocked_ips)
+struct {
+    __uint(type, BPF_MAP_TYPE_LPM_TRIE);
+    __uint(max_entries, 1024);
+    __type(key, struct lpm_key_v4);
+    __type(value, __u8);
+    __uint(map_flags, BPF_F_NO_PREALLOC);
+} blocked_cidrs SEC(".maps");
+
+// Map for blocked IPv6 addresses, value as in blocked_ips
 struct {
     __uint(type, BPF_MAP_TYPE_HASH);
     __uint(max_entries, 1024);
-    __type(key, __u32);
+    __type(key, struct in6_addr);
+    __type(value, __u64);
+} blocked_ips6 SEC(".maps");
+
+// Key for longest-prefix matches on IPv6 source addresses
+struct lpm_key_v6 {
+    __u32 prefixlen;
+    struct in6_addr addr;
+};
+
+// Map for blocked IPv6 ranges such as /64s
+struct {
+    __uint(type, BPF_MAP_TYPE_LPM_TRIE);
+    __uint(max_entries, 1024);
+    __type(key, struct lpm_key_v6);
     __type(value, __u8);
-} blocked_ips SEC(".maps");
+    __uint(map_flags, BPF_F_NO_PREALLOC);
+} blocked_cidrs6 SEC(".maps");
+
+// Blocked destination ports: one 65536-bit bitmap per protocol, stored as
+// 1024 64-bit words each. Word (proto * 1024 + port / 64), bit port % 64.
+#define PORT_PROTO_TCP 0
+#define PORT_PROTO_UDP 1
+#define PORT_WORDS 1024
+
+struct {
+    __uint(type, BPF_MAP_TYPE_ARRAY);
+    __uint(max_entries, 2 * PORT_WORDS);
+    __type(key, __u32);
+    __type(value, __u64);
+} port_bitmap SEC(".maps");
+
+static __always_inline int port_blocked(__u32 proto, __u16 port)
+{
+    __u32 key = proto * PORT_WORDS + (port >> 6);
+    __u64 *word = bpf_map_lookup_elem(&port_bitmap, &key);
+    return word && (*word >> (port & 63)) & 1;
+}
+
+// Why a packet was dropped, reported in drop events
+#define DROP_BLOCKED_IP   1
+#define DROP_BLOCKED_PORT 2
+#define DROP_RATE_LIMIT   3
+
+// Structured drop event streamed to user space
+struct drop_event {
+    __u64 timestamp;    // bpf_ktime_get_ns()
+    __u8 src_addr[16];  // network byte order, IPv4 uses the first 4 bytes
+    __u16 dst_port;     // host byte order, 0 if not TCP/UDP
+    __u8 protocol;      // IPv4 protocol or IPv6 next header
+    __u8 reason;
+    __u8 family;        // 4 or 6
+    __u8 pad[3];
+};
+
+// Ring buffer carrying sampled drop events
+struct {
+    __uint(type, BPF_MAP_TYPE_RINGBUF);
+    __uint(max_entries, 256 * 1024);
+} drop_events SEC(".maps");
+
+// Drop event sampling: report 1 in N drops, 0 disables events
+struct {
+    __uint(type, BPF_MAP_TYPE_ARRAY);
+    __uint(max_entries, 1);
+    __type(key, __u32);
+    __type(value, __u32);
+} event_sampling SEC(".maps");
+
+// Dropped traffic per source
+struct src_stat {
+    __u64 packets;
+    __u64 bytes;
+};
+
+// Per-source drop counters, least recently seen sources are evicted
+struct {
+    __uint(type, BPF_MAP_TYPE_LRU_PERCPU_HASH);
+    __uint(max_entries, 16384);
+    __type(key, __u32);
+    __type(value, struct src_stat);
+} src_stats SEC(".maps");
+
+static __always_inline void count_source(__u32 src_ip, __u64 bytes)
+{
+    struct src_stat *stat = bpf_map_lookup_elem(&src_stats, &src_ip);
+    if (stat) {
+        // Per-CPU value, no atomics needed
+        stat->packets += 1;
+        stat->bytes += bytes;
+        return;
+    }
+    
+    struct src_stat first = {
+        .packets = 1,
+        .bytes = bytes,
+    };
+    bpf_map_update_elem(&src_stats, &src_ip, &first, BPF_NOEXIST);
+}
+
+static __always_inline void report_drop(__u8 family, const void *src, __u8 protocol,
+                                        void *l4, void *data_end, __u8 reason)
+{
+    __u32 key = 0;
+    __u32 *rate = bpf_map_lookup_elem(&event_sampling, &key);
+    if (!rate || *rate == 0)
+        return;
+    if (*rate > 1 && bpf_get_prandom_u32() % *rate)
+        return;
+    
+    struct drop_event *event = bpf_ringbuf_reserve(&drop_events, sizeof(*event), 0);
+    if (!event)
+        return;
+    
+    // Reserved ring buffer memory is not zeroed
+    __builtin_memset(event, 0, sizeof(*event));
+    event->timestamp = bpf_ktime_get_ns();
+    if (family == 6)
+        __builtin_memcpy(event->src_addr, src, 16);
+    else
+        __builtin_memcpy(event->src_addr, src, 4);
+    event->protocol = protocol;
+    event->reason = reason;
+    event->family = family;
+    
+    // TCP and UDP both start with source and destination ports
+    if (protocol == IPPROTO_TCP || protocol == IPPROTO_UDP) {
+        struct udphdr *ports = l4;
+        if ((void *)(ports + 1) <= data_end)
+            event->dst_port = bpf_ntohs(ports->dest);
+    }
+    
+    bpf_ringbuf_submit(event, 0);
+}
+
+#define NSEC_PER_SEC 1000000000ULL
+
+// Per-source rate limit, a rate of 0 leaves that dimension unlimited
+struct rate_limit {
+    __u64 pps;              // packets per second
+    __u64 pps_burst;        // bucket size in packets
+    __u64 bps;              // bytes per second
+    __u64 bps_burst;        // bucket size in bytes
+    __u64 promote_after;    // over-budget packets before the source is
+                            // added to blocked_ips, 0 never promotes
+};
+
+// Rate limit configuration, written by ip_manager.py
+struct {
+    __uint(type, BPF_MAP_TYPE_ARRAY);
+    __uint(max_entries, 1);
+    __type(key, __u32);
+    __type(value, struct rate_limit);
+} rate_config SEC(".maps");
+
+// Token buckets of one source. Tokens are scaled by NSEC_PER_SEC so that
+// refilling at nanosecond resolution never rounds partial tokens away.
+struct rate_bucket {
+    __u64 last_ns;
+    __u64 packet_tokens;
+    __u64 byte_tokens;
+    __u64 dropped;          // packets over budget
+};
+
+// Token buckets per source, least recently seen sources are evicted.
+// Updates from different CPUs are not serialized; a lost refill or
+// charge only makes the limit slightly approximate.
+struct {
+    __uint(type, BPF_MAP_TYPE_LRU_HASH);
+    __uint(max_entries, 65536);
+    __type(key, __u32);
+    __type(value, struct rate_bucket);
+} rate_state SEC(".maps");
+
+static __always_inline __u64 refill(__u64 tokens, __u64 elapsed, __u64 rate, __u64 burst)
+{
+    __u64 cap = burst * NSEC_PER_SEC;
+    if (tokens >= cap)
+        return cap;
+    // Compare against the time needed to fill up before multiplying,
+    // so long idle periods cannot overflow
+    if (elapsed >= (cap - tokens) / rate)
+        return cap;
+    return tokens + elapsed * rate;
+}
+
+// Returns 1 if the packet is within the source's budget
+static __always_inline int rate_allow(__u32 src_ip, __u64 bytes)
+{
+    __u32 key = 0;
+    struct rate_limit *limit = bpf_map_lookup_elem(&rate_config, &key);
+    if (!limit || (limit->pps == 0 && limit->bps == 0))
+        return 1;
+    
+    __u64 now = bpf_ktime_get_ns();
+    struct rate_bucket *bucket = bpf_map_lookup_elem(&rate_state, &src_ip);
+    if (!bucket) {
+        // New source starts with full buckets
+        struct rate_bucket fresh = {
+            .last_ns = now,
+            .packet_tokens = limit->pps_burst * NSEC_PER_SEC,
+            .byte_tokens = limit->bps_burst * NSEC_PER_SEC,
+        };
+        bpf_map_update_elem(&rate_state, &src_ip, &fresh, BPF_NOEXIST);
+        bucket = bpf_map_lookup_elem(&rate_state, &src_ip);
+        if (!bucket)
+            return 1;
+    }
+    
+    __u64 elapsed = now > bucket->last_ns ? now - bucket->last_ns : 0;
+    bucket->last_ns = now;
+    
+    __u64 packet_cost = limit->pps ? NSEC_PER_SEC : 0;
+    __u64 byte_cost = limit->bps ? bytes * NSEC_PER_SEC : 0;
+    if (limit->pps)
+        bucket->packet_tokens = refill(bucket->packet_tokens, elapsed,
+                                       limit->pps, limit->pps_burst);
+    if (limit->bps)
+        bucket->byte_tokens = refill(bucket->byte_tokens, elapsed,
+                                     limit->bps, limit->bps_burst);
+    
+    // Only charge when both budgets can pay
+    if (bucket->packet_tokens >= packet_cost && bucket->byte_tokens >= byte_cost) {
+        bucket->packet_tokens -= packet_cost;
+        bucket->byte_tokens -= byte_cost;
+        return 1;
+    }
+    
+    bucket->dropped += 1;
+    if (limit->promote_after && bucket->dropped == limit->promote_after) {
+        // Persistent offender: block it outright from now on
+        __u64 permanent = 0;
+        void *blocklist = active_blocklist();
+        if (blocklist)
+            bpf_map_update_elem(blocklist, &src_ip, &permanent, BPF_ANY);
+    }
+    return 0;
+}
+
+// IPv6 path: blocked addresses and ranges, then blocked ports. Extension
+// headers are not walked, so ports are only checked when TCP or UDP
+// directly follows the fixed header. Rate limits and per-source counters
+// cover IPv4 only.
+static __always_inline int filter_ipv6(struct ipv6hdr *ip6, void *data_end)
+{
+    struct in6_addr src = ip6->saddr;
+    
+    int blocked = 0;
+    __u64 *expiry = bpf_map_lookup_elem(&blocked_ips6, &src);
+    if (expiry)
+        blocked = *expiry == 0 || *expiry > bpf_ktime_get_ns();
+    if (!blocked) {
+        struct lpm_key_v6 lpm_key = {
+            .prefixlen = 128,
+            .addr = src,
+        };
+        if (bpf_map_lookup_elem(&blocked_cidrs6, &lpm_key))
+            blocked = 1;
+    }
+    if (blocked) {
+        count_packet(PKT_BLOCKED);
+        report_drop(6, &src, ip6->nexthdr, ip6 + 1, data_end, DROP_BLOCKED_IP);
+        return XDP_DROP;
+    }
+    
+    if (ip6->nexthdr == IPPROTO_TCP || ip6->nexthdr == IPPROTO_UDP) {
+        struct udphdr *l4 = (void *)(ip6 + 1);
+        __u32 proto = ip6->nexthdr == IPPROTO_TCP ? PORT_PROTO_TCP : PORT_PROTO_UDP;
+        if ((void *)(l4 + 1) <= data_end && port_blocked(proto, bpf_ntohs(l4->dest))) {
+            count_packet(PKT_BLOCKED);
+            report_drop(6, &src, ip6->nexthdr, l4, data_end, DROP_BLOCKED_PORT);
+            return XDP_DROP;
+        }
+    }
+    
+    count_packet(PKT_ALLOWED);
+    return XDP_PASS;
+}
 
 SEC("xdp")
 int xdp_filter_func(struct xdp_md *ctx)
@@ -35,6 +370,13 @@ int xdp_filter_func(struct xdp_md *ctx)
     if ((void *)(eth + 1) > data_end)
         return XDP_PASS;
     
+    if (eth->h_proto == bpf_htons(ETH_P_IPV6)) {
+        struct ipv6hdr *ip6 = (void *)(eth + 1);
+        if ((void *)(ip6 + 1) > data_end)
+            return XDP_PASS;
+        return filter_ipv6(ip6, data_end);
+    }
+    
     // Only process IP packets
     if (eth->h_proto != bpf_htons(ETH_P_IP))
         return XDP_PASS;
@@ -47,39 +389,54 @@ int xdp_filter_func(struct xdp_md *ctx)
     
     __u32 src_ip = ip->saddr;
     
-    // Check if IP is blocked
-    __u8 *blocked = bpf_map_lookup_elem(&blocked_ips, &src_ip);
+    // Check if IP is blocked, exact matches first, then CIDR ranges
+    int blocked = 0;
+    __u64 *expiry = NULL;
+    void *blocklist = active_blocklist();
+    if (blocklist)
+        expiry = bpf_map_lookup_elem(blocklist, &src_ip);
+    if (expiry)
+        blocked = *expiry == 0 || *expiry > bpf_ktime_get_ns();
+    if (!blocked) {
+        struct lpm_key_v4 lpm_key = {
+            .prefixlen = 32,
+            .addr = src_ip,
+        };
+        if (bpf_map_lookup_elem(&blocked_cidrs, &lpm_key))
+            blocked = 1;
+    }
     if (blocked) {
         // Increment blocked packet counter
-        __u32 key = 1;
-        __u64 *count = bpf_map_lookup_elem(&pkt_count, &key);
-        if (count) {
-            __sync_fetch_and_add(count, 1);
-        }
-        
-        bpf_printk("Blocked packet from IP: %x\n", bpf_ntohl(src_ip));
+        count_packet(PKT_BLOCKED);
+        count_source(src_ip, data_end - data);
+        report_drop(4, &src_ip, ip->protocol, ip + 1, data_end, DROP_BLOCKED_IP);
         return XDP_DROP;
     }
     
-    // Increment allowed packet counter
-    __u32 key = 0;
-    __u64 *count = bpf_map_lookup_elem(&pkt_count, &key);
-    if (count) {
-        __sync_fetch_and_add(count, 1);
+    // Sources over their rate budget count as blocked
+    if (!rate_allow(src_ip, data_end - data)) {
+        count_packet(PKT_BLOCKED);
+        count_source(src_ip, data_end - data);
+        report_drop(4, &src_ip, ip->protocol, ip + 1, data_end, DROP_RATE_LIMIT);
+        return XDP_DROP;
     }
     
-    // Example: Block TCP port 8080
-    if (ip->protocol == IPPROTO_TCP) {
-        struct tcphdr *tcp = (void *)(ip + 1);
-        if ((void *)(tcp + 1) > data_end)
-            return XDP_PASS;
-        
-        if (bpf_ntohs(tcp->dest) == 8080) {
-            bpf_printk("Blocked TCP packet to port 8080\n");
+    // Blocked destination ports, configured per protocol in port_bitmap
+    if (ip->protocol == IPPROTO_TCP || ip->protocol == IPPROTO_UDP) {
+        // TCP and UDP both start with source and destination ports
+        struct udphdr *l4 = (void *)(ip + 1);
+        __u32 proto = ip->protocol == IPPROTO_TCP ? PORT_PROTO_TCP : PORT_PROTO_UDP;
+        if ((void *)(l4 + 1) <= data_end && port_blocked(proto, bpf_ntohs(l4->dest))) {
+            count_packet(PKT_BLOCKED);
+            count_source(src_ip, data_end - data);
+            report_drop(4, &src_ip, ip->protocol, ip + 1, data_end, DROP_BLOCKED_PORT);
             return XDP_DROP;
         }
     }
     
+    // Increment allowed packet counter
+    count_packet(PKT_ALLOWED);
+    
     return XDP_PASS;
 }
 
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Live top-style view of the XDP filter
+Holds the filter's maps open in one process and turns successive counter
+reads into packet rates, drop ratio and the heaviest dropped sources
+"""
+
+import os
+import sys
+import time
+import curses
+
+import bpf_syscall
+from ip_manager import XDPIPManager, BLOCKLIST_MAPS, source_rates, heaviest_sources
+
+DEFAULT_INTERVAL = 1.0
+# Counting the blocklist walks every entry, so it runs on its own slower interval
+DEFAULT_COUNT_INTERVAL = 10.0
+DEFAULT_TOP = 10
+
+def counter_delta(current, previous):
+    """Increase of a counter, counting from zero if it went back (program reloaded)"""
+    return current - previous if current >= previous else current
+
+class Sampler:
+    """Reads the counters of the loaded filter and computes rates between reads.
+
+    The manager keeps every map open through the bpf() syscall backend, so
+    a refresh costs a few syscalls and no subprocess. When loader.py loads
+    a new program the maps are reopened and the rates start over.
+    """
+
+    def __init__(self, manager, count_interval=DEFAULT_COUNT_INTERVAL):
+        self.manager = manager
+        self.count_interval = count_interval
+        self.previous = None
+        self.blocklist = {}
+        self.counted_at = None
+        self.prog_id = None
+        self.stats_fd = None
+        try:
+            self.stats_fd = bpf_syscall.enable_stats()
+        except OSError:
+            pass
+
+    def close(self):
+        if self.stats_fd is not None:
+            os.close(self.stats_fd)
+        self.manager.close()
+
+    def program(self):
+        """(id, fd) of the loaded program, starting the rates over when it is replaced"""
+        prog = self.manager.loaded_program()
+        if prog and prog[0] != self.prog_id:
+            if self.prog_id is not None:
+                # A fresh load may have created new maps
+                self.previous = None
+                self.counted_at = None
+            self.prog_id = prog[0]
+        return prog
+
+    def count_blocklist(self, now):
+        """Refresh {name: (entries, max_entries)} once per count interval"""
+        if self.counted_at is not None and now - self.counted_at < self.count_interval:
+            return
+        self.manager.refresh_blocklist()
+        self.blocklist = self.manager.get_occupancy(BLOCKLIST_MAPS)
+        self.counted_at = now
+
+    def read(self):
+        """One raw reading of every counter, or None if pkt_count is unavailable"""
+        prog = self.program()
+        stats = self.manager.get_stats()
+        if stats is None:
+            return None
+        now = time.monotonic()
+        reading = {"time": now, "prog_id": prog[0] if prog else None,
+                   "allowed": stats["allowed"], "blocked": stats["blocked"],
+                   "sources": self.manager.get_source_stats() or {},
+                   "run_stats": None}
+        if prog and self.stats_fd is not None:
+            reading["run_stats"] = bpf_syscall.prog_run_stats(prog[1])
+        self.count_blocklist(now)
+        return reading
+
+    def sample(self):
+        """Read the counters and return a frame of rates since the previous read.
+
+        Rates are None in the first frame, which only sets the baseline.
+        Returns None if pkt_count is unavailable.
+        """
+        current = self.read()
+        if current is None:
+            self.previous = None
+            return None
+        previous, self.previous = self.previous, current
+
+        frame = {"prog_id": current["prog_id"], "elapsed": None,
+                 "allowed": sum(current["allowed"]), "blocked": sum(current["blocked"]),
+                 "allowed_pps": None, "blocked_pps": None, "cpu_pps": None,
+                 "ns_per_packet": None, "sources": [],
+                 "blocklist": self.blocklist,
+                 "counted_ago": current["time"] - self.counted_at}
+        if previous is None:
+            return frame
+
+        elapsed = current["time"] - previous["time"]
+        deltas = {name: [counter_delta(cur, prev)
+                         for cur, prev in zip(current[name], previous[name])]
+                  for name in ("allowed", "blocked")}
+        frame["elapsed"] = elapsed
+        frame["allowed_pps"] = sum(deltas["allowed"]) / elapsed
+        frame["blocked_pps"] = sum(deltas["blocked"]) / elapsed
+        frame["cpu_pps"] = [(allowed + blocked) / elapsed
+                            for allowed, blocked in zip(deltas["allowed"], deltas["blocked"])]
+        frame["sources"] = source_rates(previous["sources"], current["sources"], elapsed)
+        if current["run_stats"] and previous["run_stats"]:
+            run_time = counter_delta(current["run_stats"][0], previous["run_stats"][0])
+            runs = counter_delta(current["run_stats"][1], previous["run_stats"][1])
+            frame["ns_per_packet"] = run_time / runs if runs else None
+        return frame
+
+def format_rate(value):
+    """Compact rate: 950, 12.3k, 4.56M"""
+    for unit, scale in (("G", 1e9), ("M", 1e6), ("k", 1e3)):
+        if value >= scale:
+            return f"{value / scale:.3g}{unit}"
+    return f"{value:.0f}"
+
+def render(frame, manager, top=DEFAULT_TOP, by="packets", interval=DEFAULT_INTERVAL):
+    """Lines of text for one frame"""
+    clock = time.strftime("%H:%M:%S")
+    if frame is None:
+        return [f"xdp-top  {clock}", "",
+                "Error: Could not find pkt_count BPF map",
+                "Make sure XDP program is loaded"]
+
+    prog = f"prog {frame['prog_id']}" if frame["prog_id"] is not None else "prog ?"
+    lines = [f"xdp-top  {prog}  every {interval:g}s  sources by {by}  {clock}", ""]
+
+    if frame["elapsed"] is None:
+        lines.append("Packets/s   measuring...")
+    else:
+        total_pps = frame["allowed_pps"] + frame["blocked_pps"]
+        ratio = frame["blocked_pps"] / total_pps if total_pps else 0
+        line = (f"Packets/s   {format_rate(total_pps):>7}  allowed {format_rate(frame['allowed_pps']):>7}"
+                f"  dropped {format_rate(frame['blocked_pps']):>7}  drop ratio {ratio:.1%}")
+        if total_pps and len(frame["cpu_pps"]) > 1:
+            busiest = max(range(len(frame["cpu_pps"])), key=frame["cpu_pps"].__getitem__)
+            line += f"  busiest CPU {busiest} {frame['cpu_pps'][busiest] / total_pps:.0%}"
+        lines.append(line)
+
+    total = frame["allowed"] + frame["blocked"]
+    lines.append(f"Totals      allowed {frame['allowed']:,}  dropped {frame['blocked']:,}"
+                 + (f"  ({frame['blocked'] / total:.2%} dropped)" if total else ""))
+    if frame["ns_per_packet"] is not None:
+        lines.append(f"Program     {frame['ns_per_packet']:.0f} ns per packet")
+
+    if frame["blocklist"]:
+        parts = [f"{name} {entries:,}/{max_entries:,}"
+                 for name, (entries, max_entries) in frame["blocklist"].items()]
+        lines.append(f"Blocklist   {'  '.join(parts)}  (counted {frame['counted_ago']:.0f}s ago)")
+
+    lines.append("")
+    rows = heaviest_sources(frame["sources"], top, by)
+    if frame["elapsed"] is not None and not any(row[1] or row[2] for row in rows):
+        lines.append("No sources dropped in the last interval")
+    else:
+        lines.append(f"  {'Dropped source':<15} {'Packets/s':>10} {'Bytes/s':>10} "
+                     f"{'Packets':>14} {'Bytes':>16}")
+        for key, pps, bps, packets, nbytes in rows:
+            lines.append(f"  {manager.key_to_ip(key):<15} {format_rate(pps):>10} "
+                         f"{format_rate(bps):>10} {packets:>14,} {nbytes:>16,}")
+    return lines
+
+def run_curses(sampler, interval, top, by):
+    """Redraw every interval until q is pressed; s switches the source ordering"""
+
+    def loop(screen):
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+        order = by
+        frame = sampler.sample()
+        next_sample = time.monotonic() + interval
+        while True:
+            height, width = screen.getmaxyx()
+            screen.erase()
+            lines = render(frame, sampler.manager, top, order, interval)
+            lines += ["", "q quit  s sort by packets/bytes"]
+            for row, line in enumerate(lines[:height - 1]):
+                screen.addnstr(row, 0, line, width - 1)
+            screen.refresh()
+
+            screen.timeout(max(int((next_sample - time.monotonic()) * 1000), 0))
+            key = screen.getch()
+            if key in (ord("q"), 27):
+                return
+            if key == ord("s"):
+                order = "bytes" if order == "packets" else "packets"
+            if time.monotonic() >= next_sample:
+                frame = sampler.sample()
+                next_sample = max(next_sample + interval, time.monotonic())
+
+    curses.wrapper(loop)
+
+def run_batch(sampler, interval, top, by, iterations):
+    """Print a frame every interval, for terminals without curses and for logs"""
+    sampler.sample()
+    printed = 0
+    while not iterations or printed < iterations:
+        time.sleep(interval)
+        print("\n".join(render(sampler.sample(), sampler.manager, top, by, interval)))
+        print("", flush=True)
+        printed += 1
+
+def print_usage():
+    print("Usage: python3 xdp_top.py [--interval SECONDS] [--count-interval SECONDS] "
+          "[--top N] [--by packets|bytes] [--batch [--iterations N]]")
+    print("")
+    print(f"  --interval SECONDS       Refresh interval (default: {DEFAULT_INTERVAL})")
+    print(f"  --count-interval SECONDS Blocklist size refresh interval (default: {DEFAULT_COUNT_INTERVAL})")
+    print(f"  --top N                  Dropped sources to show (default: {DEFAULT_TOP})")
+    print("  --by packets|bytes       Order sources by packet or byte rate (default: packets)")
+    print("  --batch                  Print frames instead of drawing the screen")
+    print("  --iterations N           Frames to print in batch mode (default: until Ctrl+C)")
+
+def main():
+    interval = DEFAULT_INTERVAL
+    count_interval = DEFAULT_COUNT_INTERVAL
+    top = DEFAULT_TOP
+    by = "packets"
+    batch = False
+    iterations = 0
+
+    args = sys.argv[1:]
+    try:
+        while args:
+            if args[0] == "--batch":
+                batch = True
+                args = args[1:]
+                continue
+            if args[0] == "--interval" and len(args) > 1:
+                interval = float(args[1])
+            elif args[0] == "--count-interval" and len(args) > 1:
+                count_interval = float(args[1])
+            elif args[0] == "--top" and len(args) > 1:
+                top = int(args[1])
+            elif args[0] == "--by" and len(args) > 1 and args[1] in ("packets", "bytes"):
+                by = args[1]
+            elif args[0] == "--iterations" and len(args) > 1:
+                iterations = int(args[1])
+            else:
+                raise ValueError(args[0])
+            args = args[2:]
+    except ValueError:
+        print_usage()
+        sys.exit(1)
+    if interval <= 0 or count_interval <= 0 or top < 0 or iterations < 0:
+        print_usage()
+        sys.exit(1)
+
+    try:
+        # Only the syscall backend keeps maps open between reads
+        sampler = Sampler(XDPIPManager(backend="syscall"), count_interval)
+    except (ImportError, OSError) as e:
+        print(f"Error: cannot use the bpf() syscall: {e}")
+        sys.exit(1)
+    if not batch and not sys.stdout.isatty():
+        batch = True
+    try:
+        if batch:
+            run_batch(sampler, interval, top, by, iterations)
+        else:
+            run_curses(sampler, interval, top, by)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.close()
+
+if __name__ == "__main__":
+    main()